@@ -1,12 +1,13 @@
-from nonebot import on_message
-from nonebot.adapters.onebot.v11 import MessageEvent, MessageSegment
+from nonebot import on_message, on_notice, get_bot, get_driver
+from nonebot.adapters.onebot.v11 import (
+    Bot, MessageEvent, MessageSegment, NoticeEvent, GroupIncreaseNoticeEvent, GroupDecreaseNoticeEvent
+)
 from nonebot.exception import IgnoredException, FinishedException
 from nonebot.rule import Rule
 from .commands.prompt import get_all_prompts
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Union, Callable
+from typing import Any, Dict, List, Optional, Set, Union, Callable
 from nonebot.adapters.onebot.v11 import MessageEvent
-import requests
 import asyncio
 import os
 import json
@@ -14,110 +15,128 @@ import random
 import time
 from .commands import handle_command
 from .commands.reply import is_reply_enabled, is_active_mode
-from .commands.model import get_current_model
-from .commands.memory import get_memory_key, get_memory_content, update_memory, update_memory_chat
+from .commands.model import get_current_model, get_context_budget
+from .commands.memory import get_memory_key, get_memory_content, update_memory, update_memory_chat, set_summary_params_provider, init_memory, preload_recent_memories, resume_summary_jobs, shutdown_memory
 from .commands.split import is_split_enabled, get_split_prompt, split_text
 from .utils.logger import get_logger
+from .utils.tokens import estimate_tokens
+from .utils.message_index import get_message_index
+from .utils.ingest_filter import abbreviate_media
+from .utils.member_cache import member_cache
 from .utils.config import config_manager
+from .utils.state_backend import get_state_backend
+from .utils.chat_state import get_chat_state
+from .utils.http import get_session, warm_up_connection
+from .utils.disk_io import run_io, submit_io, get_disk_executor
 
 # ==================== 配置加载逻辑 ====================
+# 导入插件时不写入磁盘：数据目录和默认配置文件在启动时创建，其余目录在首次写入时创建
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 
 # 初始化日志记录器
 ai_logger = get_logger(DATA_DIR)  # 使用数据目录初始化日志记录器
 
-# 确保数据目录存在
-os.makedirs(DATA_DIR, exist_ok=True)
+# 消息ID索引，用于解析用户回复/引用的消息
+message_index = get_message_index(DATA_DIR)
+message_index.background = submit_io  # 批量写入在磁盘线程池中执行，不阻塞事件循环
+QUOTE_MAX_LENGTH = 100  # 引用内容插入提示词时的最大字数
 
-# 使用配置管理器
-from .utils.config import config_manager
+# 群成员列表的后台拉取任务，避免同一个群重复拉取
+member_refresh_tasks: Dict[str, asyncio.Task] = {}
+MEMBER_FETCH_TIMEOUT = 3  # 首次遇到@未知成员时等待拉取成员列表的最长时间（秒）
 
-# 默认配置
-DEFAULT_CORE_CONFIG = {
-    "api_keys": {
-        "gemini": "",
-        "deepseek": ""
-    },
-    "models": {
-        "gemini": "gemini-2.5-pro",
-        "deepseek": "deepseek-chat"
-    },
-    "urls": {
-        "gemini": "https://generativelanguage.googleapis.com/v1/models/{model}:generateContent?key={key}",
-        "deepseek": "https://api.deepseek.com/v1/chat/completions"
-    },
-    "proxies": {},
-    "rate_limit": {
-        "gemini_cooldown": 15,
-        "deepseek_cooldown": 2,
-        "global_qps_limit": 2
-    }
-}
+# 正在处理的消息（事件任务），退出时等待其完成；accepting 为 False 后不再处理新消息
+inflight_tasks: Set[asyncio.Task] = set()
+accepting = True
+
+async def initialize_on_startup():
+    """启动时创建缺失的默认配置文件，连接共享状态后端，并开始监视配置文件的修改"""
+    config_manager.initialize()
+    # 配置了共享状态后端时，多个进程使用同一份配置
+    config_manager.attach_backend(get_state_backend())
+    # 创建聊天状态存储（首次创建时迁移旧版配置中的聊天状态，需要读写配置文件）
+    await run_io(get_chat_state)
+    init_memory()
+    resume_summary_jobs()
+    # 配置文件被修改后自动重新加载
+    reload_interval = config_manager.get_value("config.json", "config_reload_interval", 5)
+    if reload_interval > 0:
+        config_manager.start_watcher(reload_interval)
+    # 预热完成或超时后启动钩子才返回，之后才开始接收消息
+    warmup = config_manager.get_value("config.json", "warmup", {}) or {}
+    if warmup.get("enabled", True):
+        try:
+            await asyncio.wait_for(warm_up(warmup.get("chats", 50), warmup.get("timeout", 15)), warmup.get("timeout", 15))
+        except asyncio.TimeoutError:
+            print(f"启动预热超过 {warmup.get('timeout', 15)} 秒，跳过未完成的部分")
+
+async def warm_up(chats: int, timeout: float) -> None:
+    """启动预热：建立到已配置密钥的模型服务的连接（放入连接池），加载最近活跃聊天的记忆"""
+    snapshot = config_manager.snapshot()
+    urls = [provider.url for provider in (snapshot.gemini, snapshot.deepseek) if provider.api_key]
+    start = time.perf_counter()
+    loaded, *connections = await asyncio.gather(
+        preload_recent_memories(chats),
+        *(asyncio.to_thread(warm_up_connection, url, get_proxies(), timeout) for url in urls)
+    )
+    print(
+        f"启动预热完成（{(time.perf_counter() - start) * 1000:.0f}ms）：已加载 {loaded} 个聊天的记忆"
+        + (f"，连接 {'；'.join(connections)}" if connections else "")
+    )
 
-# 确保配置管理器完全初始化并加载配置
-config_manager.initialize()
+async def drain_on_shutdown():
+    """退出前：停止处理新消息，等待正在生成的回复和记忆写入完成（最多 shutdown_timeout 秒），
+    保存未完成的后台总结任务，并写入所有缓冲中的记忆、配置和消息索引"""
+    global accepting
+    accepting = False
+    timeout = config_manager.get_value("config.json", "shutdown_timeout", 20)
+    deadline = time.monotonic() + timeout
+    if inflight_tasks:
+        print(f"等待 {len(inflight_tasks)} 条正在处理的消息完成（最多 {timeout} 秒）")
+        _, unfinished = await asyncio.wait(set(inflight_tasks), timeout=timeout)
+        if unfinished:
+            print(f"{len(unfinished)} 条消息未在 {timeout} 秒内处理完成，已放弃")
+    await shutdown_memory(max(deadline - time.monotonic(), 0))
+    await run_io(message_index.flush)
+    config_manager.stop_watcher()
+    await run_io(config_manager.flush)
+    # 写入日志队列中剩余的记录，等待已提交的后台写入（消息索引）完成
+    await run_io(ai_logger.close)
+    await asyncio.to_thread(get_disk_executor().shutdown)
 
-# 从配置管理器加载核心配置
-# 为了获取整个配置对象，我们使用load_config方法而不是get_value
-CORE_CONFIG = config_manager.load_config("core_config.json")
+# 以 python -m 运行 tools 下的离线工具时会导入插件包，此时 NoneBot 未初始化，不注册启动/退出钩子
+try:
+    driver = get_driver()
+except ValueError:
+    driver = None
+if driver is not None:
+    driver.on_startup(initialize_on_startup)
+    driver.on_shutdown(drain_on_shutdown)
 # ========================================================
 
 # ==================== 配置参数管理 ====================
-USER_REQUEST_CACHE: Dict[str, datetime] = {}
-GLOBAL_REQUEST_CACHE: Dict[str, int] = {"count": 0, "last_reset": datetime.now()}
 
 # 动态获取配置的辅助函数
+# 以下配置均从配置快照读取（配置变化后自动重建），见 utils/config.py 中的 ConfigSnapshot
 def get_gemini_config() -> Dict:
-    """动态获取Gemini相关配置"""
-    api_key = config_manager.get_value("core_config.json", "api_keys.gemini", default="")
-    # 获取当前设置的模型
-    current_model = get_current_model()
-    # 如果当前模型是Gemini系列，直接使用当前模型
-    if current_model.startswith("gemini"):
-        model = current_model
-    else:
-        # 否则使用默认的Gemini模型
-        model = config_manager.get_value("core_config.json", "models.gemini", default="gemini-2.5-pro")
-    url_template = config_manager.get_value("core_config.json", "urls.gemini", 
-                                         default="https://generativelanguage.googleapis.com/v1/models/{model}:generateContent?key={key}")
-    url = url_template.format(model=model, key=api_key)
-    return {"api_key": api_key, "model": model, "url": url}
+    """动态获取Gemini相关配置（当前模型为Gemini系列时使用当前模型，否则使用默认的Gemini模型）"""
+    return config_manager.snapshot().gemini._asdict()
 
 def get_deepseek_config() -> Dict:
-    """动态获取DeepSeek相关配置"""
-    api_key = config_manager.get_value("core_config.json", "api_keys.deepseek", default="")
-    # 获取当前设置的模型
-    current_model = get_current_model()
-    # 如果当前模型是DeepSeek系列，直接使用当前模型
-    if current_model.startswith("deepseek"):
-        model = current_model
-    else:
-        # 否则使用默认的DeepSeek模型
-        model = config_manager.get_value("core_config.json", "models.deepseek", default="deepseek-chat")
-    url = config_manager.get_value("core_config.json", "urls.deepseek", 
-                                 default="https://api.deepseek.com/v1/chat/completions")
-    return {"api_key": api_key, "model": model, "url": url}
+    """动态获取DeepSeek相关配置（当前模型为DeepSeek系列时使用当前模型，否则使用默认的DeepSeek模型）"""
+    return config_manager.snapshot().deepseek._asdict()
 
 def get_proxies() -> Dict:
-    """动态获取代理配置"""
-    return config_manager.get_value("core_config.json", "proxies", default={})
+    """动态获取代理配置（返回副本，requests会向其中补充环境变量中的代理）"""
+    return dict(config_manager.snapshot().proxies)
 
 def get_cooldown_for_model(model_id: str) -> timedelta:
-    """根据模型ID获取对应的冷却时间"""
-    # 首先尝试从model_config.json的cooldowns中获取特定模型的冷却时间
-    specific_cooldown = config_manager.get_value("model_config.json", f"cooldowns.{model_id}")
-    if specific_cooldown is not None:
-        return timedelta(seconds=specific_cooldown)
-    
-    # 如果没有特定配置，则根据模型类型使用默认值
-    if model_id.startswith("gemini"):
-        return timedelta(seconds=config_manager.get_value("core_config.json", "rate_limit.gemini_cooldown", default=15))
-    else:  # deepseek模型
-        return timedelta(seconds=config_manager.get_value("core_config.json", "rate_limit.deepseek_cooldown", default=2))
+    """根据模型ID获取对应的冷却时间：优先使用model_config.json中单独配置的，否则按模型类型使用默认值"""
+    return timedelta(seconds=config_manager.snapshot().cooldown(model_id))
 
 def get_global_qps_limit() -> int:
     """动态获取全局QPS限制"""
-    return config_manager.get_value("core_config.json", "rate_limit.global_qps_limit", default=2)
+    return config_manager.snapshot().global_qps_limit
 # ========================================================
 
 def is_allowed() -> Rule:
@@ -129,30 +148,22 @@ def is_allowed() -> Rule:
 ai_chat = on_message(rule=is_allowed(), priority=5)
 
 async def handle_rate_limit(user_id: str) -> float:
-    now = datetime.now()
-    current_model = get_current_model()
-    cooldown = get_cooldown_for_model(current_model)
-    global_delay = 0
+    snapshot = config_manager.snapshot()
+    cooldown = snapshot.cooldown(snapshot.current_model)
+    qps_limit = snapshot.global_qps_limit
+    # 全局QPS和用户冷却时间都用状态后端的令牌桶实现，多个进程共享同一个后端时限流对所有进程生效
+    state_backend = get_state_backend()
     
-    if now - GLOBAL_REQUEST_CACHE["last_reset"] > timedelta(seconds=1):
-        GLOBAL_REQUEST_CACHE["count"] = 0
-        GLOBAL_REQUEST_CACHE["last_reset"] = now
-    if GLOBAL_REQUEST_CACHE["count"] >= get_global_qps_limit():
-        global_delay = 1
-    
-    user_delay = 0
-    if user_id in USER_REQUEST_CACHE:
-        time_since_last = now - USER_REQUEST_CACHE[user_id]
-        if time_since_last < cooldown:
-            user_delay = (cooldown - time_since_last).total_seconds()
+    # 预订全局令牌（每秒补充 global_qps_limit 个），令牌不足时等待
+    # 共享后端的预订需要网络往返，由 call 在线程中执行
+    global_delay = await state_backend.call("reserve_token", "global_qps", qps_limit, qps_limit) if qps_limit > 0 else 0
+    # 每个用户容量为1、每 cooldown 秒补充一个的令牌桶，即两次请求至少间隔 cooldown 秒
+    user_delay = await state_backend.call("reserve_token", f"user:{user_id}", 1 / cooldown, 1) if cooldown > 0 else 0
     
     delay = max(global_delay, user_delay)
     if delay > 0:
         await asyncio.sleep(delay)
     
-    USER_REQUEST_CACHE[user_id] = datetime.now()
-    GLOBAL_REQUEST_CACHE["count"] += 1
-    
     return delay
 
 def prepare_gemini_request(user_msg: str, memory_content: str = "", event: Optional[MessageEvent] = None) -> dict:
@@ -248,15 +259,142 @@ def parse_deepseek_response(response_data: dict) -> str:
     
     return "未获取到有效回复"
 
+def get_model_request_params(current_model: str) -> Dict:
+    """根据模型获取请求准备/解析函数、API地址和请求头（供记忆总结使用）"""
+    if current_model.startswith("gemini"):
+        # 获取Gemini配置和函数
+        gemini_config = get_gemini_config()
+        return {
+            "current_model": current_model,
+            "prepare_request": prepare_gemini_request,
+            "parse_response": parse_gemini_response,
+            "api_url": gemini_config["url"],
+            "headers": {"Content-Type": "application/json"},
+            "proxies": get_proxies()
+        }
+    else:
+        # 获取DeepSeek配置和函数
+        deepseek_config = get_deepseek_config()
+        return {
+            "current_model": current_model,
+            "prepare_request": prepare_deepseek_request,
+            "parse_response": parse_deepseek_response,
+            "api_url": deepseek_config["url"],
+            "headers": {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {deepseek_config['api_key']}"
+            },
+            "proxies": get_proxies()
+        }
+
+# 注册总结参数提供函数，供管理员批量总结使用
+set_summary_params_provider(lambda: get_model_request_params(get_current_model()))
+
+async def build_memory_content(
+    event: MessageEvent,
+    memory_key: str,
+    user_msg: str,
+    extra_prompt: str = "",
+    query: Optional[str] = None
+) -> str:
+    """按当前模型的token预算组装记忆内容
+    
+    提示词、分割提示词、附加提示词和新消息为固定部分，剩余预算留给记忆；
+    query用于从归档记录中检索相关内容，默认使用新消息；
+    群聊中只附带提问用户的画像和与其相关的记录
+    """
+    reserved_tokens = (
+        estimate_tokens(get_all_prompts(event))
+        + estimate_tokens(get_split_prompt() if is_split_enabled() else "")
+        + estimate_tokens(extra_prompt)
+        + estimate_tokens(f"<新消息>{user_msg}</新消息>")
+    )
+    budget = get_context_budget(get_current_model())
+    return await get_memory_content(
+        memory_key, budget=budget, reserved_tokens=reserved_tokens, query=query or user_msg,
+        speaker=str(event.user_id) if event.message_type == "group" else None
+    )
+
+async def refresh_group_members(group_id: str) -> None:
+    """通过 get_group_member_list 批量拉取群成员"""
+    try:
+        members = await get_bot().get_group_member_list(group_id=int(group_id))
+        count = member_cache.fill(group_id, members)
+        print(f"已缓存群 {group_id} 的成员列表：{count} 人")
+    except Exception as e:
+        print(f"拉取群 {group_id} 成员列表失败: {str(e)}")
+        member_cache.mark_failed(group_id)
+
+async def ensure_group_members(event: MessageEvent) -> None:
+    """保证群成员缓存可用
+    
+    发言者信息随消息附带，直接更新；成员列表过期时在后台重新拉取，
+    只有从未拉取过、且消息@了未知成员时才短暂等待拉取结果
+    """
+    if event.message_type != "group":
+        return
+    group_id = str(event.group_id)
+    member_cache.update_member(
+        group_id, event.user_id,
+        card=getattr(event.sender, 'card', None) or "",
+        nickname=getattr(event.sender, 'nickname', None) or ""
+    )
+    if member_cache.is_fresh(group_id):
+        return
+    task = member_refresh_tasks.get(group_id)
+    if task is None or task.done():
+        task = asyncio.create_task(refresh_group_members(group_id))
+        member_refresh_tasks[group_id] = task
+        task.add_done_callback(lambda _: member_refresh_tasks.pop(group_id, None))
+    mentioned = [
+        segment.data.get('qq') for segment in event.message
+        if segment.type == 'at' and not segment.data.get('name') and segment.data.get('qq') != 'all'
+    ]
+    if not member_cache.is_loaded(group_id) and any(not member_cache.has_member(group_id, qq) for qq in mentioned):
+        try:
+            await asyncio.wait_for(asyncio.shield(task), MEMBER_FETCH_TIMEOUT)
+        except Exception:
+            pass
+
+member_notice = on_notice(priority=5, block=False)
+
+@member_notice.handle()
+async def handle_member_notice(event: NoticeEvent):
+    """根据群成员变动通知增量更新成员缓存"""
+    if isinstance(event, GroupIncreaseNoticeEvent):
+        try:
+            info = await get_bot().get_group_member_info(group_id=event.group_id, user_id=event.user_id)
+            member_cache.update_member(event.group_id, event.user_id, info.get("card") or "", info.get("nickname") or "")
+        except Exception as e:
+            print(f"获取新成员信息失败: {str(e)}")
+            member_cache.invalidate(event.group_id)
+    elif isinstance(event, GroupDecreaseNoticeEvent):
+        if str(event.user_id) == str(getattr(event, "self_id", "")):
+            # 机器人自己退群/被踢
+            member_cache.remove_group(event.group_id)
+        else:
+            member_cache.remove_member(event.group_id, event.user_id)
+    elif getattr(event, "notice_type", "") == "group_card":
+        # 群名片变更（go-cqhttp等实现的扩展通知）
+        member_cache.update_member(event.group_id, event.user_id, card=getattr(event, "card_new", "") or "")
+
 def process_message_with_cqcodes(event: MessageEvent) -> str:
     """
     处理消息中的CQ码，将@指令转换为@昵称格式，不添加发信人标识
     """
+    group_id = getattr(event, "group_id", None) if event.message_type == "group" else None
     result = []
     for segment in event.message:
+        if segment.type == 'reply':
+            # 回复引用由 resolve_quoted_message 解析为引用内容
+            continue
         if segment.type == 'at':
-            # 获取被@用户的昵称或QQ号
-            name = segment.data.get('name', f"QQ_{segment.data.get('qq', 'unknown')}")
+            # 获取被@用户的昵称：消息段自带的名字 → 群成员缓存 → QQ号
+            qq = segment.data.get('qq', 'unknown')
+            if qq == 'all':
+                result.append("@全体成员")
+                continue
+            name = segment.data.get('name') or (member_cache.get_name(group_id, qq) if group_id else None) or f"QQ_{qq}"
             result.append(f"@{name}")
         else:
             # 保留其他类型的消息内容
@@ -264,21 +402,109 @@ def process_message_with_cqcodes(event: MessageEvent) -> str:
     
     return ''.join(result).strip()
 
+def message_to_text(message: Union[str, list]) -> str:
+    """将get_msg等接口返回的消息（字符串或消息段列表）转为文本，媒体简写为[图片]等"""
+    if isinstance(message, str):
+        return abbreviate_media(message)
+    result = []
+    for segment in message:
+        seg_type = segment.get("type") if isinstance(segment, dict) else segment.type
+        data = (segment.get("data") if isinstance(segment, dict) else segment.data) or {}
+        if seg_type == "text":
+            result.append(data.get("text", ""))
+        elif seg_type == "at":
+            result.append(f"@{data.get('name') or data.get('qq', '')}")
+        elif seg_type != "reply":
+            result.append(abbreviate_media(f"[CQ:{seg_type}]"))
+    return "".join(result).strip()
+
+def index_incoming_message(event: MessageEvent, text: str) -> None:
+    """将收到的消息记入消息ID索引"""
+    sender = getattr(event.sender, 'card', None) or getattr(event.sender, 'nickname', None) or f"用户{event.user_id}"
+    message_index.add(getattr(event, "message_id", None), sender, str(event.user_id), text, getattr(event, "time", 0))
+
+@Bot.on_called_api
+async def index_sent_message(bot: Bot, exception: Optional[Exception], api: str, data: Dict, result: Any) -> None:
+    """机器人发出的消息也记入索引，用户引用AI回复时无需再调用接口"""
+    if exception or api not in ("send_msg", "send_group_msg", "send_private_msg"):
+        return
+    if not isinstance(result, dict) or result.get("message_id") is None:
+        return
+    message = data.get("message", "")
+    text = message_to_text(message if isinstance(message, (str, list)) else str(message))
+    message_index.add(result["message_id"], "AI", str(bot.self_id), text, time.time())
+
+async def resolve_quoted_message(event: MessageEvent) -> str:
+    """解析用户回复/引用的消息，返回"[回复 发言者：内容]"，没有引用时返回空字符串
+    
+    依次查找本地消息ID索引、适配器已附带的引用消息（event.reply），最后调用get_msg接口
+    """
+    reply = getattr(event, "reply", None)
+    message_id = getattr(reply, "message_id", None) if reply else None
+    if message_id is None:
+        for segment in event.message:
+            if segment.type == "reply":
+                message_id = segment.data.get("id")
+                break
+    if message_id is None:
+        return ""
+    
+    record = await run_io(message_index.get, message_id)
+    if record is None and reply is not None:
+        sender = getattr(reply.sender, "card", None) or getattr(reply.sender, "nickname", None) or "未知用户"
+        text = message_to_text(list(reply.message) if not isinstance(reply.message, str) else reply.message)
+        record = message_index.add(message_id, sender, str(getattr(reply.sender, "user_id", "")), text, getattr(reply, "time", 0))
+        message_index.record_source("event")
+    if record is None:
+        try:
+            response = await get_bot().get_msg(message_id=int(message_id))
+            sender_info = response.get("sender", {})
+            sender = sender_info.get("card") or sender_info.get("nickname") or "未知用户"
+            record = message_index.add(
+                message_id, sender, str(sender_info.get("user_id", "")),
+                message_to_text(response.get("message", "")), response.get("time", 0)
+            )
+            message_index.record_source("api")
+        except Exception as e:
+            print(f"获取被引用的消息失败 {message_id}: {str(e)}")
+            message_index.record_source("miss")
+            return ""
+    text = record["text"]
+    if len(text) > QUOTE_MAX_LENGTH:
+        text = text[:QUOTE_MAX_LENGTH] + "…"
+    return f"[回复 {record['sender']}：{text}]"
+
 def add_sender_identifier(event: MessageEvent, message: str) -> str:
     """
     在群聊环境下为消息添加发信人标识
     """
     if event.message_type == 'group':
-        # 获取用户昵称 - 优先使用QQ昵称，其次是群昵称，最后是默认值
-        user_name = event.sender.nickname or event.sender.card or f"用户{event.user_id}"
+        # 获取用户名称 - 与@渲染一致，优先使用群成员缓存中的群名片/昵称
+        user_name = (
+            member_cache.get_name(event.group_id, event.user_id)
+            or event.sender.nickname or event.sender.card or f"用户{event.user_id}"
+        )
         # 格式为：昵称（QQ号）：消息内容
         return f"{user_name}（{event.user_id}）：{message}"
     return message
 
 @ai_chat.handle()
 async def handle_chat(event: MessageEvent):
+    import requests  # 首次处理消息时才导入，加快插件加载（请求通过 get_session 的连接池发送）
+    if not accepting:
+        raise IgnoredException("正在退出，不再处理新消息")
+    # 记录正在处理的消息，退出时等待其完成
+    task = asyncio.current_task()
+    inflight_tasks.add(task)
+    task.add_done_callback(inflight_tasks.discard)
     user_id = str(event.user_id)
     
+    # 加载该聊天的状态（回复模式、提示词开关、摘要模式），之后的指令和回复判断只读取缓存
+    await get_chat_state().preload(get_memory_key(event))
+    
+    # 更新群成员缓存，用于渲染@和发信人标识
+    await ensure_group_members(event)
+    
     # 获取原始消息内容用于指令处理
     raw_user_msg = process_message_with_cqcodes(event)  # 只处理CQ码但不添加发信人标识
     
@@ -291,6 +517,12 @@ async def handle_chat(event: MessageEvent):
     if await handle_command(event, raw_user_msg):
         raise FinishedException()
     
+    # 记入消息ID索引，并把被引用的消息内容附加到消息前
+    index_incoming_message(event, raw_user_msg)
+    quoted = await resolve_quoted_message(event)
+    if quoted:
+        raw_user_msg = f"{quoted} {raw_user_msg}".strip()
+    
     # 过滤空消息
     if not raw_user_msg:
         raise IgnoredException("空消息，跳过处理")
@@ -313,12 +545,13 @@ async def handle_chat(event: MessageEvent):
         print("群聊消息未@机器人，处理中...")
         # 更新记忆 - 只添加用户消息
         memory_key = get_memory_key(event)
+        # 总结在后台执行，未@的消息也传递模型参数以便及时触发总结
         await update_memory_chat(
             event=event,
             user_msg=raw_user_msg,
             ai_reply="",  # 未触发AI回复，所以是空的
             split_parts=None,
-            current_model=get_current_model()
+            **get_model_request_params(get_current_model())
         )
         
         # 检查是否处于主动回复模式
@@ -342,7 +575,9 @@ async def handle_chat(event: MessageEvent):
                 
                 # 获取记忆内容
                 print(f"主动回复模式：正在加载记忆内容 - 记忆键: {memory_key}")
-                memory_content = get_memory_content(memory_key)
+                memory_content = await build_memory_content(
+                    event, memory_key, add_sender_identifier(event, raw_user_msg), active_reply_prompt, query=raw_user_msg
+                )
                 print(f"主动回复模式：记忆内容加载完成，长度: {len(str(memory_content))} 字符")
                 
                 # 调用API生成回复
@@ -357,7 +592,8 @@ async def handle_chat(event: MessageEvent):
                         headers = {"Content-Type": "application/json"}
                         # 动态获取Gemini配置
                         gemini_config = get_gemini_config()
-                        response = requests.post(
+                        response = await asyncio.to_thread(
+                            get_session().post,
                             gemini_config["url"],
                             json=data,
                             headers=headers,
@@ -377,7 +613,8 @@ async def handle_chat(event: MessageEvent):
                             "Content-Type": "application/json",
                             "Authorization": f"Bearer {deepseek_config['api_key']}"
                         }
-                        response = requests.post(
+                        response = await asyncio.to_thread(
+                            get_session().post,
                             deepseek_config["url"],
                             json=data,
                             headers=headers,
@@ -418,37 +655,13 @@ async def handle_chat(event: MessageEvent):
                             # 不分割，直接发送
                             await ai_chat.send(ai_reply)
                         
-                        # 根据不同模型获取对应的参数
-                        if current_model.startswith("gemini"):
-                            # 获取Gemini配置和函数
-                            gemini_config = get_gemini_config()
-                            prepare_func = prepare_gemini_request
-                            parse_func = parse_gemini_response
-                            api_url = gemini_config["url"]
-                            headers = {"Content-Type": "application/json"}
-                        elif current_model.startswith("deepseek"):
-                            # 获取DeepSeek配置和函数
-                            deepseek_config = get_deepseek_config()
-                            prepare_func = prepare_deepseek_request
-                            parse_func = parse_deepseek_response
-                            api_url = deepseek_config["url"]
-                            headers = {
-                                "Content-Type": "application/json",
-                                "Authorization": f"Bearer {deepseek_config['api_key']}"
-                            }
-                        
                         # 更新记忆，添加AI回复，并传递所有必要的模型参数
                         await update_memory_chat(
                             event=event,
                             user_msg="",  # 用户消息已经添加过了
                             ai_reply=ai_reply,
                             split_parts=split_parts if split_parts else None,
-                            current_model=current_model,
-                            prepare_request=prepare_func,
-                            parse_response=parse_func,
-                            api_url=api_url,
-                            headers=headers,
-                            proxies=get_proxies()
+                            **get_model_request_params(current_model)
                         )
                     else:
                         print(f"主动回复模式：AI判断不需要回复此消息 - {ai_reply[:30]}...")
@@ -470,7 +683,7 @@ async def handle_chat(event: MessageEvent):
     
     # 获取记忆内容
     memory_key = get_memory_key(event)
-    memory_content = get_memory_content(memory_key)
+    memory_content = await build_memory_content(event, memory_key, add_sender_identifier(event, raw_user_msg), query=raw_user_msg)
     
     # 调用API生成回复
     current_model = get_current_model()
@@ -483,7 +696,8 @@ async def handle_chat(event: MessageEvent):
             headers = {"Content-Type": "application/json"}
             # 动态获取Gemini配置
             gemini_config = get_gemini_config()
-            response = requests.post(
+            response = await asyncio.to_thread(
+                get_session().post,
                 gemini_config["url"],
                 json=data,
                 headers=headers,
@@ -517,7 +731,8 @@ async def handle_chat(event: MessageEvent):
                 "Content-Type": "application/json",
                 "Authorization": f"Bearer {deepseek_config['api_key']}"
             }
-            response = requests.post(
+            response = await asyncio.to_thread(
+                get_session().post,
                 deepseek_config["url"],
                 json=data,
                 headers=headers,
@@ -559,38 +774,15 @@ async def handle_chat(event: MessageEvent):
         else:
             await ai_chat.send(ai_reply)
         
-        # 根据不同模型获取对应的参数
-        if current_model.startswith("gemini"):
-            # 获取Gemini配置和函数
-            gemini_config = get_gemini_config()
-            prepare_func = prepare_gemini_request
-            parse_func = parse_gemini_response
-            api_url = gemini_config["url"]
-            headers = {"Content-Type": "application/json"}
-        elif current_model.startswith("deepseek"):
-            # 获取DeepSeek配置和函数
-            deepseek_config = get_deepseek_config()
-            prepare_func = prepare_deepseek_request
-            parse_func = parse_deepseek_response
-            api_url = deepseek_config["url"]
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {deepseek_config['api_key']}"
-            }
-        
         # 更新记忆 - 使用兼容函数处理聊天记录更新，并传递所有必要的模型参数
+        # 总结在后台工作池中执行，这里只追加记录，不阻塞回复
         print("准备更新记忆...")
         await update_memory_chat(
             event=event,
             user_msg=raw_user_msg,
             ai_reply=ai_reply,
             split_parts=split_parts if split_parts else None,  # 传递分割后的消息部分
-            current_model=current_model,
-            prepare_request=prepare_func,
-            parse_response=parse_func,
-            api_url=api_url,
-            headers=headers,
-            proxies=get_proxies()
+            **get_model_request_params(current_model)
         )
         
         await ai_chat.finish()
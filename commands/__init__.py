@@ -9,10 +9,8 @@ COMMAND_METADATA: Dict[str, CommandMetadata] = {}
 COMMAND_ALIASES: Dict[str, str] = {}
 
 def is_admin(user_id: str) -> bool:
-    """检查用户是否为管理员"""
-    admin_list = config_manager.get_value("admin_config.json", "admin_qq", ["757519749"])
-    # 将admin_list中的所有元素转换为字符串进行比较
-    return user_id in [str(admin) for admin in admin_list]
+    """检查用户是否为管理员（管理员QQ号集合在配置快照中预先转换为字符串）"""
+    return config_manager.snapshot().is_admin(user_id)
 
 def register_command(
     command: Union[str, List[str]],
@@ -1,48 +1,182 @@
 import os
-import os
 import json
+import zlib
 import asyncio
-import requests  
 from datetime import datetime
-from typing import Dict, List, Callable, Optional
+from typing import Dict, List, Callable, Optional, Tuple
 from nonebot import get_bot
 from nonebot.adapters.onebot.v11 import MessageEvent
 from . import register_command, is_admin
-from ..utils.config import config_manager
+from ..utils.config import config_manager, write_json_atomic
+from ..utils.http import get_session
+from ..utils.disk_io import run_io, get_disk_executor
+from ..utils.summary_worker import SummaryWorker, STATE_FAILED
+from ..utils.tokens import estimate_tokens, entry_tokens, truncate_to_tokens, truncate_tail_to_tokens
+from ..utils.retrieval import RetrievalStore
+from ..utils.shard_pool import ShardPool
+from ..utils.memory_schema import AI_ID, HistoryEntry, entry_to_dict, parse_role_info
+from ..utils.memory_store import MemoryStore, MemoryConflict
+from ..utils.state_backend import get_state_backend
+from ..utils.ingest_filter import default_pipeline, abbreviate_media
+from ..utils.digest import DigestManager, format_digest
+from ..utils.message_index import get_message_index
+from ..utils.chat_state import get_chat_state, FIELD_DIGEST
+from ..utils.member_cache import member_cache
+from ..utils.profiles import profile_prompt, split_profiles, merge_profiles, get_profile, select_focus_entries
 
 # 记忆存储路径
 DATA_DIR = config_manager.get_data_dir()
 MEMORY_DIR = os.path.join(DATA_DIR, "memories")
-USER_MEMORY_DIR = os.path.join(MEMORY_DIR, "users")
-GROUP_MEMORY_DIR = os.path.join(MEMORY_DIR, "groups")
-
-# 确保数据目录存在并检查权限
-os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(USER_MEMORY_DIR, exist_ok=True)
-os.makedirs(GROUP_MEMORY_DIR, exist_ok=True)
-for dir_name in ["users", "groups"]:
-    dir_path = os.path.join(MEMORY_DIR, dir_name)
-    if not os.access(dir_path, os.W_OK):
-        print(f"警告：目录 {dir_path} 无写入权限，记忆无法保存！")
-
-
-# 记忆数据结构
-MEMORY_STRUCT = {
-    "summary": "",  # AI总结的历史信息
-    "history": [],  # 最近聊天记录
-    "last_summary_time": 0  # 上次总结时间戳
-}
-
-# 并发控制锁
-memory_locks = {}  # {key: asyncio.Lock()}
-
-def calculate_effective_length(history: List[Dict]) -> int:
+ARCHIVE_DIR = os.path.join(MEMORY_DIR, "archive")  # 总结后被删除的历史记录归档及检索索引
+SUMMARY_JOBS_FILE = os.path.join(MEMORY_DIR, "summary_jobs.json")  # 退出时未完成的后台总结任务，下次启动时恢复
+# 目录在首次写入时创建，导入时不访问磁盘
+
+
+# 记忆数据结构见 utils/memory_schema.py：
+# {"summary": 总结, "history": [HistoryEntry], "participants": ParticipantTable, "last_summary_time": 时间戳}
+
+# 分层存储：热数据在内存，温数据为JSON文件，冷数据压缩归档到 memories/cold
+# 配置了共享状态后端时以后端中的记忆为准，多个进程之间按版本号检测写入冲突（启动时由 init_memory 连接）
+memory_store = MemoryStore(MEMORY_DIR)
+MEMORY_CONFLICT_RETRIES = 5  # 记忆被其他进程先修改时重新加载并重试的次数
+SUMMARY_LEASE_SECONDS = 600  # 总结租约的有效期，期间其他进程不会总结同一聊天
+SUMMARY_LEASE_RENEW_SECONDS = 120  # 总结执行期间续期租约的间隔，总结耗时超过有效期时也不会被其他进程重复执行
+
+# 并发控制锁：记忆键按哈希分段映射到固定数量的锁上，锁的数量不随聊天数增长
+# asyncio.Lock按等待顺序唤醒，同一聊天的读写按到达顺序执行；
+# 不同的键可能共用一把锁，因此持有锁时不能再获取其他键的锁
+MEMORY_LOCK_STRIPES = 64
+memory_locks: List[Optional[asyncio.Lock]] = [None] * MEMORY_LOCK_STRIPES
+sweeper_task: Optional[asyncio.Task] = None
+
+# 总结触发参数
+SUMMARY_LENGTH_LIMIT = 2000  # 有效内容长度超过该值时触发总结
+SUMMARY_HARD_LIMIT = 120  # 历史记录超过该条数时忽略总结间隔
+SUMMARY_KEEP_RECENT = 40  # 总结后保留的最近记录数
+
+# 上下文组装参数
+SUMMARY_BUDGET_RATIO = 0.4  # 摘要最多占用的可用预算比例
+MIN_TRUNCATED_TOKENS = 16  # 截断后少于该token数的记录直接丢弃
+RETRIEVAL_BUDGET_RATIO = 0.2  # 相关记录最多占用的可用预算比例
+RETRIEVAL_MAX_CHARS = 1000  # 不限制预算时相关记录的最大字数
+
+# 归档消息检索索引（已加载的索引常驻内存，每条文档约 2KB，缓存的文档总数不超过该值，约 100MB；
+# 分片时由各工作进程平分）
+RETRIEVAL_CACHE_DOCS = 50000
+retrieval_store = RetrievalStore(ARCHIVE_DIR, max_cached_docs=RETRIEVAL_CACHE_DOCS)
+# 配置 shard_workers > 0 时，检索索引的加载、检索和写入在按记忆键分片的工作进程中执行，
+# 每个进程缓存本分片的索引，不再与事件循环争用同一个CPU核心
+shard_pool: Optional[ShardPool] = None
+
+# 写入记忆前的消息过滤规则链（可通过 ingest_pipeline.register 追加自定义规则）
+ingest_pipeline = default_pipeline()
+
+# 高流量群的摘要模式
+digest_manager = DigestManager()
+digest_task: Optional[asyncio.Task] = None
+DIGEST_BUDGET_RATIO = 0.25  # 群聊动态最多占用的可用预算比例
+DIGEST_ROLE = "群聊摘要"  # 转入归档检索的摘要使用的角色名
+
+# 由主模块注册，返回当前模型的总结请求参数（用于管理员批量总结）
+summary_params_provider: Optional[Callable[[], Dict]] = None
+
+def set_summary_params_provider(provider: Callable[[], Dict]) -> None:
+    """注册总结请求参数提供函数"""
+    global summary_params_provider
+    summary_params_provider = provider
+
+def init_memory() -> None:
+    """机器人启动时调用：连接共享状态后端，检查记忆目录的写入权限"""
+    memory_store.attach_backend(get_state_backend())
+    path = MEMORY_DIR
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    if not os.access(path, os.W_OK):
+        print(f"警告：目录 {path} 无写入权限，记忆无法保存！")
+
+def resume_summary_jobs() -> int:
+    """重新提交上次退出时未完成的后台总结任务（机器人启动时调用），返回提交的任务数"""
+    if not os.path.exists(SUMMARY_JOBS_FILE):
+        return 0
+    try:
+        with open(SUMMARY_JOBS_FILE, "r", encoding="utf-8") as f:
+            jobs = json.load(f)
+    except Exception as e:
+        print(f"读取未完成的总结任务失败: {str(e)}")
+        jobs = []
+    submitted = 0
+    if summary_params_provider is not None:
+        for job in jobs:
+            params = summary_params_provider()
+            params["ignore_interval"] = job.get("ignore_interval", False)
+            if summary_worker.submit(job["key"], params, immediate=job.get("immediate", False)):
+                submitted += 1
+    os.remove(SUMMARY_JOBS_FILE)
+    if submitted:
+        print(f"已恢复 {submitted} 个上次退出时未完成的后台总结任务")
+    return submitted
+
+async def shutdown_memory(timeout: float) -> None:
+    """退出前调用：最多等待 timeout 秒让执行中的总结完成，保存未完成的总结任务，
+    为摘要缓冲区中的消息生成摘要，写入记忆索引，并关闭分片工作进程"""
+    for task in (sweeper_task, digest_task):
+        if task is not None:
+            task.cancel()
+    jobs = await summary_worker.stop(timeout)
+    if jobs:
+        try:
+            await run_io(write_json_atomic, SUMMARY_JOBS_FILE, jobs)
+            print(f"已保存 {len(jobs)} 个未完成的后台总结任务，下次启动时继续")
+        except Exception as e:
+            print(f"保存未完成的总结任务失败: {str(e)}")
+    try:
+        await flush_digests(include_current=True)
+    except Exception as e:
+        print(f"生成群聊摘要失败: {str(e)}")
+    await run_io(memory_store.flush_index, True)
+    close_shard_pool()
+
+def get_shard_pool() -> Optional[ShardPool]:
+    """获取分片工作进程池，未开启时返回None（进程数在首次使用时确定，修改后需重启）"""
+    global shard_pool
+    if shard_pool is None:
+        workers = config_manager.get_value("config.json", "shard_workers", 0)
+        if workers > 0:
+            timeout = config_manager.get_value("config.json", "shard_timeout", 30)
+            shard_pool = ShardPool(
+                workers, RetrievalStore, (ARCHIVE_DIR, 32, max(RETRIEVAL_CACHE_DOCS // workers, 1)), timeout=timeout
+            )
+            print(f"已启动 {workers} 个分片工作进程处理归档检索")
+    return shard_pool
+
+def close_shard_pool() -> None:
+    """等待分片工作进程处理完已提交的请求后退出"""
+    global shard_pool
+    if shard_pool is not None:
+        shard_pool.close()
+        shard_pool = None
+
+async def call_retrieval(key: str, method: str, *args):
+    """调用检索索引的方法（RetrievalStore.<method>(key, *args)）：开启分片时发往该键所属的工作进程，否则在线程中执行"""
+    pool = get_shard_pool()
+    if pool is not None:
+        return await pool.call(key, method, key, *args)
+    return await run_io(getattr(retrieval_store, method), key, *args)
+
+def get_memory_lock(key: str) -> asyncio.Lock:
+    """获取指定记忆键所在分段的锁"""
+    index = zlib.crc32(key.encode("utf-8")) % MEMORY_LOCK_STRIPES
+    lock = memory_locks[index]
+    if lock is None:
+        lock = memory_locks[index] = asyncio.Lock()
+    return lock
+
+def calculate_effective_length(history: List[HistoryEntry]) -> int:
     """计算历史记录中的有效信息长度（去掉标记信息性质的内容）"""
     total_length = 0
     for item in history:
         # 只计算实际内容部分，去掉标记性信息
-        content = item['content']
-        total_length += len(content)
+        total_length += len(item.content)
     return total_length
 
 def get_memory_key(event: MessageEvent) -> str:
@@ -54,34 +188,158 @@ def get_memory_key(event: MessageEvent) -> str:
 
 def get_memory_path(key: str) -> str:
     """获取记忆文件路径"""
-    prefix, id = key.split("_", 1)
-    path = os.path.join(MEMORY_DIR, prefix + "s", f"{id}.json")
-    # 新增日志：验证路径是否正确
-    print(f"记忆文件路径：{path}")  # 测试时查看控制台输出
-    return path
+    return memory_store.path(key)
 
 def load_memory(key: str) -> Dict:
-    """加载记忆数据（纯文件操作，无外部函数依赖）"""
-    path = get_memory_path(key)
-    if not os.path.exists(path):
-        return MEMORY_STRUCT.copy()
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"加载记忆失败: {str(e)}")
-        return MEMORY_STRUCT.copy()
+    """加载记忆数据（优先读取内存缓存，冷数据自动解压，兼容旧版格式）"""
+    return memory_store.load(key)
 
 def save_memory(key: str, data: Dict) -> bool:
-    """保存记忆数据（纯文件操作，无外部函数依赖）"""
-    try:
-        path = get_memory_path(key)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        print(f"保存记忆失败: {str(e)}")
-        return False
+    """保存记忆数据（写入文件并更新内存缓存）"""
+    return memory_store.save(key, data)
+
+async def sweep_memory() -> Dict[str, int]:
+    """执行一次分层存储清理
+    
+    1. 将空闲超时或超出内存预算的记忆移出内存
+    2. 压缩长时间未更新的记忆文件；磁盘占用超出预算时从最久未更新的开始继续压缩
+    """
+    storage = config_manager.get_value("config.json", "memory_storage", {})
+    hot_max_bytes = storage.get("hot_max_mb", 64) * 1024 * 1024
+    hot_idle_seconds = storage.get("hot_idle_seconds", 1800)
+    cold_after_seconds = storage.get("cold_after_days", 14) * 86400
+    disk_budget = storage.get("disk_budget_mb", 1024) * 1024 * 1024
+    
+    # 正在使用或有待执行总结任务的记忆保留在内存中
+    busy = {key for key in memory_store.hot if get_memory_lock(key).locked() or summary_worker.is_busy(key)}
+    evicted = memory_store.evict_hot(hot_max_bytes, hot_idle_seconds, keep=busy)
+    
+    compressed = 0
+    saved_bytes = 0
+    candidates = await run_io(memory_store.compression_candidates, cold_after_seconds, disk_budget)
+    for key in candidates:
+        # 压缩期间持有锁，避免与加载/保存同一记忆冲突
+        async with get_memory_lock(key):
+            try:
+                saved = await run_io(memory_store.compress, key)
+            except Exception as e:
+                print(f"压缩记忆失败 [{key}]: {str(e)}")
+                continue
+        if saved:
+            compressed += 1
+            saved_bytes += saved
+    
+    await run_io(memory_store.flush_index, True)
+    usage = await run_io(memory_store.disk_usage)
+    if usage["warm"] + usage["cold"] > disk_budget:
+        print(f"警告：记忆文件占用 {(usage['warm'] + usage['cold']) / 1048576:.1f}MB，已压缩全部空闲记忆仍超出磁盘预算")
+    
+    stats = {
+        "evicted": evicted,
+        "compressed": compressed,
+        "saved_bytes": saved_bytes,
+        "hot": len(memory_store.hot),
+        "hot_bytes": memory_store.hot_bytes,
+        "warm_bytes": usage["warm"],
+        "cold_bytes": usage["cold"]
+    }
+    if evicted or compressed:
+        print(
+            f"记忆清理：移出内存 {evicted} 个，压缩 {compressed} 个（节省 {saved_bytes / 1024:.1f}KB），"
+            f"内存中 {stats['hot']} 个（{stats['hot_bytes'] / 1048576:.1f}MB）"
+        )
+    return stats
+
+async def memory_sweeper() -> None:
+    """后台定期执行分层存储清理"""
+    # 在线程中加载记忆索引（索引文件不存在时需要扫描全部记忆文件）
+    await run_io(memory_store.load_index)
+    while True:
+        interval = config_manager.get_value("config.json", "memory_storage.sweep_interval", 600)
+        await asyncio.sleep(interval)
+        try:
+            await sweep_memory()
+        except Exception as e:
+            print(f"记忆清理失败: {str(e)}")
+
+async def preload_recent_memories(count: int) -> int:
+    """把最近活跃的 count 个聊天的记忆、聊天状态和归档检索索引加载到内存（启动预热），返回加载的聊天数"""
+    keys = await run_io(memory_store.recent_keys, count)
+    chat_state = get_chat_state()
+    loaded = 0
+    for key in keys:
+        try:
+            async with get_memory_lock(key):
+                await run_io(memory_store.load, key)
+            await chat_state.preload(key)
+            await call_retrieval(key, "preload")
+            loaded += 1
+        except Exception as e:
+            print(f"预加载记忆失败 [{key}]: {str(e)}")
+    return loaded
+
+def ensure_sweeper_started() -> None:
+    """首次更新记忆时启动后台清理任务"""
+    global sweeper_task
+    if sweeper_task is None or sweeper_task.done():
+        sweeper_task = asyncio.get_running_loop().create_task(memory_sweeper())
+
+def is_digest_enabled(key: str) -> bool:
+    """群是否开启了摘要模式"""
+    return key.startswith("group_") and get_chat_state().get(key, FIELD_DIGEST, False)
+
+async def flush_digests(include_current: bool = False) -> int:
+    """为缓冲区中已结束的每分钟窗口生成摘要并写入记忆，返回生成的摘要数
+    
+    记忆中只保留最近 digest_keep 条摘要，更早的转入归档检索索引；
+    include_current 为 True 时（退出前）当前分钟的消息也生成摘要
+    """
+    options = config_manager.get_value("config.json", "digest_mode", {})
+    digest_keep = options.get("digest_keep", 120)
+    # 只处理已结束的分钟，当前分钟的消息留到下一轮
+    before = datetime.now().timestamp() + 1 if include_current else datetime.now().timestamp() // 60 * 60
+    total = 0
+    for key in list(digest_manager.buffers):
+        digests = digest_manager.collect(key, before)
+        if digests:
+            for _ in range(MEMORY_CONFLICT_RETRIES):
+                async with get_memory_lock(key):
+                    memory = await run_io(load_memory, key)
+                    all_digests = memory.get("digests", []) + digests
+                    overflow = all_digests[:-digest_keep] if len(all_digests) > digest_keep else []
+                    memory["digests"] = all_digests[len(overflow):]
+                    try:
+                        await run_io(save_memory, key, memory)
+                        break
+                    except MemoryConflict:
+                        continue
+            else:
+                print(f"记忆写入冲突次数过多，丢弃本轮摘要 [{key}]")
+                continue
+            if overflow:
+                await call_retrieval(key, "add", [
+                    {"role": DIGEST_ROLE, "content": format_digest(digest), "timestamp": digest["minute"]}
+                    for digest in overflow
+                ])
+            total += len(digests)
+        digest_manager.release_idle(key, options.get("raw_max_age", 600))
+    return total
+
+async def digest_flusher() -> None:
+    """后台定期生成摘要，没有缓冲的消息时退出"""
+    while digest_manager.buffers:
+        interval = config_manager.get_value("config.json", "digest_mode.flush_interval", 60)
+        await asyncio.sleep(interval)
+        try:
+            await flush_digests()
+        except Exception as e:
+            print(f"生成群聊摘要失败: {str(e)}")
+
+def ensure_digest_started() -> None:
+    """有消息进入摘要缓冲区时启动后台摘要任务"""
+    global digest_task
+    if digest_task is None or digest_task.done():
+        digest_task = asyncio.get_running_loop().create_task(digest_flusher())
 
 # 新增：记忆提示词管理相关指令
 @register_command(
@@ -132,7 +390,7 @@ async def handle_memory_prompt(event: MessageEvent, command_text: str) -> bool:
                     return True
             
             memory_prompts[prompt_type] = content
-            if config_manager.set_value("memory_prompts.json", memory_prompts):
+            if await run_io(config_manager.set_value, "memory_prompts.json", memory_prompts):
                 await get_bot().send(event, f"已{'创建' if action == 'create' else '编辑'}记忆提示词 `{prompt_type}`")
             else:
                 await get_bot().send(event, f"{'创建' if action == 'create' else '编辑'}记忆提示词失败（存储错误）")
@@ -165,7 +423,7 @@ async def handle_memory_prompt(event: MessageEvent, command_text: str) -> bool:
             await get_bot().send(event, f"记忆提示词 `{prompt_type}` 不存在！")
         else:
             del memory_prompts[prompt_type]
-            if config_manager.set_value("memory_prompts.json", memory_prompts):
+            if await run_io(config_manager.set_value, "memory_prompts.json", memory_prompts):
                 await get_bot().send(event, f"已删除记忆提示词 `{prompt_type}`")
             else:
                 await get_bot().send(event, "删除记忆提示词失败（存储错误）")
@@ -195,9 +453,17 @@ async def generate_summary(
     proxies: Dict,
     event: Optional[MessageEvent] = None,
     timeout: int = 15,
-    history_summary: str = ""  # 添加历史总结参数
+    history_summary: str = "",  # 添加历史总结参数
+    existing_profiles: Optional[Dict[str, str]] = None
 ) -> str:
-    """调用AI生成聊天记录总结（通过参数注入避免循环依赖）"""
+    """调用AI生成聊天记录总结（通过参数注入避免循环依赖）
+
+    existing_profiles不为None时（群聊），要求同时输出发言用户的画像，
+    由调用方用 split_profiles 拆分
+
+    请求失败或没有得到有效总结时抛出异常，由后台任务负责重试，
+    避免用空总结覆盖已有记忆
+    """
     if not history:
         return ""
     
@@ -230,7 +496,9 @@ async def generate_summary(
 """
     
     prompt_parts.append(enhanced_summary_prompt)
-    
+    if existing_profiles is not None:
+        prompt_parts.append(profile_prompt(existing_profiles))
+
     # 如果有历史总结，添加到提示词中
     if history_summary:
         prompt_parts.append(f"历史总结：\n{history_summary}")
@@ -266,7 +534,7 @@ async def generate_summary(
         
         data = prepare_summary_request(prompt)
         response = await asyncio.to_thread(
-            requests.post,
+            get_session().post,
             api_url,
             json=data,
             headers=headers,
@@ -274,11 +542,130 @@ async def generate_summary(
             timeout=timeout
         )
         response.raise_for_status()
-        # 使用注入的响应解析函数
-        return parse_response(response.json())
+        response_data = response.json()
     except Exception as e:
         print(f"生成总结失败: {str(e)}")
-        return ""
+        raise
+    
+    if "error" in response_data or not ("candidates" in response_data or "choices" in response_data):
+        raise RuntimeError(f"总结接口返回无效响应: {str(response_data)[:100]}")
+    
+    # 使用注入的响应解析函数
+    summary = parse_response(response_data)
+    if not summary or not summary.strip():
+        raise RuntimeError("总结接口返回空内容")
+    return summary
+
+def make_entry(memory: Dict, event: MessageEvent, content: str, role: str, timestamp: float) -> HistoryEntry:
+    """根据角色创建历史记录条目，发言者记录在参与者表中，条目只保存其ID"""
+    participants = memory["participants"]
+    if role.lower() == "user":
+        # 参与者表记录QQ号和最新的昵称/群名片
+        nickname = getattr(event.sender, 'nickname', None) or '未知用户'
+        card = getattr(event.sender, 'card', None) or ''
+        pid = participants.intern_user(str(event.user_id), nickname, card)
+    elif role.lower() == "ai":
+        pid = AI_ID
+    else:
+        # 支持自定义角色
+        pid = participants.intern_role(role)
+    # 缓存token数，组装上下文时无需重复估算
+    return HistoryEntry(pid, content, timestamp, estimate_tokens(content))
+
+def insert_entry(history: List[HistoryEntry], entry: HistoryEntry) -> None:
+    """按到达时间插入记录
+    
+    用户消息使用事件时间（秒级），等待AI回复期间写入的、确定晚于它到达的记录排在它后面；
+    同一秒内的记录保持写入顺序
+    """
+    index = len(history)
+    while index > 0 and history[index - 1].timestamp >= entry.timestamp + 1:
+        index -= 1
+    history.insert(index, entry)
+
+async def append_memory(
+    event: MessageEvent,
+    messages: List[Tuple[str, str]],
+    model_params: Optional[Dict] = None
+) -> None:
+    """在一次加锁内追加多条记录，messages为(角色, 内容)列表
+    
+    同一轮对话的用户消息和AI回复一起写入，不会与其他消息交错；
+    model_params完整时检查是否需要提交后台总结
+    """
+    key = get_memory_key(event)
+    ensure_sweeper_started()
+    to_me = event.message_type == "private" or bool(getattr(event, "to_me", False))
+    
+    # 摘要模式：统计群消息速率（过滤前，反映真实流量）
+    digest_active = False
+    if is_digest_enabled(key) and any(role.lower() == "user" for role, _ in messages):
+        digest_options = config_manager.get_value("config.json", "digest_mode", {})
+        digest_active = digest_manager.observe(
+            key, datetime.now().timestamp(), digest_options.get("rate_threshold", 60)
+        )
+    
+    # 过滤用户消息中的媒体、刷屏等低价值内容，全部被过滤时不写入
+    filter_options = config_manager.get_value("config.json", "ingest_filter", {})
+    if filter_options.get("enabled", True):
+        filtered = []
+        for role, content in messages:
+            if role.lower() == "user":
+                content = ingest_pipeline.process(key, content, to_me, filter_options)
+                if content is None:
+                    continue
+            filtered.append((role, content))
+        messages = filtered
+        if not messages:
+            return
+    
+    # 摘要模式下未@机器人的消息只进入内存中的环形缓冲区，定期压缩为每分钟摘要
+    if digest_active and not to_me:
+        digest_buffer = digest_manager.buffer(key, digest_options.get("ring_size", 600))
+        speaker = getattr(event.sender, 'card', None) or getattr(event.sender, 'nickname', None) or f"用户{event.user_id}"
+        now = datetime.now().timestamp()
+        for role, content in messages:
+            if role.lower() == "user":
+                digest_buffer.add(now, speaker, content)
+        ensure_digest_started()
+        messages = [(role, content) for role, content in messages if role.lower() != "user"]
+        if not messages:
+            return
+    
+    # 获取锁防止并发问题；共享存储中的记忆被其他进程先修改时重新加载后重试
+    for _ in range(MEMORY_CONFLICT_RETRIES):
+        async with get_memory_lock(key):
+            memory = await run_io(load_memory, key)
+            now = datetime.now().timestamp()
+            arrival = getattr(event, "time", None) or now
+            for role, content in messages:
+                # 用户消息按到达时间排序，AI回复按写入时间
+                timestamp = arrival if role.lower() == "user" else now
+                insert_entry(memory["history"], make_entry(memory, event, content, role, timestamp))
+            
+            # 保存更新后的记忆
+            try:
+                await run_io(save_memory, key, memory)
+            except MemoryConflict:
+                continue
+            
+            # 记录聊天活跃，推迟该聊天待执行的总结任务
+            summary_worker.touch(key)
+            
+            # 检查是否需要生成总结（总结在后台工作池中执行，不阻塞回复）
+            params = model_params or {}
+            if need_summary(memory) and all(params.get(name) for name in ["current_model", "prepare_request", "parse_response", "api_url", "headers"]):
+                summary_worker.submit(key, {
+                    "current_model": params["current_model"],
+                    "prepare_request": params["prepare_request"],
+                    "parse_response": params["parse_response"],
+                    "api_url": params["api_url"],
+                    "headers": params["headers"],
+                    "proxies": params.get("proxies") or {},
+                    "event": event
+                })
+            return
+    print(f"记忆写入冲突次数过多，放弃本次写入 [{key}]")
 
 async def update_memory(
     event: MessageEvent,
@@ -305,86 +692,135 @@ async def update_memory(
         headers: Dict - 请求头
         proxies: Dict - 代理配置
     """
-    key = get_memory_key(event)
+    await append_memory(event, [(role, content)], {
+        "current_model": current_model,
+        "prepare_request": prepare_request,
+        "parse_response": parse_response,
+        "api_url": api_url,
+        "headers": headers,
+        "proxies": proxies
+    })
+
+def need_summary(memory: Dict, ignore_interval: bool = False) -> bool:
+    """判断记忆是否需要生成总结
     
-    # 获取锁防止并发问题
-    if key not in memory_locks:
-        memory_locks[key] = asyncio.Lock()
-    async with memory_locks[key]:
-        memory = load_memory(key)
-        
-        # 添加新消息到历史记录
-        now = datetime.now().timestamp()
-        
-        # 根据role确定消息角色
-        if role.lower() == "user":
-            # 在role字段同时存储QQ号和昵称
-            user_id_str = str(event.user_id)
-            nickname = getattr(event.sender, 'nickname', '未知用户')
-            message_role = f"user_{user_id_str}_{nickname}"
-        elif role.lower() == "ai":
-            message_role = "ai"
-        else:
-            # 支持自定义角色
-            message_role = role
-        
-        # 添加消息到历史记录
-        memory["history"].append({
-            "role": message_role,
-            "content": content,
-            "timestamp": now
-        })
-        
-        # 计算有效信息长度（去掉标记信息性质的内容）
-        effective_length = calculate_effective_length(memory["history"])
-        
-        # 添加日志记录当前状态，便于调试
-        print(f"记忆更新状态 - 历史记录数: {len(memory['history'])}, 有效内容长度: {effective_length}")
-        
-        # 检查是否需要生成总结
-        # 根据需求：历史记录超过120条 或 有效信息超过2000字时触发总结
-        need_summary = (
-            len(memory["history"]) >= 120 or
-            effective_length >= 2000
-        )
-        
-        # 添加日志记录是否需要总结
-        print(f"是否需要生成总结: {need_summary}, 模型参数是否完整: {all([current_model, prepare_request, parse_response, api_url, headers])}")
-        
-        if need_summary and all([current_model, prepare_request, parse_response, api_url, headers]):
-            # 构建用于总结的完整信息：结合之前的总结和现有历史记录
-            full_history_for_summary = []
-            
-            # 如果有历史总结，添加到总结内容中
-            if memory["summary"]:
-                # 在generate_summary函数中会处理这个
-                pass  # 我们将通过修改generate_summary的提示词来包含历史总结
-            
-            # 使用注入的参数调用总结生成，并传递event以获取按聊天环境启用的提示词
-            # 传递历史总结，确保新总结能够基于之前的总结记录和现有信息
-            new_summary = await generate_summary(
-                memory["history"],
-                current_model,
-                prepare_request,
-                parse_response,
-                api_url,
-                headers,
-                proxies or {},
-                event=event,
-                history_summary=memory["summary"]  # 传递历史总结
-            )
-            
-            # 合并总结：依照之前的总结记录和现有的所有信息进行总结
-            memory["summary"] = new_summary  # 新总结已经包含了历史信息，直接替换
-                
-            # 删除历史聊天记录最远的80条（而不是之前的保留最近10条）
-            if len(memory["history"]) > 80:
-                memory["history"] = memory["history"][80:]  # 保留最新的记录
-                
-            memory["last_summary_time"] = now
+    历史记录数达到 summary_threshold 或有效内容长度超过上限时触发，
+    距上次总结不足 summary_interval 秒时跳过（历史记录超过硬上限时除外）
+    """
+    history = memory["history"]
+    if not history:
+        return False
+    
+    summary_threshold = config_manager.get_value("config.json", "summary_threshold", 50)
+    if len(history) < summary_threshold and calculate_effective_length(history) < SUMMARY_LENGTH_LIMIT:
+        return False
+    
+    if ignore_interval or len(history) >= SUMMARY_HARD_LIMIT:
+        return True
+    
+    summary_interval = config_manager.get_value("config.json", "summary_interval", 3600)
+    return datetime.now().timestamp() - memory.get("last_summary_time", 0) >= summary_interval
+
+async def run_summary_job(key: str, params: Dict) -> None:
+    """后台执行总结任务（持有该聊天的总结租约，多个进程时只有一个进程执行）"""
+    backend = get_state_backend()
+    lease = "summary:" + key
+    if not await backend.call("acquire_lease", lease, SUMMARY_LEASE_SECONDS):
+        print(f"其他进程正在总结该聊天，跳过本次总结 [{key}]")
+        return
+    renewer = asyncio.get_running_loop().create_task(renew_summary_lease(key, lease))
+    try:
+        await summarize_memory(key, params)
+    finally:
+        renewer.cancel()
+        await backend.call("release_lease", lease)
+
+async def renew_summary_lease(key: str, lease: str) -> None:
+    """总结执行期间定期续期租约，直到被取消"""
+    backend = get_state_backend()
+    while True:
+        await asyncio.sleep(SUMMARY_LEASE_RENEW_SECONDS)
+        try:
+            if not await backend.call("acquire_lease", lease, SUMMARY_LEASE_SECONDS):
+                print(f"总结租约已被其他进程占用，本次总结的结果可能与其他进程冲突 [{key}]")
+                return
+        except Exception as e:
+            print(f"续期总结租约失败 [{key}]: {str(e)}")
+
+async def summarize_memory(key: str, params: Dict) -> None:
+    """总结指定记忆
+    
+    在锁内取历史快照，锁外调用AI生成总结，完成后再加锁写回，
+    只删除已被总结覆盖的最早记录，期间新增的记录保持不变
+    """
+    async with get_memory_lock(key):
+        memory = await run_io(load_memory, key)
+        if not need_summary(memory, ignore_interval=params.get("ignore_interval", False)):
+            return
+        snapshot = list(memory["history"])
+        snapshot_dicts = [entry_to_dict(memory["participants"], entry) for entry in snapshot]
+        history_summary = memory["summary"]
+        # 群聊同时维护本次发言用户的画像
+        existing_profiles = None
+        if key.startswith("group_"):
+            stored_profiles = memory.get("profiles", {})
+            speakers = {memory["participants"].qq_of(entry.pid) for entry in snapshot} - {None}
+            existing_profiles = {qq: get_profile(stored_profiles, qq) for qq in sorted(speakers) if qq in stored_profiles}
+    
+    print(f"开始后台总结 [{key}] - 历史记录数: {len(snapshot)}")
+    new_summary = await generate_summary(
+        snapshot_dicts,
+        params["current_model"],
+        params["prepare_request"],
+        params["parse_response"],
+        params["api_url"],
+        params["headers"],
+        params.get("proxies") or {},
+        event=params.get("event"),
+        history_summary=history_summary,  # 传递历史总结
+        existing_profiles=existing_profiles
+    )
+    profiles = {}
+    if existing_profiles is not None:
+        new_summary, profiles = split_profiles(new_summary)
+    
+    # 生成失败时异常直接抛给工作池重试，已有总结和历史记录保持不变
+    async with get_memory_lock(key):
+        memory = await run_io(load_memory, key)
+        # 删除被总结覆盖的最早记录，仅保留最近的记录
+        drop_count = max(len(snapshot) - SUMMARY_KEEP_RECENT, 0)
+        if memory["history"][:drop_count] != snapshot[:drop_count]:
+            # 记忆在总结期间被删除或改写，放弃本次结果
+            print(f"记忆在总结期间发生变化，放弃总结结果 [{key}]")
+            return
         
-        # 保存更新后的记忆
-        save_memory(key, memory)
+        # 新总结已经包含了历史信息，与裁剪后的历史一起整体替换
+        updated = dict(memory)
+        updated["summary"] = new_summary
+        updated["history"] = memory["history"][drop_count:]
+        updated["last_summary_time"] = datetime.now().timestamp()
+        if profiles:
+            updated["profiles"] = merge_profiles(memory.get("profiles", {}), profiles)
+        try:
+            if not await run_io(save_memory, key, updated):
+                raise RuntimeError("保存总结结果失败")
+        except MemoryConflict:
+            # 与总结期间的改写一样处理，之后的新消息会重新触发总结
+            print(f"记忆在写回总结时已被其他进程修改，放弃总结结果 [{key}]")
+            return
+    
+    # 被删除的记录归档到本地检索索引，之后仍可按需召回（写回成功后再归档，避免放弃的结果重复归档）；
+    # 归档在锁外进行，检索进程变慢时不阻塞同一锁分段上的其他聊天（同一聊天的总结由工作池串行执行）
+    if drop_count:
+        await call_retrieval(key, "add", snapshot_dicts[:drop_count])
+    print(f"后台总结完成 [{key}] - 删除记录数: {drop_count}, 更新画像数: {len(profiles)}")
+
+# 后台总结工作池
+summary_worker = SummaryWorker(run_summary_job, concurrency=2, idle_seconds=10, max_delay=120)
+
+def list_memory_keys() -> List[str]:
+    """列出所有已存储记忆的键（包括已压缩归档的）"""
+    return memory_store.keys()
 
 # 兼容函数，处理现有的调用逻辑
 async def update_memory_chat(
@@ -402,104 +838,243 @@ async def update_memory_chat(
 ):
     """兼容原有的update_memory函数调用，用于聊天记录更新
     
-    先添加用户消息，再添加AI消息（支持分割）
+    用户消息和AI回复（支持分割）在一次加锁内按顺序写入
     """
+    messages = []
     # 添加用户消息 - 只有当user_msg不为空时才添加
     if user_msg and user_msg.strip():
-        await update_memory(
-            event=event,
-            content=user_msg,
-            role="user",
-            current_model=current_model,
-            prepare_request=prepare_request,
-            parse_response=parse_response,
-            api_url=api_url,
-            headers=headers,
-            proxies=proxies
-        )
+        messages.append(("user", user_msg))
     
-    # 添加AI回复 - 根据是否分割选择不同的方式，且仅当ai_reply不为空时添加
+    # 添加AI回复 - 如果有分割的消息部分，为每个部分创建单独的AI记忆条目
     if ai_reply:
         if split_parts and len(split_parts) > 1:
-            # 如果有分割的消息部分，为每个部分创建单独的AI记忆条目
-            for index, part in enumerate(split_parts):
-                # 第一个分割部分携带完整模型参数，以便可能触发自动总结
-                # 后续部分不携带模型参数，避免重复检查和生成总结
-                if index == 0:
-                    await update_memory(
-                        event=event,
-                        content=part,
-                        role="ai",
-                        current_model=current_model,
-                        prepare_request=prepare_request,
-                        parse_response=parse_response,
-                        api_url=api_url,
-                        headers=headers,
-                        proxies=proxies
-                    )
-                else:
-                    await update_memory(
-                        event=event,
-                        content=part,
-                        role="ai",
-                        current_model=None,
-                        prepare_request=None,
-                        parse_response=None,
-                        api_url=None,
-                        headers=None,
-                        proxies=None
-                    )
+            messages.extend(("ai", part) for part in split_parts)
         else:
-            # 否则添加完整的AI回复
-            await update_memory(
-                event=event,
-                content=ai_reply,
-                role="ai",
-                current_model=current_model,
-                prepare_request=prepare_request,
-                parse_response=parse_response,
-                api_url=api_url,
-                headers=headers,
-                proxies=proxies
-            )
+            messages.append(("ai", ai_reply))
+    
+    if not messages:
+        return
+    await append_memory(event, messages, {
+        "current_model": current_model,
+        "prepare_request": prepare_request,
+        "parse_response": parse_response,
+        "api_url": api_url,
+        "headers": headers,
+        "proxies": proxies
+    })
+
+async def get_related_content(key: str, query: str, max_tokens: Optional[int] = None) -> str:
+    """从归档消息中检索与新消息相关的记录，生成<相关记录>块"""
+    top_k = config_manager.get_value("config.json", "retrieval_top_k", 5)
+    if not query or top_k <= 0:
+        return ""
+    try:
+        docs = await call_retrieval(key, "search", query, top_k)
+    except Exception as e:
+        print(f"检索归档记录失败 [{key}]: {str(e)}")
+        return ""
+    if not docs:
+        return ""
+    
+    # 按得分从高到低填充预算，放不下的记录跳过（后面得分更低但更短的记录仍可放入），保留的记录再按时间排列
+    kept = []
+    used = estimate_tokens("<相关记录></相关记录>")
+    used_chars = 0
+    for doc in sorted(docs, key=lambda doc: doc.get("score", 0), reverse=True):
+        date = datetime.fromtimestamp(doc.get("timestamp", 0)).strftime("%Y-%m-%d")
+        line = f"[{date}] {parse_role_info(doc['role'])}: {doc['content']}"
+        line_tokens = estimate_tokens(line)
+        if max_tokens is not None and used + line_tokens > max_tokens:
+            continue
+        if max_tokens is None and used_chars + len(line) > RETRIEVAL_MAX_CHARS:
+            continue
+        kept.append((doc.get("timestamp", 0), doc.get("id", 0), line))
+        used += line_tokens
+        used_chars += len(line)
+    if not kept:
+        return ""
+    kept.sort(key=lambda item: item[:2])
+    return "<相关记录>\n" + "\n".join(line for _, _, line in kept) + "\n</相关记录>"
 
-def parse_role_info(role: str) -> str:
-    """解析role字段，提取用户信息"""
-    if role == "ai":
-        return "AI"
-    elif role.startswith("user_"):
-        # 格式：user_qq号_昵称
-        parts = role.split('_', 2)
-        if len(parts) >= 3:
-            qq = parts[1]
-            nickname = parts[2]
-            return f"用户[{qq}:{nickname}]"
-        return "用户"
-    return role
-
-def get_memory_content(key: str) -> str:
-    """获取用于AI调用的记忆内容（纯数据读取，无外部依赖）"""
-    memory = load_memory(key)
-    if not memory["summary"] and not memory["history"]:
+def build_digest_block(digest_lines: List[str], raw_lines: List[str], max_tokens: Optional[int] = None) -> str:
+    """生成<群聊动态>块：预算不足时优先保留最近的原始消息，再从最新的摘要开始填充"""
+    used = estimate_tokens("<群聊动态></群聊动态>最近发言：")
+    kept_raw = []
+    for line in reversed(raw_lines):
+        line_tokens = estimate_tokens(line)
+        if max_tokens is not None and used + line_tokens > max_tokens:
+            break
+        kept_raw.append(line)
+        used += line_tokens
+    kept_raw.reverse()
+    kept_digests = []
+    for line in reversed(digest_lines):
+        line_tokens = estimate_tokens(line)
+        if max_tokens is not None and used + line_tokens > max_tokens:
+            break
+        kept_digests.append(line)
+        used += line_tokens
+    kept_digests.reverse()
+    if not kept_raw and not kept_digests:
         return ""
+    lines = ["<群聊动态>"] + kept_digests
+    if kept_raw:
+        lines.append("最近发言：")
+        lines.extend(kept_raw)
+    lines.append("</群聊动态>")
+    return "\n".join(lines)
+
+async def get_memory_content(
+    key: str,
+    budget: Optional[int] = None,
+    reserved_tokens: int = 0,
+    query: Optional[str] = None,
+    speaker: Optional[str] = None
+) -> str:
+    """获取用于AI调用的记忆内容（纯数据读取，无外部依赖）
     
-    content = []
-    if memory["summary"]:
-        content.append("[历史对话摘要]")
-        content.append(memory["summary"])
+    Args:
+        key: 记忆键
+        budget: 本次请求的总token预算，None表示不限制
+        reserved_tokens: 提示词、新消息等固定部分已占用的token数
+        query: 新消息内容，用于从归档记录中检索相关内容
+        speaker: 提问用户的QQ号；群聊中只附带该用户的画像和与其相关的记录
     
-    if memory["history"]:
-        # 获取最大历史记录数配置
-        max_history = config_manager.get_value("config.json", "max_history", 30)
-        # 限制历史记录数量
-        recent_history = memory["history"][-max_history*2:]  # 每个对话包含用户和AI两条消息
+    预算不足时优先保留摘要（最多占可用预算的 SUMMARY_BUDGET_RATIO），
+    然后是相关记录（最多占 RETRIEVAL_BUDGET_RATIO），
+    其余预算从最新的历史记录开始填充，放不下的最早记录被丢弃或截断
+    
+    在锁内取记忆快照，读取时不会看到写入或总结进行到一半的记忆
+    """
+    # 获取最大历史记录数配置，作为历史条数的上限
+    max_history = config_manager.snapshot().max_history
+    async with get_memory_lock(key):
+        memory = await run_io(load_memory, key)
+        summary_text = memory["summary"]
+        history_count = len(memory["history"])
+        candidates = memory["history"][-max_history*2:]  # 每个对话包含用户和AI两条消息
+        participants = memory["participants"]
+        digests = memory.get("digests", [])
         
+        # 发言者聚焦：只保留提问用户、AI及提到该用户的记录，另附带该用户的画像
+        focus = config_manager.get_value("config.json", "speaker_focus", {})
+        focused = bool(speaker and key.startswith("group_") and focus.get("enabled", True))
+        full_candidates = candidates
+        profile_text = ""
+        if focused:
+            speaker_pid = participants.user_ids.get(speaker)
+            mention_names = set()
+            if speaker_pid is not None:
+                mention_names = {name for name in participants.rows[speaker_pid][2:4] if name}
+            candidates = select_focus_entries(
+                full_candidates, speaker_pid, AI_ID, mention_names,
+                max_history * 2, focus.get("context_lines", 3)
+            )
+            profile_text = get_profile(memory.get("profiles", {}), speaker)
+            speaker_label = participants.label(speaker_pid) if speaker_pid is not None else speaker
+    
+    # 摘要模式：最近的每分钟摘要和环形缓冲区中的最近原始消息
+    digest_block = ""
+    if digests or key in digest_manager.buffers:
+        digest_options = config_manager.get_value("config.json", "digest_mode", {})
+        digest_lines = [format_digest(digest) for digest in digests[-digest_options.get("prompt_digests", 10):]]
+        raw_lines = digest_manager.recent_lines(
+            key, digest_options.get("raw_lines", 10), digest_options.get("raw_max_age", 600)
+        )
+        digest_block = build_digest_block(
+            digest_lines, raw_lines,
+            None if budget is None else int(max(budget - reserved_tokens, 0) * DIGEST_BUDGET_RATIO)
+        )
+    
+    related = await get_related_content(
+        key, query,
+        None if budget is None else int(max(budget - reserved_tokens, 0) * RETRIEVAL_BUDGET_RATIO)
+    ) if query else ""
+    if not summary_text and not candidates and not related and not digest_block and not profile_text:
+        return ""
+    
+    available = None if budget is None else max(budget - reserved_tokens, 0)
+    
+    content = []
+    summary_tokens = 0
+    if summary_text:
+        summary = summary_text
+        if available is not None:
+            summary_cap = int(available * SUMMARY_BUDGET_RATIO) if candidates else available
+            summary = truncate_to_tokens(summary, summary_cap - estimate_tokens("[历史对话摘要]"))
+        if summary:
+            content.append("[历史对话摘要]")
+            content.append(summary)
+            summary_tokens = estimate_tokens("[历史对话摘要]") + estimate_tokens(summary)
+    
+    profile_tokens = 0
+    if profile_text:
+        profile_block = f"<用户画像>\n{speaker_label}: {profile_text}\n</用户画像>"
+        content.append(profile_block)
+        profile_tokens = estimate_tokens(profile_block)
+    
+    related_tokens = estimate_tokens(related)
+    if related:
+        content.append(related)
+    
+    digest_tokens = estimate_tokens(digest_block)
+    if digest_block:
+        content.append(digest_block)
+    
+    history_lines = []
+    history_tokens = 0
+    if candidates:
+        remaining = None if available is None else (
+            available - summary_tokens - profile_tokens - related_tokens - digest_tokens
+            - estimate_tokens("<对话历史></对话历史>")
+        )
+        label_cache = {}
+        newer_content = None
+        # 从最新的记录开始填充预算
+        for item in reversed(candidates):
+            # 旧记录中的CQ码简写为媒体标记，连续重复的内容只保留一条
+            content_text = abbreviate_media(item.content)
+            if not content_text or content_text == newer_content:
+                continue
+            newer_content = content_text
+            if item.pid not in label_cache:
+                label = participants.label(item.pid)
+                label_cache[item.pid] = (label, estimate_tokens(label) + 1)
+            label, label_tokens = label_cache[item.pid]
+            text_tokens = entry_tokens(item) if content_text is item.content else estimate_tokens(content_text)
+            line_tokens = label_tokens + text_tokens
+            if remaining is not None and line_tokens > remaining:
+                # 预算不足以放下完整记录时，截断这条最早的记录后停止
+                truncated = truncate_tail_to_tokens(content_text, remaining - label_tokens)
+                if truncated and remaining - label_tokens >= MIN_TRUNCATED_TOKENS:
+                    history_lines.append(f"{label}: {truncated}")
+                    history_tokens += label_tokens + estimate_tokens(truncated)
+                break
+            history_lines.append(f"{label}: {content_text}")
+            history_tokens += line_tokens
+            if remaining is not None:
+                remaining -= line_tokens
+        history_lines.reverse()
+    
+    if history_lines:
         # 将对话历史用<对话历史>标签包裹
         content.append("<对话历史>")
-        for item in recent_history:
-            content.append(f"{parse_role_info(item['role'])}: {item['content']}")
+        content.extend(history_lines)
         content.append("</对话历史>")
     
+    focus_note = ""
+    if focused:
+        # 与不聚焦时候选记录的总token数比较，记录节省量
+        full_tokens = sum(estimate_tokens(participants.label(item.pid)) + 1 + entry_tokens(item) for item in full_candidates)
+        focus_note = f", 聚焦发言者: {len(candidates)}/{len(full_candidates)}条（候选 {full_tokens} -> {history_tokens + profile_tokens} token）"
+    
+    if budget is not None:
+        print(
+            f"上下文预算 [{key}] 总预算: {budget}, 固定部分: {reserved_tokens}, "
+            f"摘要: {summary_tokens}, 画像: {profile_tokens}, 相关记录: {related_tokens}, 群聊动态: {digest_tokens}, "
+            f"历史: {history_tokens}（{len(history_lines)}/{history_count}条）{focus_note}"
+        )
+    
     return "\n".join(content)
 
 # 指令处理部分保持不变（仅依赖本地函数）
@@ -525,13 +1100,14 @@ async def handle_delete_memory(event: MessageEvent, command_text: str) -> bool:
     else:
         target_key = get_memory_key(event)
     
-    path = get_memory_path(target_key)
-    if os.path.exists(path):
-        try:
-            os.remove(path)
-            await get_bot().send(event, f"已删除{'个人' if 'user_' in target_key else '群组'}记忆")
-        except Exception as e:
-            await get_bot().send(event, f"删除记忆失败: {str(e)}")
+    try:
+        async with get_memory_lock(target_key):
+            deleted = await run_io(memory_store.delete, target_key)
+    except Exception as e:
+        await get_bot().send(event, f"删除记忆失败: {str(e)}")
+        return True
+    if deleted:
+        await get_bot().send(event, f"已删除{'个人' if 'user_' in target_key else '群组'}记忆")
     else:
         await get_bot().send(event, "没有找到可删除的记忆")
     
@@ -544,13 +1120,25 @@ async def handle_delete_memory(event: MessageEvent, command_text: str) -> bool:
 )
 async def handle_show_memory_status(event: MessageEvent, _: str) -> bool:
     key = get_memory_key(event)
-    memory = load_memory(key)
+    async with get_memory_lock(key):
+        memory = await run_io(load_memory, key)
     
     status = [
         f"总结长度: {len(memory['summary'])}字",
         f"最近记录数: {len(memory['history'])//2}轮对话",
         f"上次总结: {datetime.fromtimestamp(memory['last_summary_time']).strftime('%Y-%m-%d %H:%M') if memory['last_summary_time'] else '未总结'}"
     ]
+    if "profiles" in memory:
+        status.append(f"用户画像: {len(memory['profiles'])}人")
+    
+    job_status = summary_worker.get_status(key)
+    if job_status:
+        status.append(f"总结任务状态: {job_status.state}")
+        status.append(f"总结失败次数: 累计{job_status.failures}次，连续{job_status.attempts}次")
+        if job_status.last_error:
+            status.append(f"最近错误: {job_status.last_error[:50]}")
+        if job_status.state == STATE_FAILED and job_status.next_retry_at:
+            status.append(f"下次重试: {datetime.fromtimestamp(job_status.next_retry_at).strftime('%Y-%m-%d %H:%M:%S')}")
     
     await get_bot().send(event, f"当前{'个人' if 'user_' in key else '群组'}记忆状态:\n" + "\n".join(status))
     return True
@@ -588,17 +1176,17 @@ async def handle_memory_config(event: MessageEvent, args: str) -> bool:
     try:
         # 更新配置
         if param_name == "max_history":
-            if config_manager.set_value("config.json", "max_history", int(param_value)):
+            if await run_io(config_manager.set_value, "config.json", "max_history", int(param_value)):
                 await get_bot().send(event, f"已更新记忆配置: {param_name} = {param_value}")
             else:
                 await get_bot().send(event, "更新配置失败（存储错误）")
         elif param_name == "summary_threshold":
-            if config_manager.set_value("config.json", "summary_threshold", int(param_value)):
+            if await run_io(config_manager.set_value, "config.json", "summary_threshold", int(param_value)):
                 await get_bot().send(event, f"已更新记忆配置: {param_name} = {param_value}")
             else:
                 await get_bot().send(event, "更新配置失败（存储错误）")
         elif param_name == "summary_interval":
-            if config_manager.set_value("config.json", "summary_interval", int(param_value)):
+            if await run_io(config_manager.set_value, "config.json", "summary_interval", int(param_value)):
                 await get_bot().send(event, f"已更新记忆配置: {param_name} = {param_value}")
             else:
                 await get_bot().send(event, "更新配置失败（存储错误）")
@@ -606,4 +1194,283 @@ async def handle_memory_config(event: MessageEvent, args: str) -> bool:
             await get_bot().send(event, f"未知的参数名: {param_name}")
     except ValueError:
         await get_bot().send(event, "参数值必须为数字")
-    return True
\ No newline at end of file
+    return True
+
+@register_command(
+    command=["记忆总结", "memory summarize"],
+    description="立即为当前场景或所有聊天补做记忆总结（仅管理员）",
+    usage="\\记忆总结 [all] 或 \\memory summarize [all]（all：为所有达到总结阈值的聊天补做总结）"
+)
+async def handle_memory_summarize(event: MessageEvent, command_text: str) -> bool:
+    user_id = str(event.user_id)
+    if not is_admin(user_id):
+        await get_bot().send(event, "无权限执行此操作（仅管理员可触发记忆总结）")
+        return True
+    
+    if summary_params_provider is None:
+        await get_bot().send(event, "总结参数未初始化，暂时无法执行总结")
+        return True
+    
+    params = summary_params_provider()
+    params["ignore_interval"] = True
+    
+    parts = command_text.split()
+    if parts and parts[-1].lower() in ["all", "全部"]:
+        # 批量补做：为所有达到阈值的聊天提交后台任务
+        # 先用索引中的条目数和内容长度筛选，只加载可能需要总结的记忆
+        summary_threshold = config_manager.get_value("config.json", "summary_threshold", 50)
+        index = await run_io(memory_store.get_index)
+        candidates = [
+            key for key, entry in index.items()
+            if entry["entries"] >= summary_threshold or entry["chars"] >= SUMMARY_LENGTH_LIMIT
+        ]
+        submitted = 0
+        for key in candidates:
+            async with get_memory_lock(key):
+                ready = need_summary(await run_io(load_memory, key), ignore_interval=True)
+            if ready:
+                if summary_worker.submit(key, dict(params), immediate=True):
+                    submitted += 1
+        await get_bot().send(event, f"已提交 {submitted} 个后台总结任务（并发上限 {summary_worker.concurrency}）")
+    else:
+        key = get_memory_key(event)
+        params["event"] = event
+        async with get_memory_lock(key):
+            ready = need_summary(await run_io(load_memory, key), ignore_interval=True)
+        if not ready:
+            await get_bot().send(event, "当前记忆未达到总结阈值，无需总结")
+        elif summary_worker.submit(key, params, immediate=True):
+            await get_bot().send(event, "已提交后台总结任务")
+        else:
+            await get_bot().send(event, "当前场景已有待执行的总结任务")
+    return True
+
+@register_command(
+    command=["记忆索引", "memory index"],
+    description="管理归档记录的本地检索索引（仅管理员）",
+    usage="\\记忆索引 [status/build/compact] [all] 或 \\memory index [status/build/compact] [all]\nbuild：根据归档记录重建索引，compact：合并索引段"
+)
+async def handle_memory_index(event: MessageEvent, command_text: str) -> bool:
+    user_id = str(event.user_id)
+    if not is_admin(user_id):
+        await get_bot().send(event, "无权限执行此操作（仅管理员可管理记忆索引）")
+        return True
+    
+    command_str = command_text[1:].strip()
+    if command_str.startswith("memory index"):
+        args = command_str[12:].split()
+    else:
+        args = command_str[4:].split()
+    action = args[0].lower() if args else "status"
+    all_keys = len(args) > 1 and args[1].lower() in ["all", "全部"]
+    
+    keys = retrieval_store.list_keys() if all_keys else [get_memory_key(event)]
+    keys = [key for key in keys if retrieval_store.has_archive(key)]
+    if not keys:
+        await get_bot().send(event, "没有找到归档记录")
+        return True
+    
+    if action == "status":
+        lines = []
+        for key in keys:
+            stats = await call_retrieval(key, "stats")
+            lines.append(f"{key}: 归档消息 {stats['documents']} 条，索引段 {stats['segments']} 个，词项 {stats['terms']} 个")
+        await get_bot().send(event, "记忆索引状态:\n" + "\n".join(lines[:20]) + (f"\n...共 {len(lines)} 个" if len(lines) > 20 else ""))
+    elif action == "build":
+        total = 0
+        for key in keys:
+            total += await call_retrieval(key, "rebuild")
+        await get_bot().send(event, f"已重建 {len(keys)} 个索引，共 {total} 条归档消息")
+    elif action == "compact":
+        merged = 0
+        for key in keys:
+            merged += await call_retrieval(key, "compact")
+        await get_bot().send(event, f"已压缩 {len(keys)} 个索引，合并索引段 {merged} 个")
+    else:
+        await get_bot().send(event, f"未知的操作：{action}\n支持的操作：status/build/compact")
+    return True
+
+@register_command(
+    command=["记忆存储", "memory storage"],
+    description="查看记忆分层存储状态或立即执行清理（仅管理员）",
+    usage="\\记忆存储 [sweep] 或 \\memory storage [sweep]\nsweep：立即移出空闲记忆并压缩长时间未活跃的记忆"
+)
+async def handle_memory_storage(event: MessageEvent, command_text: str) -> bool:
+    user_id = str(event.user_id)
+    if not is_admin(user_id):
+        await get_bot().send(event, "无权限执行此操作（仅管理员可管理记忆存储）")
+        return True
+    
+    parts = command_text.split()
+    if parts and parts[-1].lower() in ["sweep", "清理"]:
+        stats = await sweep_memory()
+        await get_bot().send(
+            event,
+            f"记忆清理完成：移出内存 {stats['evicted']} 个，"
+            f"压缩 {stats['compressed']} 个（节省 {stats['saved_bytes'] / 1024:.1f}KB）"
+        )
+        return True
+    
+    # 统计信息全部来自索引，不打开记忆文件
+    index = await run_io(memory_store.get_index)
+    usage = {"warm": 0, "cold": 0}
+    counts = {"warm": 0, "cold": 0}
+    for entry in index.values():
+        usage[entry["tier"]] += entry["size"]
+        counts[entry["tier"]] += 1
+    storage = config_manager.get_value("config.json", "memory_storage", {})
+    legacy = await run_io(memory_store.legacy_keys)
+    disk = get_disk_executor().stats()
+    status = [
+        f"记忆总数: {len(index)}（私聊 {sum(1 for key in index if key.startswith('user_'))}，群聊 {sum(1 for key in index if key.startswith('group_'))}）",
+        f"历史记录总条数: {sum(entry['entries'] for entry in index.values())}",
+        f"内存中: {len(memory_store.hot)}个，约{memory_store.hot_bytes / 1048576:.1f}MB（上限{storage.get('hot_max_mb', 64)}MB）",
+        f"未压缩文件: {counts['warm']}个，{usage['warm'] / 1048576:.1f}MB",
+        f"压缩归档: {counts['cold']}个，{usage['cold'] / 1048576:.1f}MB",
+        f"磁盘预算: {storage.get('disk_budget_mb', 1024)}MB，超过{storage.get('cold_after_days', 14)}天未活跃的记忆自动压缩",
+        f"锁分段: {MEMORY_LOCK_STRIPES}个，占用中{sum(1 for lock in memory_locks if lock is not None and lock.locked())}个",
+        f"磁盘读写线程: {disk['workers']}个，执行中{disk['running']}个，排队{disk['queued']}个（峰值{disk['peak_queued']}），"
+        f"排队等待平均{disk['avg_wait_ms']:.1f}ms/最长{disk['max_wait_ms']:.0f}ms，已完成{disk['completed']}次（失败{disk['failed']}次）"
+    ]
+    if legacy:
+        status.append(f"旧版目录中待迁移: {len(legacy)}个（使用 \\记忆迁移 迁移）")
+    await get_bot().send(event, "记忆存储状态:\n" + "\n".join(status))
+    return True
+
+@register_command(
+    command=["记忆过滤", "memory filter"],
+    description="查看写入记忆前的消息过滤统计（仅管理员）",
+    usage="\\记忆过滤 [all] 或 \\memory filter [all]（all：查看所有聊天）"
+)
+async def handle_memory_filter(event: MessageEvent, command_text: str) -> bool:
+    user_id = str(event.user_id)
+    if not is_admin(user_id):
+        await get_bot().send(event, "无权限执行此操作（仅管理员可查看过滤统计）")
+        return True
+    
+    rule_names = {"media": "纯媒体", "short": "过短", "regex": "正则", "duplicate": "重复/刷屏"}
+    
+    def format_stats(key: str) -> str:
+        stats = ingest_pipeline.get_stats(key)
+        hits = "，".join(f"{label} {stats[rule]}" for rule, label in rule_names.items() if stats[rule])
+        return (
+            f"{key}: 收到 {stats['total']} 条，丢弃 {stats['dropped']} 条"
+            + (f"（{hits}）" if hits else "")
+            + (f"，媒体简写 {stats['media_rewritten']} 条" if stats["media_rewritten"] else "")
+        )
+    
+    parts = command_text.split()
+    if parts and parts[-1].lower() in ["all", "全部"]:
+        keys = sorted(ingest_pipeline.stats, key=lambda key: ingest_pipeline.stats[key]["dropped"], reverse=True)
+        if not keys:
+            await get_bot().send(event, "暂无过滤统计")
+            return True
+        lines = [format_stats(key) for key in keys[:20]]
+        if len(keys) > 20:
+            lines.append(f"...共 {len(keys)} 个聊天")
+        await get_bot().send(event, "消息过滤统计（自启动以来）:\n" + "\n".join(lines))
+    else:
+        await get_bot().send(event, "消息过滤统计（自启动以来）:\n" + format_stats(get_memory_key(event)))
+    return True
+
+@register_command(
+    command=["摘要模式", "memory digest"],
+    description="为高流量群开启/关闭摘要模式（仅管理员）",
+    usage="\\摘要模式 [on/off/status] 或 \\memory digest [on/off/status]\n开启后消息速率超过阈值时，未@机器人的消息只保留每分钟摘要和最近几条原文"
+)
+async def handle_memory_digest(event: MessageEvent, command_text: str) -> bool:
+    user_id = str(event.user_id)
+    if not is_admin(user_id):
+        await get_bot().send(event, "无权限执行此操作（仅管理员可设置摘要模式）")
+        return True
+    if event.message_type != "group":
+        await get_bot().send(event, "摘要模式仅适用于群聊")
+        return True
+    
+    key = get_memory_key(event)
+    parts = command_text.split()
+    action = parts[-1].lower() if len(parts) > 1 and parts[-1].lower() in ["on", "off", "status"] else "status"
+    
+    if action in ["on", "off"]:
+        if await run_io(get_chat_state().set, key, FIELD_DIGEST, True if action == "on" else None):
+            await get_bot().send(event, f"已{'开启' if action == 'on' else '关闭'}本群的摘要模式")
+        else:
+            await get_bot().send(event, "设置摘要模式失败（存储错误）")
+        return True
+    
+    options = config_manager.get_value("config.json", "digest_mode", {})
+    async with get_memory_lock(key):
+        digest_count = len((await run_io(load_memory, key)).get("digests", []))
+    status = [
+        f"摘要模式: {'已开启' if is_digest_enabled(key) else '未开启'}",
+        f"最近一分钟消息数: {digest_manager.rate(key)}（阈值 {options.get('rate_threshold', 60)}）",
+        f"当前状态: {'摘要中' if digest_manager.active.get(key) else '逐条记录'}",
+        f"已保存每分钟摘要: {digest_count}条"
+    ]
+    buffer_stats = digest_manager.stats(key)
+    if buffer_stats:
+        status.append(
+            f"缓冲区: {buffer_stats['buffered']}条，待摘要 {buffer_stats['pending']}条，"
+            f"未摘要即被挤出 {buffer_stats['dropped']}条"
+        )
+    await get_bot().send(event, "本群摘要模式状态:\n" + "\n".join(status))
+    return True
+
+@register_command(
+    command=["记忆迁移", "memory migrate"],
+    description="将旧版平铺目录中的记忆迁移到分片目录并重建索引（仅管理员）",
+    usage="\\记忆迁移 或 \\memory migrate"
+)
+async def handle_memory_migrate(event: MessageEvent, _: str) -> bool:
+    user_id = str(event.user_id)
+    if not is_admin(user_id):
+        await get_bot().send(event, "无权限执行此操作（仅管理员可迁移记忆）")
+        return True
+    
+    keys = await run_io(memory_store.legacy_keys)
+    await get_bot().send(event, f"开始迁移 {len(keys)} 个记忆...")
+    moved = 0
+    failed = 0
+    for key in keys:
+        # 逐个加锁迁移，迁移期间该记忆的读写会等待
+        async with get_memory_lock(key):
+            try:
+                if await run_io(memory_store.migrate_key, key):
+                    moved += 1
+            except Exception as e:
+                failed += 1
+                print(f"迁移记忆失败 [{key}]: {str(e)}")
+    total = await run_io(memory_store.rebuild_index)
+    await get_bot().send(
+        event,
+        f"迁移完成：移动 {moved} 个记忆" + (f"，失败 {failed} 个" if failed else "") + f"，索引中共 {total} 个记忆"
+    )
+    return True
+
+@register_command(
+    command=["消息索引", "message index"],
+    description="查看引用消息解析和群成员缓存的命中率（仅管理员）",
+    usage="\\消息索引 或 \\message index"
+)
+async def handle_message_index(event: MessageEvent, _: str) -> bool:
+    user_id = str(event.user_id)
+    if not is_admin(user_id):
+        await get_bot().send(event, "无权限执行此操作（仅管理员可查看消息索引）")
+        return True
+    
+    stats = get_message_index().hit_rates()
+    status = [
+        f"引用解析次数: {stats['total']}",
+        f"索引命中率: {stats['hit_rate']:.1%}（内存 {stats['memory']}，磁盘 {stats['disk']}）",
+        f"使用适配器附带的引用: {stats['event']}",
+        f"调用get_msg接口: {stats['api']}",
+        f"未找到: {stats['miss']}",
+        f"内存中消息数: {stats['cached']}，磁盘中消息数: {stats['on_disk']}"
+    ]
+    member_stats = member_cache.stats()
+    status.append(
+        f"群成员缓存: {member_stats['groups']}个群，{member_stats['members']}人，"
+        f"名称命中率 {member_stats['hit_rate']:.1%}（命中 {member_stats['hits']}，未命中 {member_stats['misses']}）"
+    )
+    await get_bot().send(event, "消息索引状态:\n" + "\n".join(status))
+    return True
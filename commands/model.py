@@ -4,6 +4,7 @@ from nonebot import get_bot
 from nonebot.adapters.onebot.v11 import MessageEvent
 from . import register_command, is_admin
 from ..utils.config import config_manager
+from ..utils.disk_io import run_io
 from ..models.model_factory import ModelFactory
 
 def load_model_config() -> Dict[str, any]:
@@ -28,11 +29,11 @@ def load_model_config() -> Dict[str, any]:
 def save_model_config(config: Dict[str, any]) -> bool:
     """保存模型配置"""
     try:
-        # 使用配置管理器保存各配置项
-        for key, value in config.items():
-            if not config_manager.set_value("model_config.json", key, value):
-                return False
-        return True
+        # 合并所有配置项后只保存一次；嵌套的字典也复制一份，缓存中的配置和日志不与调用方共享可变对象
+        with config_manager.lock:
+            model_config = dict(config_manager.load_config("model_config.json"))
+            model_config.update({key: dict(value) if isinstance(value, dict) else value for key, value in config.items()})
+            return config_manager.save_config("model_config.json", model_config)
     except Exception as e:
         print(f"保存模型配置失败：{str(e)}")
         return False
@@ -83,7 +84,7 @@ async def handle_switch_model(event: MessageEvent, command_text: str) -> bool:
             return True
         
         # 直接使用配置管理器设置当前模型
-        if config_manager.set_value("model_config.json", "current_model", model_id):
+        if await run_io(config_manager.set_value, "model_config.json", "current_model", model_id):
             await get_bot().send(event, 
                 f"已切换模型为：{model_id}（{models[model_id]}）")
             # 清除模型工厂的缓存
@@ -152,17 +153,15 @@ async def handle_set_api_key(event: MessageEvent, command_text: str) -> bool:
         if not model_id or not api_key:
             raise ValueError
         
-        config = load_model_config()
         supported_models = ModelFactory.get_supported_models()
         if model_id not in supported_models:
             await get_bot().send(event, f"模型ID不存在！支持的模型：{', '.join(supported_models.keys())}")
             return True
         
-        if "api_keys" not in config:
-            config["api_keys"] = {}
-        config["api_keys"][model_id] = api_key
+        # 构建新的密钥表后整体写入（模型ID含"."，不能作为 set_value 的键路径），不修改缓存中的配置
+        api_keys = {**load_model_config()["api_keys"], model_id: api_key}
         
-        if save_model_config(config):
+        if await run_io(config_manager.set_value, "model_config.json", "api_keys", api_keys):
             await get_bot().send(event, f"已设置 {model_id} 的API密钥")
         else:
             await get_bot().send(event, "设置密钥失败（存储错误）")
@@ -189,7 +188,7 @@ async def handle_set_cooldown(event: MessageEvent, command_text: str) -> bool:
         
         if command_str.startswith("model cooldown"):
             # 英文命令格式：model cooldown 模型ID 秒数
-            parts = command_str[13:].strip().split(" ", 1)
+            parts = command_str[len("model cooldown"):].strip().split(" ", 1)
             if len(parts) < 2:
                 raise ValueError("缺少冷却时间")
             model_id = parts[0].strip()
@@ -197,7 +196,7 @@ async def handle_set_cooldown(event: MessageEvent, command_text: str) -> bool:
         else:
             # 中文命令格式：设置模型冷却时间 模型ID 秒数
             if command_str.startswith("设置模型冷却时间"):
-                parts = command_str[7:].strip().split(" ", 1)
+                parts = command_str[len("设置模型冷却时间"):].strip().split(" ", 1)
                 if len(parts) < 2:
                     raise ValueError("缺少冷却时间")
                 model_id = parts[0].strip()
@@ -216,17 +215,15 @@ async def handle_set_cooldown(event: MessageEvent, command_text: str) -> bool:
         if seconds < 1:
             raise ValueError("冷却时间必须为正整数")
         
-        config = load_model_config()
         supported_models = ModelFactory.get_supported_models()
         if model_id not in supported_models:
             await get_bot().send(event, f"模型ID不存在！支持的模型：{', '.join(supported_models.keys())}")
             return True
         
-        if "cooldowns" not in config:
-            config["cooldowns"] = {}
-        config["cooldowns"][model_id] = seconds
+        # 同上，构建新的冷却时间表后整体写入
+        cooldowns = {**load_model_config()["cooldowns"], model_id: seconds}
         
-        if save_model_config(config):
+        if await run_io(config_manager.set_value, "model_config.json", "cooldowns", cooldowns):
             await get_bot().send(event, f"已设置 {model_id} 的冷却时间为 {seconds} 秒")
         else:
             await get_bot().send(event, "设置冷却时间失败（存储错误）")
@@ -237,4 +234,8 @@ async def handle_set_cooldown(event: MessageEvent, command_text: str) -> bool:
 
 def get_current_model() -> str:
     """获取当前模型ID（供主程序调用）"""
-    return config_manager.get_value("model_config.json", "current_model", "gemini-2.5-pro")
\ No newline at end of file
+    return config_manager.snapshot().current_model
+
+def get_context_budget(model_id: str) -> int:
+    """获取指定模型单次请求的上下文token预算（提示词+记忆+新消息），未单独配置时使用 context_budgets.default"""
+    return config_manager.snapshot().context_budget(model_id)
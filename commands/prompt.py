@@ -5,106 +5,73 @@ from nonebot import get_bot
 from nonebot.adapters.onebot.v11 import MessageEvent, MessageSegment
 from . import register_command
 from ..utils.config import config_manager
+from ..utils.chat_state import get_chat_state, chat_key, FIELD_PROMPTS
+from ..utils.disk_io import run_io
 
-# 初始化提示词配置文件
-prompts_config = config_manager.load_config("prompts_config.json")
-if "prompts" not in prompts_config:
-    prompts_config["prompts"] = {}
-    config_manager.save_config("prompts_config.json", prompts_config)
-    
-if "status" not in prompts_config:
-    prompts_config["status"] = {}
-    config_manager.save_config("prompts_config.json", prompts_config)
+# prompts_config.json 缺少的 prompts/status 由配置管理器按默认配置补全，导入时无需写入
 
 def load_prompts() -> Dict[str, str]:
-    """从prompts_config.json加载提示词"""
+    """从prompts_config.json加载提示词（返回配置缓存中的字典，修改前先复制）"""
     prompts_config = config_manager.load_config("prompts_config.json")
     return prompts_config.get("prompts", {})
 
 # 保留独立的提示词状态加载/保存函数
 def load_prompt_status(context: str = None) -> Dict[str, bool]:
     """
-    从prompts_config.json加载提示词启用状态
-    context: 聊天环境标识，None时返回所有环境的状态
+    加载提示词启用状态（按聊天存储，只记录被禁用的提示词，其余默认启用）
+    context: 聊天环境标识，None时返回所有环境记录的禁用项
     """
-    prompts_config = config_manager.load_config("prompts_config.json")
-    all_status = prompts_config.get("context_status", {})
-    
+    chat_state = get_chat_state()
     if context:
-        # 返回指定环境的状态，如果不存在则初始化并返回默认值（全部启用）
-        if context not in all_status:
-            prompts = load_prompts()
-            all_status[context] = {name: True for name in prompts.keys()}
-            # 保存初始化的状态
-            prompts_config["context_status"] = all_status
-            config_manager.save_config("prompts_config.json", prompts_config)
-        return all_status[context]
+        overrides = chat_state.prompt_overrides(chat_key(context))
+        return {name: overrides.get(name, True) for name in load_prompts()}
     else:
-        return all_status
+        return {key: dict(state[FIELD_PROMPTS]) for key, state in chat_state.items() if state.get(FIELD_PROMPTS)}
 
 def save_prompt_status(status: Dict[str, bool], context: str = None) -> bool:
     """
-    保存提示词状态到prompts_config.json
-    context: 聊天环境标识，None时保存所有环境的状态
+    保存提示词状态
+    context: 聊天环境标识，None时保存到prompts_config.json的根级status
     """
     try:
-        prompts_config = config_manager.load_config("prompts_config.json")
         if context:
-            # 保存指定环境的状态
-            all_status = prompts_config.get("context_status", {})
-            all_status[context] = status
-            prompts_config["context_status"] = all_status
-        else:
-            # 兼容旧版，保存到根级status（不推荐使用）
-            prompts_config["status"] = status
-        return config_manager.save_config("prompts_config.json", prompts_config)
+            # 只写入该聊天自己的状态文件
+            return get_chat_state().set_prompt_status(chat_key(context), status)
+        # 兼容旧版，保存到根级status（不推荐使用）
+        with config_manager.lock:
+            prompts_config = config_manager.load_config("prompts_config.json")
+            return config_manager.save_config("prompts_config.json", {**prompts_config, "status": dict(status)})
     except Exception as e:
         print(f"保存提示词状态失败：{str(e)}")
         return False
 
-def init_prompt_status():
-    """初始化提示词配置"""
-    prompts_config = config_manager.load_config("prompts_config.json")
-    
-    # 确保有prompts字段
-    if "prompts" not in prompts_config:
-        prompts_config["prompts"] = {}
-        config_manager.save_config("prompts_config.json", prompts_config)
-    
-    # 确保有context_status字段
-    if "context_status" not in prompts_config:
-        prompts_config["context_status"] = {}
-        config_manager.save_config("prompts_config.json", prompts_config)
-
-init_prompt_status()
-
-
 def save_prompts(prompts: Dict[str, str]) -> bool:
-    """保存提示词到prompts_config.json（同步更新所有环境的状态）"""
+    """保存提示词到prompts_config.json（新增提示词在各聊天中默认启用，无需逐个同步）
+    
+    配置缓存中的字典不做原地修改（其他读取方和配置快照可能正在使用），写入新构建的配置
+    """
     try:
-        prompts_config = config_manager.load_config("prompts_config.json")
-        prompts_config["prompts"] = prompts
-        
-        # 同步所有环境的状态（新增提示词默认启用）
-        all_status = prompts_config.get("context_status", {})
-        for context, status in all_status.items():
-            for name in prompts:
-                if name not in status:
-                    status[name] = True
-        prompts_config["context_status"] = all_status
-        
-        # 兼容旧版状态
-        old_status = prompts_config.get("status", {})
-        for name in prompts:
-            if name not in old_status:
-                old_status[name] = True
-        prompts_config["status"] = old_status
-        
-        return config_manager.save_config("prompts_config.json", prompts_config)
+        with config_manager.lock:
+            prompts_config = config_manager.load_config("prompts_config.json")
+            # 兼容旧版状态：只保留现有提示词的记录，新增的默认启用
+            old_status = prompts_config.get("status", {})
+            status = {name: old_status.get(name, True) for name in prompts}
+            return config_manager.save_config(
+                "prompts_config.json",
+                {**prompts_config, "prompts": dict(prompts), "status": status}
+            )
     except Exception as e:
         print(f"保存提示词失败：{str(e)}")
         return False
 
+def remove_prompt_overrides(name: str) -> None:
+    """清除各聊天中该提示词的启用/禁用记录"""
+    chat_state = get_chat_state()
+    for key, state in list(chat_state.items()):
+        overrides = state.get(FIELD_PROMPTS, {})
+        if name in overrides:
+            chat_state.set(key, FIELD_PROMPTS, {n: v for n, v in overrides.items() if n != name} or None)
+
 @register_command(
     command=["创建提示词", "prompt create"],
     description="创建新的提示词预设",
@@ -147,8 +114,8 @@ async def handle_create_prompt(event: MessageEvent, command_text: str) -> bool:
             await bot.send(event, f"提示词 `{name}` 已存在！")
             return True
         
-        prompts[name] = content
-        if save_prompts(prompts):
+        prompts = {**prompts, name: content}
+        if await run_io(save_prompts, prompts):
             bot = get_bot()
             await bot.send(event, f"已创建提示词 `{name}`")
         else:
@@ -198,23 +165,11 @@ async def handle_delete_prompt(event: MessageEvent, command_text: str) -> bool:
             await bot.send(event, f"提示词 `{name}` 不存在！")
             return True
         
-        del prompts[name]
-        if save_prompts(prompts):
-            # 直接从配置文件加载和修改所有环境的状态，更高效
-            prompts_config = config_manager.load_config("prompts_config.json")
-            
-            # 处理所有聊天环境的状态
-            if "context_status" in prompts_config:
-                for context, status in prompts_config["context_status"].items():
-                    if name in status:
-                        del status[name]
-                # 保存更新后的配置
-                config_manager.save_config("prompts_config.json", prompts_config)
-            
-            # 兼容旧版，删除根级status中的记录
-            if "status" in prompts_config and name in prompts_config["status"]:
-                del prompts_config["status"][name]
-                config_manager.save_config("prompts_config.json", prompts_config)
+        # 根级status中的记录由 save_prompts 随提示词一起删除
+        prompts = {n: content for n, content in prompts.items() if n != name}
+        if await run_io(save_prompts, prompts):
+            # 清除各聊天中该提示词的禁用记录，避免之后创建的同名提示词仍被禁用
+            await run_io(remove_prompt_overrides, name)
             
             bot = get_bot()
             await bot.send(event, f"已删除提示词 `{name}`（所有聊天环境的状态已同步更新）")
@@ -377,7 +332,7 @@ async def handle_enable_prompt(event: MessageEvent, command_text: str) -> bool:
     status = load_prompt_status(context)
     status[prompt_name] = True
     
-    if save_prompt_status(status, context):
+    if await run_io(save_prompt_status, status, context):
         # 显示当前环境信息
         if context.startswith("group_"):
             env_info = f"[群聊 {context[6:]}] "
@@ -450,7 +405,7 @@ async def handle_disable_prompt(event: MessageEvent, command_text: str) -> bool:
     status = load_prompt_status(context)
     status[prompt_name] = False
     
-    if save_prompt_status(status, context):
+    if await run_io(save_prompt_status, status, context):
         # 显示当前环境信息
         if context.startswith("group_"):
             env_info = f"[群聊 {context[6:]}] "
@@ -480,17 +435,13 @@ def get_all_prompts(event: Optional[MessageEvent] = None) -> str:
     if not prompts:
         return ""
     
-    if event:
-        # 有事件对象时，获取当前聊天环境的状态
-        status = load_prompt_status(get_chat_context(event))
-    else:
-        # 没有事件对象时，使用默认状态（全部启用）
-        status = {name: True for name in prompts.keys()}
+    # 有事件对象时只读取当前聊天被禁用的提示词；没有事件对象时全部启用
+    overrides = get_chat_state().prompt_overrides(chat_key(get_chat_context(event))) if event else {}
     
     # 过滤出已启用的提示词，只返回内容，不包含提示词名称
     enabled_prompts = [
         content  # 只使用提示词内容，不包含名称
         for name, content in prompts.items() 
-        if status.get(name, True)
+        if overrides.get(name, True)
     ]
     return "\n\n".join(enabled_prompts)
\ No newline at end of file
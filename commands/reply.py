@@ -1,6 +1,7 @@
 from nonebot import get_bot
 from nonebot.adapters.onebot.v11 import MessageEvent
-from ..utils.config import config_manager
+from ..utils.chat_state import get_chat_state, FIELD_REPLY, DEFAULT_REPLY_MODE
+from ..utils.disk_io import run_io
 from . import register_command
 from .__init__ import is_admin
 
@@ -10,6 +11,14 @@ def get_status_key(event: MessageEvent) -> str:
     else:
         return f"group_{event.group_id}"
 
+def get_reply_status(key: str) -> str:
+    """读取聊天的回复状态，默认为on"""
+    return get_chat_state().get(key, FIELD_REPLY, DEFAULT_REPLY_MODE)
+
+def set_reply_status(key: str, status: str) -> bool:
+    """保存聊天的回复状态（默认状态不单独记录）"""
+    return get_chat_state().set(key, FIELD_REPLY, None if status == DEFAULT_REPLY_MODE else status)
+
 @register_command(
     command=["回复状态", "reply status"],
     description="设置当前聊天场景的回复状态",
@@ -26,7 +35,7 @@ async def handle_reply_status(event: MessageEvent, command_text: str) -> bool:
         params = command_str[12:].strip().lower()
     else:
         # 获取当前状态并显示帮助信息
-        current_status = config_manager.get_value("config.json", f"reply_status.{key}", "on")
+        current_status = get_reply_status(key)
         await get_bot().send(event, 
                            f"当前回复状态：{current_status}\n" 
                            f"使用格式：\\回复状态 on/off/admin/active 或 \\reply status on/off/admin/active\n" 
@@ -38,7 +47,7 @@ async def handle_reply_status(event: MessageEvent, command_text: str) -> bool:
     
     # 根据参数设置状态
     if params in ["on", "admin", "off", "active"]:
-        if config_manager.set_value("config.json", f"reply_status.{key}", params):
+        if await run_io(set_reply_status, key, params):
             status_text = {
                 "on": "已开启处理所有消息",
                 "admin": "已设置为仅处理管理员消息",
@@ -57,7 +66,7 @@ async def handle_reply_status(event: MessageEvent, command_text: str) -> bool:
 )
 async def handle_enable_reply(event: MessageEvent, _: str) -> bool:
     key = get_status_key(event)
-    if config_manager.set_value("config.json", f"reply_status.{key}", "on"):
+    if await run_io(set_reply_status, key, "on"):
         await get_bot().send(event, "已开启处理所有消息", at_sender=True)
     return True
 
@@ -68,7 +77,7 @@ async def handle_enable_reply(event: MessageEvent, _: str) -> bool:
 )
 async def handle_disable_reply(event: MessageEvent, _: str) -> bool:
     key = get_status_key(event)
-    if config_manager.set_value("config.json", f"reply_status.{key}", "off"):
+    if await run_io(set_reply_status, key, "off"):
         await get_bot().send(event, "已关闭回复功能", at_sender=True)
     return True
 
@@ -79,7 +88,7 @@ async def handle_disable_reply(event: MessageEvent, _: str) -> bool:
 )
 async def handle_active_reply(event: MessageEvent, _: str) -> bool:
     key = get_status_key(event)
-    if config_manager.set_value("config.json", f"reply_status.{key}", "active"):
+    if await run_io(set_reply_status, key, "active"):
         await get_bot().send(event, "已开启主动回复模式（群聊消息有概率触发AI自主回复）", at_sender=True)
     return True
 
@@ -90,14 +99,14 @@ async def handle_active_reply(event: MessageEvent, _: str) -> bool:
 )
 async def handle_admin_only_reply(event: MessageEvent, _: str) -> bool:
     key = get_status_key(event)
-    if config_manager.set_value("config.json", f"reply_status.{key}", "admin"):
+    if await run_io(set_reply_status, key, "admin"):
         await get_bot().send(event, "已设置为仅处理管理员消息", at_sender=True)
     return True
 
 def is_reply_enabled(event: MessageEvent) -> bool:
     key = get_status_key(event)
-    # 使用配置管理器获取回复状态，默认为on
-    reply_status = config_manager.get_value("config.json", f"reply_status.{key}", "on")
+    # 从聊天状态获取回复状态，默认为on
+    reply_status = get_reply_status(key)
     
     # 根据不同状态进行处理
     if reply_status == "off":
@@ -113,5 +122,4 @@ def is_active_mode(event: MessageEvent) -> bool:
     if event.message_type != "group":
         return False
     key = get_status_key(event)
-    reply_status = config_manager.get_value("config.json", f"reply_status.{key}", "on")
-    return reply_status == "active"
\ No newline at end of file
+    return get_reply_status(key) == "active"
\ No newline at end of file
@@ -4,15 +4,15 @@ from nonebot import get_bot
 from nonebot.adapters.onebot.v11 import MessageEvent, MessageSegment
 from . import register_command, is_admin
 from ..utils.config import config_manager
+from ..utils.disk_io import run_io
 
 def is_split_enabled() -> bool:
     """检查文本分割功能是否启用"""
-    return config_manager.get_value("config.json", "split_enabled", False)
+    return config_manager.snapshot().split_enabled
 
 def get_split_prompt() -> str:
     """获取文本分割提示词"""
-    default_prompt = "请将你的回答分成多条简短消息，每条消息控制在1-2句话内（一般不多于20字）。当需要分段时，请使用换行符\n作为每条消息的结束。确保内容连贯自然，符合QQ聊天场景的交流习惯，避免过长段落。"
-    return config_manager.get_value("split_config.json", "prompt", default_prompt)
+    return config_manager.snapshot().split_prompt
 
 def split_text(text: str) -> List[str]:
     """根据换行符分割文本（处理句尾情况）"""
@@ -63,7 +63,7 @@ async def handle_enable_split(event: MessageEvent, _: str) -> bool:
         await get_bot().send(event, "无权限执行此操作（仅管理员可启用文本分割）")
         return True
 
-    if config_manager.set_value("config.json", "split_enabled", True):
+    if await run_io(config_manager.set_value, "config.json", "split_enabled", True):
         await get_bot().send(event, "已启用文本分割功能")
     else:
         await get_bot().send(event, "启用文本分割功能失败（存储错误）")
@@ -80,7 +80,7 @@ async def handle_disable_split(event: MessageEvent, _: str) -> bool:
         await get_bot().send(event, "无权限执行此操作（仅管理员可禁用文本分割）")
         return True
 
-    if config_manager.set_value("config.json", "split_enabled", False):
+    if await run_io(config_manager.set_value, "config.json", "split_enabled", False):
         await get_bot().send(event, "已禁用文本分割功能")
     else:
         await get_bot().send(event, "禁用文本分割功能失败（存储错误）")
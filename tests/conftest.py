@@ -0,0 +1,35 @@
+import os
+import sys
+
+# utils 不依赖 nonebot，测试直接从仓库根目录导入（不导入插件本身）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shutil
+import subprocess
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 复制出的插件包名（仓库目录名不一定是合法的包名）
+PLUGIN_PACKAGE = "plugin_under_test"
+
+def copy_plugin(root):
+    """把插件（不含数据目录和测试）复制到 root 目录下，返回包名，数据目录为空"""
+    shutil.copytree(
+        REPO_DIR, os.path.join(str(root), PLUGIN_PACKAGE),
+        ignore=shutil.ignore_patterns("data", "tests", "__pycache__", ".*")
+    )
+    return PLUGIN_PACKAGE
+
+@pytest.fixture
+def plugin_copy(tmp_path):
+    """复制到临时目录的插件，返回 (所在目录, 包名)"""
+    return str(tmp_path), copy_plugin(tmp_path)
+
+def run_python(root, *args, timeout=120):
+    """在子进程中运行 python，root 加入 PYTHONPATH"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    return subprocess.run(
+        [sys.executable, *args], cwd=root, env=env, capture_output=True, text=True, timeout=timeout
+    )
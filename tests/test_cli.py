@@ -0,0 +1,18 @@
+import pytest
+
+from conftest import run_python
+
+# 以 python -m 运行工具会导入插件包本身
+pytest.importorskip("nonebot")
+pytest.importorskip("nonebot.adapters.onebot.v11")
+
+def test_memory_tool_runs(plugin_copy, tmp_path):
+    root, package = plugin_copy
+    result = run_python(root, "-m", f"{package}.tools.memory", "--memory-dir", str(tmp_path / "memories"), "--workers", "1", "stats")
+    assert result.returncode == 0, result.stderr
+    assert "记忆数: 0" in result.stdout
+
+def test_benchmark_tool_runs(plugin_copy):
+    root, package = plugin_copy
+    result = run_python(root, "-m", f"{package}.tools.benchmark", "schema", "--entries", "10", "--rounds", "1")
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,50 @@
+import os
+import statistics
+
+import pytest
+
+from conftest import run_python
+
+pytest.importorskip("nonebot")
+pytest.importorskip("nonebot.adapters.onebot.v11")
+
+# 与 tools/benchmark.py importtime 的默认上限一致（毫秒，多次测量的中位数）
+IMPORT_BUDGET_MS = 300
+RUNS = 5
+# 先导入 nonebot 和适配器（框架本身的耗时不计入插件）
+IMPORT_SCRIPT = """
+import nonebot
+nonebot.init(driver="~none")
+import nonebot.adapters.onebot.v11
+import {package}
+"""
+
+def import_time_ms(root, package):
+    """在子进程中导入插件，返回插件包的累计导入耗时（毫秒）"""
+    result = run_python(root, "-X", "importtime", "-c", IMPORT_SCRIPT.format(package=package))
+    assert result.returncode == 0, result.stderr[-2000:]
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and line.rsplit("|", 1)[-1].strip() == package:
+            return int(line.split("|")[1]) / 1000
+    raise AssertionError(f"importtime 输出中没有 {package}")
+
+def list_files(root):
+    """目录下除字节码缓存外的所有文件"""
+    files = set()
+    for dir_path, dir_names, filenames in os.walk(root):
+        dir_names[:] = [name for name in dir_names if name != "__pycache__"]
+        files.update(os.path.relpath(os.path.join(dir_path, name), root) for name in filenames)
+    return files
+
+def test_import_is_fast_and_writes_nothing(plugin_copy):
+    root, package = plugin_copy
+    plugin_dir = os.path.join(root, package)
+    before = list_files(plugin_dir)
+    # 第一次导入会编译字节码，不计入耗时
+    import_time_ms(root, package)
+    timings = [import_time_ms(root, package) for _ in range(RUNS)]
+
+    assert not os.path.exists(os.path.join(plugin_dir, "data")), "导入期间创建了数据目录"
+    assert list_files(plugin_dir) == before
+    median = statistics.median(timings)
+    assert median < IMPORT_BUDGET_MS, f"导入耗时 {median:.1f}ms 超过上限 {IMPORT_BUDGET_MS}ms（{timings}）"
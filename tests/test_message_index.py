@@ -0,0 +1,31 @@
+from utils.message_index import FLUSH_BATCH, MessageIndex
+
+def add_messages(index, start, count):
+    for i in range(start, start + count):
+        index.add(i, "发送者", "10000", f"消息{i}", 1000.0 + i)
+    index.flush()
+
+def test_compaction_keeps_recent_messages(tmp_path):
+    index = MessageIndex(str(tmp_path), max_memory=1, max_disk=FLUSH_BATCH)
+    add_messages(index, 0, FLUSH_BATCH * 3)
+    assert index.disk_lines <= FLUSH_BATCH * 2
+    assert index.get(0) is None
+    last = FLUSH_BATCH * 3 - 1
+    assert index.get(last)["text"] == f"消息{last}"
+
+def test_compaction_keeps_messages_appended_while_rewriting(tmp_path):
+    index = MessageIndex(str(tmp_path), max_memory=1, max_disk=1000)
+    add_messages(index, 0, 100)
+    with index.lock:
+        snapshot = list(index.offsets.items())[50:]
+    end = (tmp_path / "messages.jsonl").stat().st_size
+    # 压缩开始后追加的消息
+    add_messages(index, 100, 20)
+    index._compact(snapshot, end)
+    assert index.disk_lines == 70
+    with index.lock:
+        index.entries.clear()
+    for i in range(100, 120):
+        assert index.get(i)["text"] == f"消息{i}"
+    assert index.get(60)["text"] == "消息60"
+    assert index.get(10) is None
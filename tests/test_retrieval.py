@@ -0,0 +1,61 @@
+import threading
+import time
+
+from utils.retrieval import RetrievalIndex, RetrievalStore
+
+def archive(store, key, contents):
+    store.add(key, [
+        {"role": "user_1_test", "content": content, "timestamp": 1000 + i}
+        for i, content in enumerate(contents)
+    ])
+
+def test_search_returns_hits_by_score_with_ids(tmp_path):
+    store = RetrievalStore(str(tmp_path))
+    archive(store, "group_1", ["猫咪", "今天喂了猫咪", "狗狗散步", "猫咪猫咪猫咪"] + ["无关的消息"] * 20)
+    docs = store.search("group_1", "猫咪", 3)
+    scores = [doc["score"] for doc in docs]
+    assert len(docs) == 3
+    assert scores == sorted(scores, reverse=True)
+    assert {doc["id"] for doc in docs} == {0, 1, 3}
+    assert all("猫咪" in doc["content"] for doc in docs)
+
+def test_cache_evicts_least_recently_used_by_document_count(tmp_path):
+    store = RetrievalStore(str(tmp_path), max_cached=32, max_cached_docs=15)
+    for key in ["a", "b", "c"]:
+        archive(store, key, [f"消息{i}" for i in range(10)])
+    # 每个索引10条文档，上限15条时只保留最近使用的索引
+    assert store.cache_stats() == {"indexes": 1, "documents": 10}
+    store.search("a", "消息", 1)
+    store.search("b", "消息", 1)
+    assert store.cache_stats()["indexes"] == 1
+    assert store.search("c", "消息", 1)
+
+def wait_until(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_index_in_use_is_not_evicted(tmp_path):
+    store = RetrievalStore(str(tmp_path), max_cached=1)
+    archive(store, "a", ["苹果0", "苹果1", "苹果2"])
+    index = store._acquire("a")
+    store._release("a")
+    # 持有索引锁，让下面两次写入都停在执行中
+    with index.lock:
+        first = threading.Thread(target=archive, args=(store, "a", ["香蕉0", "香蕉1", "香蕉2"]))
+        first.start()
+        wait_until(lambda: store._in_use["a"] == 1)
+        # 写入其他键会把缓存挤满，正在使用的索引不能被淘汰
+        archive(store, "b", ["其他"])
+        second = threading.Thread(target=archive, args=(store, "a", ["橘子0", "橘子1", "橘子2"]))
+        second.start()
+        wait_until(lambda: store._in_use["a"] == 2)
+    first.join()
+    second.join()
+
+    reloaded = RetrievalIndex(str(tmp_path / "a"))
+    reloaded.load()
+    assert reloaded.doc_count == 9
+    for word in ["苹果", "香蕉", "橘子"]:
+        assert len(reloaded.search(word, 10)) == 3
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from utils.memory_store import MemoryStore, MemoryConflict
+from utils.state_backend import LocalBackend, RedisBackend, StateBackend
+
+@pytest.fixture(params=["local", "redis"])
+def backend(request):
+    if request.param == "local":
+        return LocalBackend()
+    return RedisBackend(fakeredis.FakeRedis(decode_responses=True))
+
+@pytest.fixture
+def redis_backend():
+    return RedisBackend(fakeredis.FakeRedis(decode_responses=True))
+
+def test_state_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+def test_put_versioned_rejects_stale_version(backend):
+    assert backend.put_versioned("k", "a", 0) == 1
+    assert backend.put_versioned("k", "b", 0) is None
+    assert backend.get_versioned("k") == ("a", 1)
+    assert backend.put_versioned("k", "b", 1) == 2
+
+def test_memory_save_conflict_between_processes(redis_backend, tmp_path):
+    # 两个进程各自的本地目录，共享同一个后端
+    first = MemoryStore(str(tmp_path / "first"), redis_backend)
+    second = MemoryStore(str(tmp_path / "second"), redis_backend)
+    first_memory = first.load("group_1")
+    second_memory = second.load("group_1")
+    first_memory["summary"] = "first"
+    assert first.save("group_1", first_memory)
+
+    second_memory["summary"] = "second"
+    with pytest.raises(MemoryConflict):
+        second.save("group_1", second_memory)
+
+    # 重新加载后读到其他进程的写入，再保存成功
+    reloaded = second.load("group_1")
+    assert reloaded["summary"] == "first"
+    reloaded["summary"] = "second"
+    assert second.save("group_1", reloaded)
+    assert first.load("group_1")["summary"] == "second"
+
+def test_reserve_token_delays_when_bucket_empty(backend):
+    assert backend.reserve_token("global_qps", 2, 2) == 0
+    assert backend.reserve_token("global_qps", 2, 2) == 0
+    # 令牌用完后按预订顺序排队：第3个请求约等0.5秒，第4个约等1秒
+    assert 0.4 < backend.reserve_token("global_qps", 2, 2) <= 0.5
+    assert 0.9 < backend.reserve_token("global_qps", 2, 2) <= 1.0
+    # 其他桶不受影响
+    assert backend.reserve_token("user:1", 1, 1) == 0
+
+def test_lease_is_exclusive_until_released(backend):
+    assert backend.acquire_lease("summary:group_1", 10, owner="a")
+    assert not backend.acquire_lease("summary:group_1", 10, owner="b")
+    # 持有者可以续期
+    assert backend.acquire_lease("summary:group_1", 10, owner="a")
+    # 非持有者释放无效
+    backend.release_lease("summary:group_1", owner="b")
+    assert not backend.acquire_lease("summary:group_1", 10, owner="b")
+    backend.release_lease("summary:group_1", owner="a")
+    assert backend.acquire_lease("summary:group_1", 10, owner="b")
+
+def test_lease_expires(backend):
+    assert backend.acquire_lease("summary:group_1", 0.05, owner="a")
+    assert not backend.acquire_lease("summary:group_1", 10, owner="b")
+    time.sleep(0.1)
+    assert backend.acquire_lease("summary:group_1", 10, owner="b")
+
+def test_call_runs_shared_backend_in_thread(redis_backend):
+    async def main():
+        return await redis_backend.call("acquire_lease", "summary:group_1", 10, "a")
+    assert asyncio.run(main()) is True
@@ -0,0 +1,110 @@
+import asyncio
+import importlib
+import sys
+
+import pytest
+
+from conftest import copy_plugin
+
+# commands/memory.py 依赖 nonebot，从复制到临时目录的插件中导入（数据目录为空）
+pytest.importorskip("nonebot")
+pytest.importorskip("nonebot.adapters.onebot.v11")
+
+KEY = "user_10000"
+HISTORY_LENGTH = 60  # 超过默认的总结阈值（50条）
+
+@pytest.fixture(scope="module")
+def plugin(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp("plugin"))
+    package = copy_plugin(root)
+    sys.path.insert(0, root)
+    try:
+        memory = importlib.import_module(f"{package}.commands.memory")
+        schema = importlib.import_module(f"{package}.utils.memory_schema")
+        yield memory, schema
+    finally:
+        sys.path.remove(root)
+        for name in [name for name in sys.modules if name == package or name.startswith(package + ".")]:
+            del sys.modules[name]
+
+@pytest.fixture
+def memory_module(plugin, monkeypatch):
+    memory, schema = plugin
+    memory.save_memory(KEY, schema.decode_memory({
+        "summary": "旧总结",
+        "history": [
+            {"role": "user_10000_测试", "content": f"消息{i}", "timestamp": 1000 + i}
+            for i in range(HISTORY_LENGTH)
+        ]
+    }))
+    archived = []
+
+    async def fake_call_retrieval(key, method, *args):
+        archived.append((key, method, args))
+
+    monkeypatch.setattr(memory, "call_retrieval", fake_call_retrieval)
+    return memory, archived
+
+def summary_params():
+    return {
+        "current_model": "test-model",
+        "prepare_request": None,
+        "parse_response": None,
+        "api_url": "",
+        "headers": {},
+        "ignore_interval": True
+    }
+
+def reload_memory(memory):
+    """丢弃内存缓存，从磁盘重新加载"""
+    memory.memory_store.evict(KEY)
+    return memory.load_memory(KEY)
+
+def test_summary_replaces_summary_and_archives_dropped_history(memory_module, monkeypatch):
+    memory, archived = memory_module
+
+    async def fake_generate_summary(*args, **kwargs):
+        return "新总结"
+
+    monkeypatch.setattr(memory, "generate_summary", fake_generate_summary)
+    asyncio.run(memory.summarize_memory(KEY, summary_params()))
+
+    saved = reload_memory(memory)
+    dropped = HISTORY_LENGTH - memory.SUMMARY_KEEP_RECENT
+    assert saved["summary"] == "新总结"
+    assert [entry.content for entry in saved["history"]] == [f"消息{i}" for i in range(dropped, HISTORY_LENGTH)]
+    assert len(archived) == 1 and len(archived[0][2][0]) == dropped
+
+def test_failed_summary_keeps_memory_unchanged(memory_module, monkeypatch):
+    memory, archived = memory_module
+    before = reload_memory(memory)
+
+    async def failing_generate_summary(*args, **kwargs):
+        raise RuntimeError("模型服务不可用")
+
+    monkeypatch.setattr(memory, "generate_summary", failing_generate_summary)
+    with pytest.raises(RuntimeError):
+        asyncio.run(memory.summarize_memory(KEY, summary_params()))
+
+    saved = reload_memory(memory)
+    assert saved["summary"] == "旧总结"
+    assert saved["history"] == before["history"]
+    assert archived == []
+
+def test_summary_is_discarded_when_history_changed_during_generation(memory_module, monkeypatch):
+    memory, archived = memory_module
+
+    async def generate_while_history_changes(*args, **kwargs):
+        # 总结期间最早的记录被删除（如管理员清理了记忆）
+        changed = memory.load_memory(KEY)
+        changed["history"] = changed["history"][1:]
+        memory.save_memory(KEY, changed)
+        return "新总结"
+
+    monkeypatch.setattr(memory, "generate_summary", generate_while_history_changes)
+    asyncio.run(memory.summarize_memory(KEY, summary_params()))
+
+    saved = reload_memory(memory)
+    assert saved["summary"] == "旧总结"
+    assert [entry.content for entry in saved["history"]] == [f"消息{i}" for i in range(1, HISTORY_LENGTH)]
+    assert archived == []
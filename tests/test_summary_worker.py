@@ -0,0 +1,55 @@
+import asyncio
+
+from utils.summary_worker import SummaryWorker, STATE_DONE, STATE_FAILED
+
+def test_failed_job_is_requeued_and_retried_until_done():
+    calls = []
+    states = []
+
+    async def runner(key, params):
+        calls.append(key)
+        if len(calls) == 1:
+            raise RuntimeError("模型服务不可用")
+
+    async def main():
+        worker = SummaryWorker(runner, concurrency=1, poll_interval=0.01, retry_base=0.3)
+        worker.submit("group_1", {}, immediate=True)
+        while not calls:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.02)
+        status = worker.get_status("group_1")
+        states.append((status.state, status.attempts, worker.is_busy("group_1")))
+        # 失败后按退避时间重新排队
+        job = worker.pending["group_1"]
+        assert job.not_before == status.next_retry_at
+        while status.state != STATE_DONE:
+            await asyncio.sleep(0.01)
+        return status, worker
+
+    status, worker = asyncio.run(asyncio.wait_for(main(), 5))
+    assert states == [(STATE_FAILED, 1, True)]
+    assert calls == ["group_1", "group_1"]
+    assert status.attempts == 0 and status.failures == 1 and status.last_error == ""
+    assert not worker.is_busy("group_1")
+
+def test_job_gives_up_after_max_retries():
+    calls = []
+
+    async def runner(key, params):
+        calls.append(key)
+        raise RuntimeError("模型服务不可用")
+
+    async def main():
+        worker = SummaryWorker(runner, concurrency=1, poll_interval=0.01, max_retries=1, retry_base=0.01, retry_max=60)
+        worker.submit("group_1", {}, immediate=True)
+        while len(calls) < 2 or worker.running:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        return worker
+
+    worker = asyncio.run(asyncio.wait_for(main(), 5))
+    status = worker.get_status("group_1")
+    assert len(calls) == 2
+    assert status.state == STATE_FAILED and status.attempts == 2
+    # 超过重试次数后不再排队，新提交的任务要等到 retry_max 的退避结束
+    assert not worker.is_busy("group_1")
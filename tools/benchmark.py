@@ -0,0 +1,591 @@
+"""性能基准测试
+
+用法：python -m <插件包名>.tools.benchmark <项目> [参数]
+    retrieval  归档检索索引的构建耗时与查询延迟
+    schema     记忆文件旧格式（version 1）与紧凑格式（version 2）的大小及加载/渲染耗时
+    profiles   群聊提示词附带全部历史与只附带提问用户画像及相关记录的token数对比
+    config     一次@回复中逐项读取配置与读取配置快照的耗时对比
+    chatstate  切换单个聊天的回复状态/提示词开关时整体重写配置文件与按聊天存储的耗时对比
+    configwrite  连续修改配置时每次立即写入文件与合并延迟写入的耗时和写入次数
+    shards     归档检索在线程中执行与分到不同数量的分片工作进程时的吞吐量和事件循环延迟
+    importtime  把插件复制到空目录中导入，测量导入耗时（python -X importtime）并检查导入期间是否写入文件；
+                超过耗时上限（默认 IMPORT_BUDGET_MS）或写入了文件时以非零状态退出
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from ..utils.config import ConfigManager
+from ..utils.chat_state import ChatStateStore, FIELD_REPLY
+from ..utils.retrieval import RetrievalIndex, RetrievalStore
+from ..utils.shard_pool import ShardPool
+from ..utils.memory_schema import AI_ID, decode_memory, encode_memory, parse_role_info
+from ..utils.profiles import merge_profiles, get_profile, select_focus_entries
+from ..utils.tokens import estimate_tokens
+
+# 生成测试消息用的词表：由常用汉字组成的双字词和少量英文词，按Zipf分布取词
+VOCAB_RNG = random.Random(42)
+SAMPLE_WORDS = [
+    chr(0x4e00 + VOCAB_RNG.randrange(3000)) + chr(0x4e00 + VOCAB_RNG.randrange(3000))
+    for _ in range(20000)
+] + ["python", "bug", "deploy", "server", "api", "model", "gemini", "deepseek", "token", "prompt"]
+VOCAB_RNG.shuffle(SAMPLE_WORDS)
+SAMPLE_CUM_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(SAMPLE_WORDS) + 1)))
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct), len(ordered) - 1)]
+
+def report(name: str, timings: List[float]) -> None:
+    print(
+        f"{name}: 次数 {len(timings)}，平均 {statistics.mean(timings) * 1000:.2f}ms，"
+        f"p50 {percentile(timings, 0.5) * 1000:.2f}ms，p95 {percentile(timings, 0.95) * 1000:.2f}ms，"
+        f"最大 {max(timings) * 1000:.2f}ms"
+    )
+
+def random_message(rng: random.Random) -> str:
+    return "".join(rng.choices(SAMPLE_WORDS, cum_weights=SAMPLE_CUM_WEIGHTS, k=rng.randint(3, 15)))
+
+def bench_retrieval(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix="retrieval_bench_")
+    try:
+        index = RetrievalIndex(os.path.join(work_dir, "group_bench"))
+        batches = max(args.messages // args.batch, 1)
+        start = time.perf_counter()
+        for _ in range(batches):
+            index.add([
+                {"role": "user_1_bench", "content": random_message(rng), "timestamp": time.time()}
+                for _ in range(args.batch)
+            ])
+        print(f"归档并索引 {index.doc_count} 条消息（{len(index.segments)} 个段）：{time.perf_counter() - start:.2f}s")
+
+        queries = [random_message(rng) for _ in range(args.queries)]
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query, args.top_k)
+            timings.append(time.perf_counter() - start)
+        report("查询（未压缩）", timings)
+
+        start = time.perf_counter()
+        index.compact()
+        print(f"压缩索引：{time.perf_counter() - start:.2f}s")
+
+        # 重新从磁盘加载，测量冷启动耗时
+        index = RetrievalIndex(index.index_dir)
+        start = time.perf_counter()
+        index.load()
+        print(f"加载压缩后的索引：{time.perf_counter() - start:.2f}s")
+        # 另行加载一次测量常驻内存（tracemalloc 会拖慢加载，不计入上面的耗时）
+        tracemalloc.start()
+        loaded = RetrievalIndex(index.index_dir)
+        loaded.load()
+        loaded_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del loaded
+        print(f"已加载索引的内存：{loaded_bytes / 1024 / 1024:.1f}MB（每条文档 {loaded_bytes / max(index.doc_count, 1):.0f}B）")
+
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            hits = index.search(query, args.top_k)
+            index.get_documents([doc_id for _, doc_id in hits])
+            timings.append(time.perf_counter() - start)
+        report("查询+读取原文（压缩后）", timings)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def bench_schema(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    nicknames = {str(100000 + i): f"群友{i}号的超长昵称" for i in range(args.participants)}
+    v1 = {
+        "summary": random_message(rng) * 20,
+        "history": [],
+        "last_summary_time": 0
+    }
+    for i in range(args.entries):
+        if rng.random() < 0.3:
+            role = "ai"
+        else:
+            qq = rng.choice(list(nicknames))
+            role = f"user_{qq}_{nicknames[qq]}"
+        v1["history"].append({"role": role, "content": random_message(rng), "timestamp": time.time() + i})
+
+    v1_text = json.dumps(v1, ensure_ascii=False, indent=2)
+    v2_text = json.dumps(encode_memory(decode_memory(v1)), ensure_ascii=False, separators=(",", ":"))
+    v1_size = len(v1_text.encode("utf-8"))
+    v2_size = len(v2_text.encode("utf-8"))
+    print(f"{args.entries} 条记录、{args.participants} 个参与者")
+    print(f"文件大小：旧格式 {v1_size / 1024:.1f}KB，紧凑格式 {v2_size / 1024:.1f}KB（{v2_size / v1_size:.0%}）")
+
+    def run_v1() -> None:
+        memory = json.loads(v1_text)
+        "\n".join(f"{parse_role_info(item['role'])}: {item['content']}" for item in memory["history"])
+
+    def run_v2() -> None:
+        memory = decode_memory(json.loads(v2_text))
+        participants = memory["participants"]
+        "\n".join(f"{participants.label(item.pid)}: {item.content}" for item in memory["history"])
+
+    for name, func in [("旧格式 加载+渲染", run_v1), ("紧凑格式 加载+渲染", run_v2)]:
+        timings = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        report(name, timings)
+
+def bench_profiles(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    qqs = [str(100000 + i) for i in range(args.participants)]
+    raw = {"summary": random_message(rng) * 10, "history": [], "last_summary_time": 0}
+    for i in range(args.entries):
+        if rng.random() < args.ai_ratio:
+            role = "ai"
+        else:
+            qq = rng.choice(qqs)
+            role = f"user_{qq}_群友{qq}"
+        raw["history"].append({"role": role, "content": random_message(rng), "timestamp": time.time() + i})
+    memory = decode_memory(raw)
+    participants = memory["participants"]
+    profiles = merge_profiles({}, {qq: random_message(rng)[:60] for qq in qqs})
+    candidates = memory["history"][-args.max_history * 2:]
+
+    def render(entries: List) -> int:
+        return sum(estimate_tokens(f"{participants.label(item.pid)}: {item.content}") for item in entries)
+
+    summary_tokens = estimate_tokens(memory["summary"])
+    full_tokens = summary_tokens + render(candidates)
+    focused_totals = []
+    line_counts = []
+    timings = []
+    for _ in range(args.queries):
+        qq = rng.choice(qqs)
+        pid = participants.user_ids.get(qq)
+        start = time.perf_counter()
+        focused = select_focus_entries(candidates, pid, AI_ID, {f"群友{qq}"}, args.max_history * 2, args.context_lines)
+        timings.append(time.perf_counter() - start)
+        profile_tokens = estimate_tokens(f"<用户画像>\n群友{qq}: {get_profile(profiles, qq)}\n</用户画像>")
+        focused_totals.append(summary_tokens + profile_tokens + render(focused))
+        line_counts.append(len(focused))
+
+    focused_mean = statistics.mean(focused_totals)
+    print(f"{args.entries} 条记录、{args.participants} 个发言者、AI发言占比 {args.ai_ratio:.0%}")
+    print(f"全部历史：{len(candidates)} 条，{full_tokens} token")
+    print(
+        f"聚焦发言者：平均 {statistics.mean(line_counts):.1f} 条，{focused_mean:.0f} token"
+        f"（减少 {1 - focused_mean / full_tokens:.0%}，p95 {percentile(focused_totals, 0.95):.0f} token）"
+    )
+    report("挑选相关记录", timings)
+
+def bench_config(args: argparse.Namespace) -> None:
+    work_dir = tempfile.mkdtemp(prefix="config_bench_")
+    try:
+        manager = ConfigManager()
+        manager.data_dir = work_dir
+        manager.initialize()
+        manager.set_value("admin_config.json", "admin_qq", [100000 + i for i in range(args.admins)])
+        manager.set_value("config.json", "reply_status", {f"group_{i}": "on" for i in range(args.chats)})
+        chat_state = ChatStateStore(os.path.join(work_dir, "chat_state"))
+        user_id = "999999"
+        key = f"group_{args.chats // 2}"
+        chat_state.set(key, FIELD_REPLY, "active")
+
+        def read_legacy() -> None:
+            # 与改动前一次@回复中的配置读取相同：每次按点分隔的键逐级查找
+            get_value = manager.get_value
+            get_value("config.json", f"reply_status.{key}", "on")
+            user_id in [str(admin) for admin in get_value("admin_config.json", "admin_qq", [])]
+            for _ in range(3):
+                model = get_value("model_config.json", "current_model", "gemini-2.5-pro")
+            if get_value("model_config.json", f"cooldowns.{model}") is None:
+                get_value("core_config.json", "rate_limit.gemini_cooldown", 15)
+            get_value("core_config.json", "rate_limit.global_qps_limit", 2)
+            if get_value("model_config.json", f"context_budgets.{model}") is None:
+                get_value("model_config.json", "context_budgets.default", 6000)
+            get_value("config.json", "max_history", 30)
+            for _ in range(2):
+                if get_value("config.json", "split_enabled", False):
+                    get_value("split_config.json", "prompt", "")
+            api_key = get_value("core_config.json", "api_keys.gemini", "")
+            get_value("core_config.json", "urls.gemini", "").format(model=model, key=api_key)
+            for _ in range(3):
+                get_value("core_config.json", "proxies", {})
+
+        def read_snapshot() -> None:
+            # 与改动后相同：每个读取函数各自调用一次 snapshot()
+            snapshot = manager.snapshot
+            chat_state.get(key, FIELD_REPLY, "on")
+            snapshot().is_admin(user_id)
+            for _ in range(3):
+                model = snapshot().current_model
+            snapshot().cooldown(model)
+            snapshot().global_qps_limit
+            snapshot().context_budget(model)
+            snapshot().max_history
+            for _ in range(2):
+                if snapshot().split_enabled:
+                    snapshot().split_prompt
+            snapshot().gemini.url
+            for _ in range(3):
+                dict(snapshot().proxies)
+
+        print(f"{args.admins} 个管理员、{args.chats} 个聊天的回复状态")
+        results = {}
+        for name, func in [("逐项读取配置", read_legacy), ("读取配置快照", read_snapshot)]:
+            timings = []
+            for _ in range(args.rounds):
+                start = time.perf_counter()
+                for _ in range(args.batch):
+                    func()
+                timings.append((time.perf_counter() - start) / args.batch)
+            results[name] = statistics.mean(timings)
+            report(f"{name}（每次回复）", timings)
+        print(
+            f"平均每次回复：逐项读取 {results['逐项读取配置'] * 1e6:.1f}µs，读取快照 {results['读取配置快照'] * 1e6:.1f}µs"
+            f"（{results['读取配置快照'] / results['逐项读取配置']:.0%}）"
+        )
+
+        timings = []
+        for _ in range(args.rounds):
+            manager.version += 1
+            start = time.perf_counter()
+            manager.snapshot()
+            timings.append(time.perf_counter() - start)
+        report("配置变化后重建快照", timings)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def bench_chatstate(args: argparse.Namespace) -> None:
+    work_dir = tempfile.mkdtemp(prefix="chatstate_bench_")
+    try:
+        rng = random.Random(args.seed)
+        manager = ConfigManager()
+        manager.data_dir = work_dir
+        manager.initialize()
+        chats = [f"group_{100000 + i}" for i in range(args.chats)]
+        prompt_names = [f"提示词{i}" for i in range(args.prompts)]
+        # 改动前：所有聊天的回复状态和完整的提示词开关分别保存在 config.json 与 prompts_config.json 中
+        manager.set_value("config.json", "reply_status", {key: rng.choice(["on", "off", "active"]) for key in chats})
+        prompts_config = manager.load_config("prompts_config.json")
+        prompts_config["context_status"] = {key: {name: rng.random() > 0.1 for name in prompt_names} for key in chats}
+        manager.save_config("prompts_config.json", prompts_config)
+        manager.flush()
+        legacy_bytes = sum(os.path.getsize(manager.get_config_path(name)) for name in ("config.json", "prompts_config.json"))
+
+        chat_state = ChatStateStore(os.path.join(work_dir, "chat_state"))
+        migrate_start = time.perf_counter()
+        migrated = chat_state.migrate_legacy(manager)
+        migrate_seconds = time.perf_counter() - migrate_start
+        state_bytes = sum(
+            os.path.getsize(os.path.join(dir_path, filename))
+            for dir_path, _, filenames in os.walk(chat_state.state_dir)
+            for filename in filenames
+        )
+        print(f"{args.chats} 个聊天、{args.prompts} 条提示词")
+        print(f"迁移 {migrated} 个聊天耗时 {migrate_seconds * 1e3:.1f}ms；状态占用 {legacy_bytes / 1024:.0f}KB -> {state_bytes / 1024:.0f}KB（只记录非默认项）")
+
+        legacy_config = json.loads(json.dumps({"reply_status": {key: "on" for key in chats}}))
+        legacy_prompts = {"context_status": {key: {name: True for name in prompt_names} for key in chats}}
+        legacy_timings, store_timings = [], []
+        for _ in range(args.rounds):
+            key = rng.choice(chats)
+            mode = rng.choice(["on", "off", "active"])
+            name = rng.choice(prompt_names)
+            # 改动前：修改一个聊天的状态需要重写包含所有聊天状态的两个文件
+            start = time.perf_counter()
+            legacy_config["reply_status"][key] = mode
+            manager.save_config("config.json", legacy_config)
+            legacy_prompts["context_status"][key][name] = not legacy_prompts["context_status"][key][name]
+            manager.save_config("prompts_config.json", legacy_prompts)
+            manager.flush()
+            legacy_timings.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            chat_state.set(key, FIELD_REPLY, None if mode == "on" else mode)
+            status = {prompt: chat_state.prompt_overrides(key).get(prompt, True) for prompt in prompt_names}
+            status[name] = not status[name]
+            chat_state.set_prompt_status(key, status)
+            store_timings.append(time.perf_counter() - start)
+        report("整体重写配置文件（每次切换）", legacy_timings)
+        report("按聊天存储（每次切换）", store_timings)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def bench_configwrite(args: argparse.Namespace) -> None:
+    work_dir = tempfile.mkdtemp(prefix="configwrite_bench_")
+    try:
+        manager = ConfigManager()
+        manager.data_dir = work_dir
+        manager.initialize()
+        manager.flush()
+        # 模拟保存模型配置等一次操作中连续修改多项配置
+        keys = [f"bench.key{i}" for i in range(args.keys)]
+        results = {}
+        for name, immediate in [("每次修改立即写入", True), ("合并延迟写入", False)]:
+            timings = []
+            writes = 0
+            for round_index in range(args.rounds):
+                start = time.perf_counter()
+                for key in keys:
+                    manager.set_value("config.json", key, round_index)
+                    if immediate:
+                        manager.flush()
+                        writes += 1
+                timings.append(time.perf_counter() - start)
+                # 延迟写入由定时器完成，这里直接写入以便统计下一轮
+                flush_start = time.perf_counter()
+                if not immediate and manager.dirty:
+                    manager.flush()
+                    writes += 1
+                timings[-1] += time.perf_counter() - flush_start
+            results[name] = statistics.mean(timings)
+            report(f"{name}（{args.keys} 项）", timings)
+            print(f"  写入文件 {writes} 次")
+        print(f"合并写入耗时为立即写入的 {results['合并延迟写入'] / results['每次修改立即写入']:.0%}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+async def run_shard_load(store: RetrievalStore, pool: "ShardPool", keys: List[str], queries: List[tuple], concurrency: int) -> tuple:
+    """并发执行检索，同时用一个定时协程测量事件循环的调度延迟，返回 (总耗时, 延迟列表)"""
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker() -> None:
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - start - 0.005)
+
+    async def client(items: List[tuple]) -> None:
+        for key, query in items:
+            if pool is None:
+                await asyncio.to_thread(store.search, key, query, 5)
+            else:
+                await pool.call(key, "search", key, query, 5)
+
+    # 先让每个进程加载各自分片的索引，只测量加载后的检索
+    await client([(key, "预热") for key in keys])
+    tick_task = asyncio.get_running_loop().create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(client(queries[i::concurrency]) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await tick_task
+    return elapsed, lags
+
+def bench_shards(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix="shards_bench_")
+    try:
+        keys = [f"group_{100000 + i}" for i in range(args.chats)]
+        builder = RetrievalStore(work_dir)
+        for key in keys:
+            for _ in range(max(args.messages // 200, 1)):
+                builder.add(key, [
+                    {"role": "user_1_bench", "content": random_message(rng), "timestamp": time.time()}
+                    for _ in range(200)
+                ])
+            builder.compact(key)
+        queries = [(rng.choice(keys), random_message(rng)) for _ in range(args.queries)]
+        print(f"{args.chats} 个聊天，每个 {args.messages} 条归档消息，{args.queries} 次检索，并发 {args.concurrency}（CPU核心数 {os.cpu_count()}）")
+
+        baseline = None
+        for workers in [0] + args.workers:
+            store = RetrievalStore(work_dir, max_cached=args.chats)
+            pool = ShardPool(workers, RetrievalStore, (work_dir, args.chats)) if workers else None
+            try:
+                elapsed, lags = asyncio.run(run_shard_load(store, pool, keys, queries, args.concurrency))
+            finally:
+                if pool is not None:
+                    pool.close()
+            throughput = args.queries / elapsed
+            baseline = baseline or throughput
+            name = "线程" if workers == 0 else f"{workers} 个分片进程"
+            print(
+                f"{name}: {throughput:.0f} 次/秒（{throughput / baseline:.2f}x），"
+                f"事件循环延迟 p50 {percentile(lags, 0.5) * 1000:.2f}ms，p95 {percentile(lags, 0.95) * 1000:.2f}ms，"
+                f"最大 {max(lags) * 1000:.2f}ms"
+            )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+# 插件包名及其所在目录（导入耗时在子进程中测量）
+PACKAGE = __package__.rsplit(".", 1)[0]
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 先导入 nonebot 和适配器（框架本身的耗时不计入插件）
+IMPORT_SCRIPT = """
+import nonebot
+nonebot.init(driver="~none")
+import nonebot.adapters.onebot.v11
+import {package}
+"""
+IMPORT_BUDGET_MS = 300  # 插件导入耗时上限（毫秒，多次测量的中位数；tests/test_import_time.py 使用同一上限）
+
+def snapshot_files(root: str) -> Dict[str, Tuple[int, int]]:
+    """目录下所有文件的 (修改时间, 大小)"""
+    files = {}
+    for dir_path, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dir_path, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files[path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+def measure_import(root: str, package: str) -> Dict[str, Tuple[int, int]]:
+    """在子进程中从 root 目录导入插件包 package，返回 {模块名: (自身耗时us, 累计耗时us)}"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORT_SCRIPT.format(package=package)],
+        env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"导入插件失败:\n{result.stderr[-2000:]}")
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+def bench_importtime(args: argparse.Namespace) -> None:
+    # 把插件（不含数据目录）复制到临时目录中导入，相当于首次部署时数据目录为空
+    package = PACKAGE.rsplit(".", 1)[-1]
+    work_dir = tempfile.mkdtemp(prefix="importtime_bench_")
+    try:
+        plugin_dir = shutil.copytree(
+            PACKAGE_DIR, os.path.join(work_dir, package),
+            ignore=shutil.ignore_patterns("data", "__pycache__", ".*")
+        )
+        data_dir = os.path.join(plugin_dir, "data")
+        before = snapshot_files(plugin_dir)
+        # 第一次导入会编译字节码，不计入耗时（但计入导入期间写入的文件）
+        measure_import(work_dir, package)
+        runs = [measure_import(work_dir, package) for _ in range(args.runs)]
+        after = snapshot_files(plugin_dir)
+        data_created = os.path.exists(data_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    totals = [modules[package][1] / 1000 for modules in runs]
+    total = statistics.median(totals)
+    print(f"导入 {package}: 中位数 {total:.1f}ms（{args.runs} 次，最小 {min(totals):.1f}ms，最大 {max(totals):.1f}ms）")
+    slowest = sorted(runs[-1].items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+    print(f"自身耗时最多的 {len(slowest)} 个模块:")
+    for name, (self_us, cumulative_us) in slowest:
+        print(f"  {name}: 自身 {self_us / 1000:.1f}ms，累计 {cumulative_us / 1000:.1f}ms")
+
+    # 字节码缓存（__pycache__）不算导入期间的写入
+    written = sorted(
+        path for path, stat in after.items()
+        if before.get(path) != stat and "__pycache__" not in path.split(os.sep)
+    )
+    removed = sorted(set(before) - set(after))
+    failed = False
+    if data_created:
+        print("导入期间创建了数据目录 data/")
+        failed = True
+    if written or removed:
+        print(f"导入期间修改了插件目录中的 {len(written) + len(removed)} 个文件:")
+        for path in written + removed:
+            print(f"  {os.path.relpath(path, plugin_dir)}")
+        failed = True
+    if not failed:
+        print("导入期间未写入任何文件")
+
+    if total > args.budget:
+        print(f"导入耗时 {total:.1f}ms 超过上限 {args.budget:.1f}ms")
+        failed = True
+    else:
+        print(f"导入耗时在上限 {args.budget:.1f}ms 以内")
+    if failed:
+        sys.exit(1)
+
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace], None]] = {
+    "retrieval": bench_retrieval,
+    "schema": bench_schema,
+    "profiles": bench_profiles,
+    "config": bench_config,
+    "chatstate": bench_chatstate,
+    "configwrite": bench_configwrite,
+    "shards": bench_shards,
+    "importtime": bench_importtime,
+}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="性能基准测试")
+    subparsers = parser.add_subparsers(dest="name", required=True)
+
+    retrieval = subparsers.add_parser("retrieval", help="归档检索索引的构建与查询延迟")
+    retrieval.add_argument("--messages", type=int, default=100000, help="归档消息总数")
+    retrieval.add_argument("--batch", type=int, default=80, help="每次归档的消息数（对应一次总结删除的记录数）")
+    retrieval.add_argument("--queries", type=int, default=200, help="查询次数")
+    retrieval.add_argument("--top-k", type=int, default=5)
+    retrieval.add_argument("--seed", type=int, default=0)
+
+    schema = subparsers.add_parser("schema", help="记忆文件格式的大小与加载/渲染耗时")
+    schema.add_argument("--entries", type=int, default=120, help="历史记录条数")
+    schema.add_argument("--participants", type=int, default=50, help="参与者人数")
+    schema.add_argument("--rounds", type=int, default=200, help="重复次数")
+    schema.add_argument("--seed", type=int, default=0)
+
+    profiles = subparsers.add_parser("profiles", help="发言者聚焦前后群聊提示词的token数")
+    profiles.add_argument("--entries", type=int, default=120, help="历史记录条数")
+    profiles.add_argument("--participants", type=int, default=20, help="发言者人数")
+    profiles.add_argument("--ai-ratio", type=float, default=0.2, help="AI发言占比")
+    profiles.add_argument("--max-history", type=int, default=30, help="对应配置项 max_history")
+    profiles.add_argument("--context-lines", type=int, default=3, help="对应配置项 speaker_focus.context_lines")
+    profiles.add_argument("--queries", type=int, default=200, help="模拟提问次数")
+    profiles.add_argument("--seed", type=int, default=0)
+
+    config = subparsers.add_parser("config", help="逐项读取配置与读取配置快照的耗时")
+    config.add_argument("--admins", type=int, default=20, help="管理员人数")
+    config.add_argument("--chats", type=int, default=2000, help="配置了回复状态的聊天数")
+    config.add_argument("--rounds", type=int, default=200, help="重复次数")
+    config.add_argument("--batch", type=int, default=100, help="每轮模拟的回复次数")
+
+    chatstate = subparsers.add_parser("chatstate", help="切换单个聊天状态时整体重写配置与按聊天存储的耗时")
+    chatstate.add_argument("--chats", type=int, default=2000, help="聊天数")
+    chatstate.add_argument("--prompts", type=int, default=10, help="提示词条数")
+    chatstate.add_argument("--rounds", type=int, default=200, help="切换次数")
+    chatstate.add_argument("--seed", type=int, default=0)
+
+    configwrite = subparsers.add_parser("configwrite", help="连续修改配置时立即写入与合并延迟写入的对比")
+    configwrite.add_argument("--keys", type=int, default=4, help="每轮修改的配置项数")
+    configwrite.add_argument("--rounds", type=int, default=50, help="重复次数")
+
+    shards = subparsers.add_parser("shards", help="归档检索在线程与分片工作进程中执行的吞吐量")
+    shards.add_argument("--chats", type=int, default=16, help="聊天数")
+    shards.add_argument("--messages", type=int, default=5000, help="每个聊天的归档消息数")
+    shards.add_argument("--queries", type=int, default=2000, help="检索次数")
+    shards.add_argument("--concurrency", type=int, default=16, help="同时进行的检索数")
+    shards.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="测试的分片进程数")
+    shards.add_argument("--seed", type=int, default=0)
+
+    importtime = subparsers.add_parser("importtime", help="导入插件的耗时及导入期间写入的文件")
+    importtime.add_argument("--runs", type=int, default=5, help="测量次数，取中位数")
+    importtime.add_argument("--top", type=int, default=10, help="列出自身耗时最多的模块数")
+    importtime.add_argument("--budget", type=float, default=IMPORT_BUDGET_MS, help="导入耗时上限（毫秒），超过或导入期间写入了文件时以非零状态退出")
+
+    args = parser.parse_args()
+    BENCHMARKS[args.name](args)
+
+if __name__ == "__main__":
+    main()
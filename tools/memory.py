@@ -0,0 +1,359 @@
+"""记忆文件离线维护工具（请在机器人停止运行时使用，运行中的机器人会用内存缓存覆盖改动）
+
+用法：python -m <插件包名>.tools.memory <命令> [参数]
+    export    将全部记忆逐条导出为JSONL（.gz结尾时压缩）
+    import    从JSONL导入记忆，默认跳过已存在的记忆
+    validate  检查记忆文件，--repair 时修复结构问题并隔离无法解析的文件
+    compact   将旧格式和非紧凑的文件重写为紧凑格式，清理残留的临时文件，可选压缩空闲记忆
+    stats     统计记忆数量、大小、条目数及最大的记忆
+
+文件按批提交到进程池并行处理，同时在途的文件数有上限，内存占用与记忆总量无关
+"""
+import argparse
+import gzip
+import heapq
+import json
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ..utils.config import config_manager
+from ..utils.memory_schema import SCHEMA_VERSION, decode_memory, validate_memory
+from ..utils.memory_store import MemoryStore, TIER_COLD, TIER_WARM
+
+def run_parallel(func: Callable, items: Iterable, workers: int, window: int) -> Iterator:
+    """在进程池中执行 func(item)，按提交顺序产出结果；在途任务不超过 window 个"""
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def open_jsonl(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def file_index_entry(path: str, tier: str, raw: Dict[str, Any], last_activity: Optional[float] = None) -> Dict[str, Any]:
+    """单个文件的索引条目，last_activity默认取文件修改时间"""
+    stat = os.stat(path)
+    return MemoryStore._index_entry(
+        decode_memory(raw), stat.st_size, tier, stat.st_mtime if last_activity is None else last_activity
+    )
+
+def rewrite(path: str, tier: str, raw: Dict[str, Any]) -> int:
+    """原地重写温数据或冷数据文件并保留修改时间（后台清理按修改时间判断是否空闲），返回新文件大小"""
+    stat = os.stat(path)
+    if tier == TIER_COLD:
+        data = json.dumps(raw, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        with gzip.open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+    else:
+        MemoryStore._write_file(path, raw)
+    os.utime(path, (stat.st_atime, stat.st_mtime))
+    return os.path.getsize(path)
+
+# ---------- 进程池中执行的单文件操作 ----------
+
+def export_file(item: Tuple[str, str, str]) -> Tuple[Optional[str], Optional[str]]:
+    """读取一个记忆文件，返回 (JSONL行, 错误信息)"""
+    key, tier, path = item
+    try:
+        raw = MemoryStore.read_path(path)
+    except Exception as e:
+        return None, f"{path}: {str(e)}"
+    return json.dumps({"key": key, "tier": tier, "memory": raw}, ensure_ascii=False, separators=(",", ":")), None
+
+def import_line(memory_dir: str, overwrite: bool, line: str) -> Tuple[str, Optional[str], Optional[Dict[str, Any]]]:
+    """导入一行记录，返回 (状态, 记忆键, 索引条目)；状态为 imported/skipped/invalid"""
+    try:
+        record = json.loads(line)
+        key = record["key"]
+        prefix, _ = key.split("_", 1)
+        if prefix not in ("user", "group"):
+            raise ValueError(f"无效的记忆键: {key}")
+        problems, raw = validate_memory(record["memory"])
+        if raw is None:
+            raise ValueError("; ".join(problems))
+    except Exception as e:
+        return "invalid", None, {"error": str(e)}
+    store = MemoryStore(memory_dir)
+    path = store.path(key)
+    existing = [p for p in (path, store.cold_path(key), *store.legacy_paths(key)) if os.path.exists(p)]
+    if existing and not overwrite:
+        return "skipped", key, None
+    MemoryStore._write_file(path, raw)
+    for old_path in existing:
+        if old_path != path:
+            os.remove(old_path)
+    # 以最后一条记录的时间作为活跃时间，导入的旧记忆之后会被正常压缩归档
+    history = raw["history"]
+    last_activity = history[-1][2] if history else time.time()
+    os.utime(path, (last_activity, last_activity))
+    return "imported", key, file_index_entry(path, TIER_WARM, raw)
+
+def validate_file(memory_dir: str, repair: bool, item: Tuple[str, str, str]) -> Dict[str, Any]:
+    """检查一个记忆文件，repair时写回修复结果；JSON无法解析时优先用残留的临时文件恢复，否则隔离"""
+    key, tier, path = item
+    result = {"key": key, "path": path, "problems": [], "action": None, "index": None}
+    store = MemoryStore(memory_dir)
+    try:
+        raw = MemoryStore.read_path(path)
+    except Exception as e:
+        result["problems"].append(f"无法解析: {str(e)}")
+        if not repair:
+            return result
+        tmp_path = path + ".tmp"
+        try:
+            # 写入临时文件后、替换前中断时，临时文件是最后一次完整的写入
+            raw = MemoryStore.read_path(tmp_path) if os.path.exists(tmp_path) else None
+        except Exception:
+            raw = None
+        if raw is None or validate_memory(raw)[1] is None:
+            result["action"] = f"已隔离到 {store.quarantine(path)}"
+            result["index"] = "delete"
+            return result
+        store.quarantine(path)
+        os.replace(tmp_path, path)
+        result["action"] = "已从临时文件恢复"
+        raw = MemoryStore.read_path(path)
+
+    problems, fixed = validate_memory(raw)
+    result["problems"].extend(problems)
+    if fixed is None:
+        if repair:
+            result["action"] = f"已隔离到 {store.quarantine(path)}"
+            result["index"] = "delete"
+        return result
+    if repair and problems:
+        rewrite(path, tier, fixed)
+        result["action"] = result["action"] or "已修复"
+    if repair and result["action"]:
+        result["index"] = file_index_entry(path, tier, fixed)
+    return result
+
+def compact_file(memory_dir: str, cold_after_seconds: Optional[float], item: Tuple[str, str, str]) -> Dict[str, Any]:
+    """将温数据重写为紧凑格式，空闲超过阈值时压缩为冷数据；返回节省的字节数和新的索引条目"""
+    key, tier, path = item
+    result = {"key": key, "saved": 0, "rewritten": False, "compressed": False, "index": None, "error": None}
+    store = MemoryStore(memory_dir)
+    try:
+        # 写入中断残留的临时文件
+        if os.path.exists(path + ".tmp"):
+            result["saved"] += os.path.getsize(path + ".tmp")
+            os.remove(path + ".tmp")
+        if tier == TIER_COLD:
+            return result
+        raw = MemoryStore.read_path(path)
+        problems, fixed = validate_memory(raw)
+        if problems:
+            raise ValueError(f"存在 {len(problems)} 个结构问题，请先运行 validate --repair")
+        size = os.path.getsize(path)
+        last_activity = os.path.getmtime(path)
+        compact = json.dumps(fixed, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if raw.get("version", 1) < SCHEMA_VERSION or len(compact) < size:
+            result["saved"] += size - rewrite(path, tier, fixed)
+            result["rewritten"] = True
+        result["index"] = file_index_entry(path, TIER_WARM, fixed, last_activity)
+        if cold_after_seconds is not None and time.time() - last_activity >= cold_after_seconds:
+            result["saved"] += store.compress(key)
+            result["compressed"] = True
+            result["index"] = file_index_entry(store.cold_path(key), TIER_COLD, fixed, last_activity)
+    except Exception as e:
+        result["error"] = f"{path}: {str(e)}"
+    return result
+
+def stat_file(item: Tuple[str, str, str]) -> Dict[str, Any]:
+    key, tier, path = item
+    result = {"key": key, "tier": tier, "size": os.path.getsize(path), "error": None}
+    try:
+        raw = MemoryStore.read_path(path)
+        memory = decode_memory(raw)
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+    result.update({
+        "version": raw.get("version", 1),
+        "entries": len(memory["history"]),
+        "chars": sum(len(entry.content) for entry in memory["history"]),
+        "participants": len(memory["participants"].rows) - 1,
+        "summary_chars": len(memory["summary"]),
+        "profiles": len(memory.get("profiles", {})),
+        "digests": len(memory.get("digests", [])),
+        # 旧版平铺目录中的文件直接位于 users/groups 目录下
+        "legacy": os.path.basename(os.path.dirname(path)) == key.split("_", 1)[0] + "s"
+    })
+    return result
+
+# ---------- 命令 ----------
+
+def cmd_export(store: MemoryStore, args: argparse.Namespace) -> None:
+    exported = errors = 0
+    with open_jsonl(args.output, "w") as out:
+        for line, error in run_parallel(export_file, store.iter_files(), args.workers, args.window):
+            if error:
+                errors += 1
+                print(f"导出失败 {error}")
+                continue
+            out.write(line + "\n")
+            exported += 1
+    print(f"已导出 {exported} 个记忆到 {args.output}，失败 {errors} 个")
+
+def cmd_import(store: MemoryStore, args: argparse.Namespace) -> None:
+    counts: Counter = Counter()
+    index_updates: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    def read_lines() -> Iterator[str]:
+        with open_jsonl(args.input, "r") as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+    func = partial(import_line, store.memory_dir, args.overwrite)
+    for number, (status, key, detail) in enumerate(run_parallel(func, read_lines(), args.workers, args.window), 1):
+        counts[status] += 1
+        if status == "invalid":
+            print(f"第 {number} 行无效: {detail['error']}")
+        elif status == "imported":
+            index_updates[key] = detail
+    store.update_index(index_updates)
+    print(f"导入 {counts['imported']} 个，跳过已存在 {counts['skipped']} 个，无效 {counts['invalid']} 行")
+
+def cmd_validate(store: MemoryStore, args: argparse.Namespace) -> None:
+    checked = broken = 0
+    index_updates: Dict[str, Optional[Dict[str, Any]]] = {}
+    func = partial(validate_file, store.memory_dir, args.repair)
+    for result in run_parallel(func, store.iter_files(), args.workers, args.window):
+        checked += 1
+        if not result["problems"]:
+            continue
+        broken += 1
+        print(f"{result['key']} ({result['path']}):")
+        for problem in result["problems"][:args.max_problems]:
+            print(f"  - {problem}")
+        if len(result["problems"]) > args.max_problems:
+            print(f"  - ……共 {len(result['problems'])} 个问题")
+        if result["action"]:
+            print(f"  => {result['action']}")
+        if result["index"] == "delete":
+            index_updates[result["key"]] = None
+        elif result["index"]:
+            index_updates[result["key"]] = result["index"]
+    if index_updates:
+        store.update_index(index_updates)
+    print(f"检查 {checked} 个文件，有问题 {broken} 个" + ("" if args.repair else "（使用 --repair 修复）"))
+
+def cmd_compact(store: MemoryStore, args: argparse.Namespace) -> None:
+    cold_after = args.cold_after_days * 86400 if args.cold_after_days is not None else None
+    func = partial(compact_file, store.memory_dir, cold_after)
+    counts: Counter = Counter()
+    saved = 0
+    index_updates: Dict[str, Optional[Dict[str, Any]]] = {}
+    # 先将旧版平铺目录中的文件移动到分片目录（只是重命名，在主进程中顺序执行）
+    legacy_keys = store.legacy_keys()
+    for key in legacy_keys:
+        store.migrate_key(key)
+    if legacy_keys:
+        print(f"已迁移旧版目录中的 {len(legacy_keys)} 个记忆")
+    for result in run_parallel(func, list(store.iter_files()), args.workers, args.window):
+        if result["error"]:
+            counts["errors"] += 1
+            print(f"压缩失败 {result['error']}")
+            continue
+        counts["rewritten"] += result["rewritten"]
+        counts["compressed"] += result["compressed"]
+        saved += result["saved"]
+        if result["index"]:
+            index_updates[result["key"]] = result["index"]
+    store.update_index(index_updates)
+    print(
+        f"重写 {counts['rewritten']} 个，压缩归档 {counts['compressed']} 个，失败 {counts['errors']} 个，"
+        f"节省 {saved / 1048576:.1f}MB"
+    )
+
+def cmd_stats(store: MemoryStore, args: argparse.Namespace) -> None:
+    totals: Counter = Counter()
+    tiers: Counter = Counter()
+    versions: Counter = Counter()
+    largest: List[Tuple[int, str]] = []
+    errors = 0
+    for result in run_parallel(stat_file, store.iter_files(), args.workers, args.window):
+        if result["error"]:
+            errors += 1
+            continue
+        tiers[result["tier"]] += 1
+        versions[result["version"]] += 1
+        totals["size_" + result["tier"]] += result["size"]
+        for field in ("entries", "chars", "participants", "summary_chars", "profiles", "digests"):
+            totals[field] += result[field]
+        totals["legacy"] += result["legacy"]
+        heapq.heappush(largest, (result["size"], result["key"]))
+        if len(largest) > args.top:
+            heapq.heappop(largest)
+    count = sum(tiers.values())
+    print(f"记忆数: {count}（温数据 {tiers[TIER_WARM]}，冷数据 {tiers[TIER_COLD]}，旧版目录 {totals['legacy']}，无法解析 {errors}）")
+    print(f"磁盘占用: 温数据 {totals['size_' + TIER_WARM] / 1048576:.1f}MB，冷数据 {totals['size_' + TIER_COLD] / 1048576:.1f}MB")
+    print("文件格式: " + "，".join(f"version {version}: {n}" for version, n in sorted(versions.items())))
+    if count:
+        print(
+            f"历史记录: {totals['entries']} 条（平均 {totals['entries'] / count:.1f} 条，{totals['chars'] / 1e4:.1f}万字），"
+            f"总结 {totals['summary_chars'] / 1e4:.1f}万字，参与者 {totals['participants']} 人次，"
+            f"用户画像 {totals['profiles']} 个，群聊摘要 {totals['digests']} 条"
+        )
+    if largest:
+        print(f"最大的 {len(largest)} 个记忆:")
+        for size, key in sorted(largest, reverse=True):
+            print(f"  {key}: {size / 1024:.1f}KB")
+
+COMMANDS: Dict[str, Callable[[MemoryStore, argparse.Namespace], None]] = {
+    "export": cmd_export,
+    "import": cmd_import,
+    "validate": cmd_validate,
+    "compact": cmd_compact,
+    "stats": cmd_stats,
+}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="记忆文件离线维护工具")
+    parser.add_argument(
+        "--memory-dir", default=os.path.join(config_manager.get_data_dir(), "memories"),
+        help="记忆目录（默认为插件数据目录下的 memories）"
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行进程数，1为单进程")
+    parser.add_argument("--window", type=int, default=64, help="同时在途的最大文件数")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export = subparsers.add_parser("export", help="导出为JSONL")
+    export.add_argument("output", help="输出文件，.gz结尾时压缩")
+
+    import_ = subparsers.add_parser("import", help="从JSONL导入")
+    import_.add_argument("input", help="export 生成的文件")
+    import_.add_argument("--overwrite", action="store_true", help="覆盖已存在的记忆")
+
+    validate = subparsers.add_parser("validate", help="检查并修复记忆文件")
+    validate.add_argument("--repair", action="store_true", help="修复结构问题，隔离无法解析的文件")
+    validate.add_argument("--max-problems", type=int, default=5, help="每个文件最多显示的问题数")
+
+    compact = subparsers.add_parser("compact", help="重写为紧凑格式并清理临时文件")
+    compact.add_argument("--cold-after-days", type=float, default=None, help="同时压缩空闲超过该天数的记忆")
+
+    stats = subparsers.add_parser("stats", help="统计信息")
+    stats.add_argument("--top", type=int, default=10, help="显示最大的记忆数")
+
+    args = parser.parse_args()
+    store = MemoryStore(args.memory_dir)
+    COMMANDS[args.command](store, args)
+
+if __name__ == "__main__":
+    main()
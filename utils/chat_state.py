@@ -0,0 +1,210 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from .memory_store import shard_dirs
+from .disk_io import run_io
+
+# 每个聊天的状态字段
+FIELD_REPLY = "reply"      # 回复模式：on/off/admin/active，缺省为 on
+FIELD_PROMPTS = "prompts"  # 提示词开关，只记录与默认（启用）不同的项：{名称: False}
+FIELD_DIGEST = "digest"    # 是否开启摘要模式（仅群聊）
+
+DEFAULT_REPLY_MODE = "on"
+
+CACHE_MAX_CHATS = 10000  # 内存中缓存状态的聊天数上限，超出时淘汰最久未使用的
+
+def chat_key(context: str) -> str:
+    """统一聊天标识：提示词模块使用的 private_123 转换为 user_123"""
+    if context.startswith("private_"):
+        return "user_" + context[len("private_"):]
+    return context
+
+class ChatStateStore:
+    """按聊天存储的状态（回复模式、提示词开关、摘要模式）
+
+    每个聊天一个文件：chat_state/<users|groups>/<ab>/<cd>/<id>.json，
+    读写只涉及该聊天自己的文件，不再整体重写 config.json / prompts_config.json；
+    读取过的聊天缓存在内存中（没有文件的聊天缓存为空状态，按LRU淘汰），热路径上只是字典查找；
+    事件循环中使用前先 await preload(key)，在磁盘线程池中读取未缓存的聊天
+    """
+
+    def __init__(self, state_dir: str, max_cached: int = CACHE_MAX_CHATS):
+        self.state_dir = state_dir
+        self.max_cached = max_cached
+        # 聊天标识 -> 状态字段
+        self.cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.lock = threading.RLock()
+
+    def path(self, key: str) -> str:
+        prefix, id = key.split("_", 1)
+        return os.path.join(self.state_dir, prefix + "s", *shard_dirs(id), f"{id}.json")
+
+    def _cached(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            state = self.cache.get(key)
+            if state is not None:
+                self.cache.move_to_end(key)
+            return state
+
+    def _store(self, key: str, state: Dict[str, Any]) -> None:
+        with self.lock:
+            self.cache[key] = state
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+
+    def _load(self, key: str) -> Dict[str, Any]:
+        state = self._cached(key)
+        if state is not None:
+            return state
+        # 在锁外读取文件，读取期间不阻塞其他聊天的缓存查找
+        state = {}
+        path = self.path(key)
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+            except Exception as e:
+                print(f"读取聊天状态失败 {path}: {str(e)}")
+        with self.lock:
+            # 读取期间其他线程已加载或写入时以缓存为准
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+            self._store(key, state)
+            return state
+
+    async def preload(self, key: str) -> None:
+        """确保该聊天的状态已在缓存中（未缓存时在磁盘线程池中读取），之后的 get 不再访问磁盘"""
+        if self._cached(key) is None:
+            await run_io(self._load, key)
+
+    def _write(self, key: str, state: Dict[str, Any]) -> None:
+        path = self.path(key)
+        if not state:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def get(self, key: str, field: str, default: Any = None) -> Any:
+        """读取聊天状态字段"""
+        return self._load(key).get(field, default)
+
+    def set(self, key: str, field: str, value: Any) -> bool:
+        """写入聊天状态字段，value 为 None 时删除该字段；只重写该聊天的文件"""
+        try:
+            with self.lock:
+                # 复制后替换，读取方拿到的状态字典不会被原地修改
+                state = dict(self._load(key))
+                if value is None:
+                    if field not in state:
+                        return True
+                    del state[field]
+                else:
+                    state[field] = value
+                self._write(key, state)
+                self._store(key, state)
+            return True
+        except Exception as e:
+            print(f"保存聊天状态失败 {key}.{field}: {str(e)}")
+            return False
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """遍历磁盘上所有聊天的状态（用于删除提示词等低频的全量操作）"""
+        for prefix in ("user", "group"):
+            root = os.path.join(self.state_dir, prefix + "s")
+            for dir_path, _, filenames in os.walk(root):
+                for filename in sorted(filenames):
+                    if filename.endswith(".json"):
+                        key = f"{prefix}_{filename[:-len('.json')]}"
+                        yield key, self._load(key)
+
+    # 提示词开关
+
+    def prompt_overrides(self, key: str) -> Dict[str, bool]:
+        """该聊天中被禁用的提示词 {名称: False}"""
+        return self.get(key, FIELD_PROMPTS, {})
+
+    def set_prompt_status(self, key: str, status: Dict[str, bool]) -> bool:
+        """保存完整的提示词开关，只记录与默认不同（禁用）的项"""
+        overrides = {name: False for name, enabled in status.items() if not enabled}
+        return self.set(key, FIELD_PROMPTS, overrides or None)
+
+    def migrate_legacy(self, config_manager) -> int:
+        """把旧版保存在 config.json 的 reply_status、digest_groups 和
+        prompts_config.json 的 context_status 迁移到按聊天的存储，迁移后从原文件中移除，返回迁移的聊天数"""
+        migrated = set()
+        failed = 0
+        config = config_manager.load_config("config.json")
+        reply_status = config.get("reply_status") or {}
+        digest_groups = config.get("digest_groups") or {}
+        for key, mode in reply_status.items():
+            # 更早的版本用布尔值表示开关
+            if isinstance(mode, bool):
+                mode = "on" if mode else "off"
+            if mode != DEFAULT_REPLY_MODE:
+                if self.set(key, FIELD_REPLY, mode):
+                    migrated.add(key)
+                else:
+                    failed += 1
+        for key, enabled in digest_groups.items():
+            if enabled:
+                if self.set(key, FIELD_DIGEST, True):
+                    migrated.add(key)
+                else:
+                    failed += 1
+
+        prompts_config = config_manager.load_config("prompts_config.json")
+        context_status = prompts_config.get("context_status") or {}
+        for context, status in context_status.items():
+            key = chat_key(context)
+            if any(not enabled for enabled in status.values()):
+                if self.set_prompt_status(key, status):
+                    migrated.add(key)
+                else:
+                    failed += 1
+
+        if failed:
+            # 有聊天迁移失败时保留原配置，下次启动重试
+            print(f"{failed} 个聊天状态迁移失败，暂不从配置文件中移除")
+            return len(migrated)
+        if "reply_status" in config or "digest_groups" in config:
+            config = dict(config)
+            config.pop("reply_status", None)
+            config.pop("digest_groups", None)
+            config_manager.save_config("config.json", config)
+        if "context_status" in prompts_config:
+            prompts_config = dict(prompts_config)
+            del prompts_config["context_status"]
+            config_manager.save_config("prompts_config.json", prompts_config)
+        if migrated:
+            print(f"已将 {len(migrated)} 个聊天的状态从配置文件迁移到 {self.state_dir}")
+        return len(migrated)
+
+# 全局聊天状态实例
+chat_state = None
+
+def get_chat_state(data_dir: str = None) -> ChatStateStore:
+    """获取聊天状态存储（单例模式），首次获取时迁移旧版配置中的聊天状态
+
+    迁移会读写配置文件，机器人启动时在磁盘线程池中调用，不在事件循环中执行
+    """
+    global chat_state
+    if chat_state is None:
+        from .config import config_manager
+        actual_data_dir = data_dir or config_manager.get_data_dir()
+        store = ChatStateStore(os.path.join(actual_data_dir, "chat_state"))
+        try:
+            store.migrate_legacy(config_manager)
+        except Exception as e:
+            print(f"迁移旧版聊天状态失败: {str(e)}")
+        chat_state = store
+    return chat_state
@@ -1,17 +1,249 @@
 import os
 import json
-from typing import Dict, Any, Optional
+import threading
+from types import MappingProxyType
+from typing import Dict, Any, Callable, FrozenSet, List, Mapping, NamedTuple, Optional, Tuple
+
+# 未配置管理员时的默认管理员
+DEFAULT_ADMINS = ["757519749"]
+# 未配置上下文预算时的默认值
+DEFAULT_CONTEXT_BUDGET = 6000
+# 保存配置后延迟该秒数再写入文件，期间对同一文件的多次修改合并为一次写入
+CONFIG_WRITE_DELAY = 1.0
+# 配置修改日志：修改先追加到日志再延迟写入文件，进程在写入前退出时启动后按日志恢复
+JOURNAL_FILE = "config.journal"
+
+def write_json_atomic(path: str, data: Any) -> None:
+    """先写临时文件并刷到磁盘，再替换目标文件，读取方和崩溃后都只会看到完整的旧文件或新文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def set_path(config: Dict[str, Any], keys: str, value: Any) -> Dict[str, Any]:
+    """按点分隔的键路径设置值，返回新配置；路径上的字典都复制一份（写时复制），不改动原配置"""
+    config = dict(config)
+    parts = keys.split(".")
+    current = config
+    for part in parts[:-1]:
+        child = current.get(part)
+        current[part] = dict(child) if isinstance(child, dict) else {}
+        current = current[part]
+    current[parts[-1]] = value
+    return config
+
+class ProviderSettings(NamedTuple):
+    """当前模型对应接口的请求参数"""
+    api_key: str
+    model: str
+    url: str
+
+class ConfigSnapshot(NamedTuple):
+    """某一配置版本的只读快照，热路径直接读取属性，不再逐级查找配置字典
+
+    快照在配置变化后首次访问时重建，字典类字段为只读视图
+    """
+    version: int
+    current_model: str
+    admins: FrozenSet[str]
+    split_enabled: bool
+    split_prompt: str
+    max_history: int
+    global_qps_limit: int
+    proxies: Mapping[str, str]
+    gemini: ProviderSettings
+    deepseek: ProviderSettings
+    cooldowns: Mapping[str, float]  # 模型ID -> 单独配置的冷却秒数
+    default_cooldowns: Mapping[str, float]  # gemini/deepseek -> 未单独配置的模型的冷却秒数
+    context_budgets: Mapping[str, int]
+    default_context_budget: int
+
+    def is_admin(self, user_id: str) -> bool:
+        return user_id in self.admins
+
+    def cooldown(self, model_id: str) -> float:
+        """模型的冷却时间（秒）"""
+        cooldown = self.cooldowns.get(model_id)
+        if cooldown is None:
+            cooldown = self.default_cooldowns["gemini" if model_id.startswith("gemini") else "deepseek"]
+        return cooldown
+
+    def context_budget(self, model_id: str) -> int:
+        """模型单次请求的上下文token预算"""
+        return self.context_budgets.get(model_id, self.default_context_budget)
+
+def build_snapshot(version: int, get_value: Callable[..., Any]) -> ConfigSnapshot:
+    """按当前配置构建快照，各项的默认值与原先逐项读取时一致"""
+    current_model = get_value("model_config.json", "current_model", "gemini-2.5-pro")
+    gemini_key = get_value("core_config.json", "api_keys.gemini", "")
+    gemini_model = current_model if current_model.startswith("gemini") else get_value("core_config.json", "models.gemini", "gemini-2.5-pro")
+    gemini_url = get_value(
+        "core_config.json", "urls.gemini",
+        "https://generativelanguage.googleapis.com/v1/models/{model}:generateContent?key={key}"
+    ).format(model=gemini_model, key=gemini_key)
+    deepseek_model = current_model if current_model.startswith("deepseek") else get_value("core_config.json", "models.deepseek", "deepseek-chat")
+    budgets = get_value("model_config.json", "context_budgets", {}) or {}
+    return ConfigSnapshot(
+        version=version,
+        current_model=current_model,
+        admins=frozenset(str(admin) for admin in get_value("admin_config.json", "admin_qq", DEFAULT_ADMINS)),
+        split_enabled=bool(get_value("config.json", "split_enabled", False)),
+        split_prompt=get_value("split_config.json", "prompt", ""),
+        max_history=get_value("config.json", "max_history", 30),
+        global_qps_limit=get_value("core_config.json", "rate_limit.global_qps_limit", 2),
+        proxies=MappingProxyType(dict(get_value("core_config.json", "proxies", {}) or {})),
+        gemini=ProviderSettings(gemini_key, gemini_model, gemini_url),
+        deepseek=ProviderSettings(
+            get_value("core_config.json", "api_keys.deepseek", ""),
+            deepseek_model,
+            get_value("core_config.json", "urls.deepseek", "https://api.deepseek.com/v1/chat/completions")
+        ),
+        cooldowns=MappingProxyType({
+            model_id: seconds
+            for model_id, seconds in (get_value("model_config.json", "cooldowns", {}) or {}).items()
+            if seconds is not None
+        }),
+        default_cooldowns=MappingProxyType({
+            "gemini": get_value("core_config.json", "rate_limit.gemini_cooldown", 15),
+            "deepseek": get_value("core_config.json", "rate_limit.deepseek_cooldown", 2)
+        }),
+        context_budgets=MappingProxyType({
+            model_id: int(budget) for model_id, budget in budgets.items()
+            if model_id != "default" and budget is not None
+        }),
+        default_context_budget=int(budgets.get("default", DEFAULT_CONTEXT_BUDGET))
+    )
+
+def validate_config(config: Any, defaults: Dict[str, Any], path: str = "") -> List[str]:
+    """按默认配置的结构检查配置，返回错误列表
+
+    只检查默认配置中存在的键：对象必须仍为对象，布尔值、数字、字符串、列表的类型需一致；
+    缺失的键由默认值补全，不视为错误
+    """
+    if not isinstance(config, dict):
+        return [f"{path or '顶层'} 应为对象"]
+    errors = []
+    for key, default in defaults.items():
+        if key not in config:
+            continue
+        value = config[key]
+        name = f"{path}.{key}" if path else key
+        if isinstance(default, dict):
+            if isinstance(value, dict):
+                errors.extend(validate_config(value, default, name))
+            else:
+                errors.append(f"{name} 应为对象")
+        elif isinstance(default, bool):
+            if not isinstance(value, bool):
+                errors.append(f"{name} 应为布尔值")
+        elif isinstance(default, (int, float)):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                errors.append(f"{name} 应为数字")
+        elif isinstance(default, str):
+            if not isinstance(value, str):
+                errors.append(f"{name} 应为字符串")
+        elif isinstance(default, list):
+            if not isinstance(value, list):
+                errors.append(f"{name} 应为列表")
+    return errors
 
 class ConfigManager:
-    """统一的配置管理器"""
+    """统一的配置管理器
+
+    配置文件在修改后由后台线程重新加载（见 start_watcher）：新文件校验通过后整体替换缓存中的配置，
+    读取方只会看到替换前或替换后的完整配置；set_value 复制修改路径上的字典后再替换，不改动正在被读取的配置
+
+    保存配置时立即更新缓存并追加到修改日志（config.journal），文件在 CONFIG_WRITE_DELAY 秒后统一写入，
+    短时间内的多次修改只写一次；写入使用临时文件+替换，全部写入后清空日志。
+    进程在写入前退出时，下次加载配置前按日志重放修改；退出前应调用 flush
+
+    连接共享状态后端（attach_backend）后，保存和重新加载的配置会发布到后端，
+    监视线程同时拉取其他进程发布的配置，多个进程使用同一份配置
+    """
     
     def __init__(self):
         self.data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
         self.configs: Dict[str, Dict[str, Any]] = {}
+        # 配置版本：保存或重新加载配置时递增，快照按版本缓存
+        self.version = 0
+        self._snapshot: Optional[ConfigSnapshot] = None
+        # 已加载文件的 (修改时间, 大小)，用于发现外部修改
+        self.file_stats: Dict[str, Tuple[int, int]] = {}
+        # 保存配置与重新加载互斥，避免基于旧配置的修改覆盖刚加载的新配置
+        self.lock = threading.RLock()
+        self.watcher: Optional[threading.Thread] = None
+        self.watcher_stop = threading.Event()
+        # 已修改但尚未写入文件的配置
+        self.dirty: set = set()
+        self.flush_timer: Optional[threading.Timer] = None
+        self.journal_recovered = False
+        # 共享状态后端（见 utils/state_backend.py），以及已应用的各配置在后端中的版本号
+        self.shared = None
+        self.shared_versions: Dict[str, int] = {}
         self.default_configs = {
             "config.json": {
                 "split_enabled": False,
-                "reply_status": {}  # 格式: {"user_123": True, "group_456": False}
+                "max_history": 30,
+                "summary_threshold": 50,  # 历史记录达到该条数时触发后台总结
+                "summary_interval": 3600,  # 两次总结的最小间隔（秒）
+                "retrieval_top_k": 5,  # 从归档记录中召回的相关消息条数，0为关闭
+                "shard_workers": 0,  # 归档检索使用的分片工作进程数（按记忆键哈希分配），0为在本进程的线程中执行；修改后需重启
+                "shard_timeout": 30,  # 等待分片工作进程返回结果的最长时间（秒），超时的检索按失败处理
+                "config_reload_interval": 5,  # 检查配置文件是否被修改的间隔（秒），0为不自动重新加载
+                "shutdown_timeout": 20,  # 退出时等待正在处理的消息和后台总结完成的最长时间（秒）
+                "disk_io_workers": 4,  # 磁盘读写线程数（记忆、配置、聊天状态、消息索引的读写在这些线程中执行，修改后需重启）
+                "interaction_log": {  # API交互日志由后台线程批量写入；修改后需重启
+                    "batch_size": 50,  # 每写入该条数刷新一次到磁盘
+                    "flush_ms": 1000,  # 最早一条未刷新的记录最多等待的毫秒数
+                    "max_queued": 10000  # 队列中最多等待写入的记录数，超出时丢弃新记录并计数
+                },
+                "warmup": {  # 启动预热：预先建立到模型服务的连接，加载最近活跃聊天的记忆；完成或超时后才开始处理消息
+                    "enabled": True,
+                    "chats": 50,  # 预加载记忆的最近活跃聊天数
+                    "timeout": 15  # 预热的最长时间（秒）
+                },
+                "state_backend": {  # 多个进程共享记忆、配置、限流和总结租约的状态后端
+                    "type": "local",  # local：仅本进程；redis：使用Redis或兼容Redis协议的服务（需安装redis）
+                    "url": "redis://localhost:6379/0",
+                    "prefix": "kirya:"  # 共享同一个服务的不同部署使用不同前缀
+                },
+                "ingest_filter": {  # 写入记忆前的消息过滤（@机器人和私聊的消息只做媒体简写）
+                    "enabled": True,
+                    "media": "abbreviate",  # 媒体消息处理：abbreviate简写为[图片]等/drop丢弃纯媒体消息/keep保留原样
+                    "min_length": 2,  # 纯文本少于该字数的消息丢弃
+                    "drop_patterns": [  # 匹配任一正则的消息丢弃
+                        r"^[哈呵嘿嘻hH]{2,}[!！~～。.]*$",
+                        r"^[6６]+$",
+                        r"^[?？。.!！~～]+$"
+                    ],
+                    "dedup_window": 20,  # 近似重复检测比较的最近消息数，0为关闭
+                    "dedup_seconds": 300,  # 近似重复检测的时间窗口（秒）
+                    "dedup_threshold": 0.8,  # 估算相似度达到该值视为重复
+                    "disabled_rules": []  # 停用的规则：media/short/regex/duplicate
+                },
+                "digest_mode": {  # 高流量群的摘要模式（需用 \摘要模式 on 为群开启）
+                    "rate_threshold": 60,  # 每分钟消息数达到该值时进入摘要模式，低于一半时退出
+                    "ring_size": 600,  # 内存中保留的原始消息条数
+                    "raw_lines": 10,  # 提示词中附带的最近原始消息条数
+                    "raw_max_age": 600,  # 附带的原始消息的最长时间（秒）
+                    "prompt_digests": 10,  # 提示词中附带的每分钟摘要条数
+                    "digest_keep": 120,  # 记忆中保留的每分钟摘要条数，更早的转入归档检索
+                    "flush_interval": 60  # 生成摘要的间隔（秒）
+                },
+                "speaker_focus": {  # 群聊提示词只附带与提问用户相关的记录
+                    "enabled": True,
+                    "context_lines": 3  # 无论是否相关都保留的最近记录数
+                },
+                "memory_storage": {  # 记忆分层存储
+                    "hot_max_mb": 64,  # 内存中缓存记忆的总大小上限
+                    "hot_idle_seconds": 1800,  # 缓存的记忆空闲超过该时间后移出内存
+                    "cold_after_days": 14,  # 记忆文件超过该天数未更新时压缩归档
+                    "disk_budget_mb": 1024,  # 记忆文件（含压缩归档）的磁盘占用上限
+                    "sweep_interval": 600  # 后台清理间隔（秒）
+                }
             },
             "core_config.json": {
                 "api_keys": {
@@ -53,6 +285,13 @@ class ConfigManager:
                     "deepseek-chat": 2,
                     "deepseek-reasoner": 3
                 },
+                "context_budgets": {  # 单次请求的上下文token预算
+                    "default": 6000,
+                    "gemini-2.5-pro": 8000,
+                    "gemini-2.5-flash": 8000,
+                    "deepseek-chat": 6000,
+                    "deepseek-reasoner": 6000
+                },
                 "urls": {
                     "gemini": "https://generativelanguage.googleapis.com/v1/models/{model}:generateContent?key={key}",
                     "deepseek": "https://api.deepseek.com/v1/chat/completions"
@@ -76,9 +315,6 @@ class ConfigManager:
                 "admin_qq": []
             }
         }
-        
-        # 确保数据目录存在
-        os.makedirs(self.data_dir, exist_ok=True)
     
     def get_config_path(self, filename: str) -> str:
         """获取配置文件的完整路径"""
@@ -89,11 +325,13 @@ class ConfigManager:
         # 如果配置已加载，直接返回缓存的配置
         if filename in self.configs:
             return self.configs[filename]
+        if not self.journal_recovered:
+            self.recover_journal()
         
         config_path = self.get_config_path(filename)
         default_config = self.default_configs.get(filename, {})
         
-        # 如果文件不存在，创建默认配置文件
+        # 文件不存在时使用默认配置（文件由 initialize 在机器人启动时创建，导入插件时不写入磁盘）
         if not os.path.exists(config_path):
             # 检查是否有对应的.example文件
             example_path = config_path + ".example"
@@ -104,10 +342,6 @@ class ConfigManager:
                 except Exception as e:
                     print(f"加载示例配置文件失败: {e}，使用内置默认配置")
             
-            # 保存默认配置
-            with open(config_path, "w", encoding="utf-8") as f:
-                json.dump(default_config, f, ensure_ascii=False, indent=2)
-            
             self.configs[filename] = default_config
             return default_config
         
@@ -121,6 +355,7 @@ class ConfigManager:
                 
                 # 缓存配置
                 self.configs[filename] = config
+                self._record_stat(filename)
                 return config
         except (json.JSONDecodeError, Exception) as e:
             print(f"加载配置文件 {filename} 失败: {e}，使用默认配置")
@@ -128,18 +363,212 @@ class ConfigManager:
             return default_config
     
     def save_config(self, filename: str, config: Dict[str, Any]) -> bool:
-        """保存配置到指定文件"""
-        try:
-            config_path = self.get_config_path(filename)
-            with open(config_path, "w", encoding="utf-8") as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
-            
-            # 更新缓存
+        """保存配置到指定文件（立即生效，延迟写入文件）"""
+        return self._commit(filename, config, {"file": filename, "config": config})
+    
+    def _commit(self, filename: str, config: Dict[str, Any], entry: Dict[str, Any]) -> bool:
+        """更新缓存中的配置，把修改追加到日志并安排延迟写入"""
+        with self.lock:
+            try:
+                self._append_journal(entry)
+            except Exception as e:
+                print(f"保存配置文件 {filename} 失败: {e}")
+                return False
             self.configs[filename] = config
+            self.version += 1
+            self._schedule_flush(filename)
+            self._publish(filename, config)
             return True
+    
+    def _schedule_flush(self, filename: str) -> None:
+        self.dirty.add(filename)
+        if self.flush_timer is None:
+            self.flush_timer = threading.Timer(CONFIG_WRITE_DELAY, self.flush)
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
+    
+    def _publish(self, filename: str, config: Dict[str, Any]) -> None:
+        """把配置发布到共享状态后端"""
+        if self.shared is None:
+            return
+        try:
+            self.shared_versions[filename] = self.shared.publish_config(filename, config)
         except Exception as e:
-            print(f"保存配置文件 {filename} 失败: {e}")
-            return False
+            print(f"发布配置 {filename} 到共享状态后端失败: {e}")
+    
+    def attach_backend(self, backend: Any) -> None:
+        """连接共享状态后端：后端中已有的配置覆盖本地配置，后端中没有的本地配置发布到后端"""
+        if not backend.shared:
+            return
+        self.shared = backend
+        self.sync_shared()
+        with self.lock:
+            for filename in self.default_configs:
+                if filename not in self.shared_versions:
+                    self._publish(filename, self.load_config(filename))
+    
+    def sync_shared(self) -> List[str]:
+        """应用其他进程发布到共享状态后端的配置，返回更新的文件名"""
+        if self.shared is None:
+            return []
+        try:
+            changed = self.shared.fetch_configs(self.shared_versions)
+        except Exception as e:
+            print(f"从共享状态后端拉取配置失败: {e}")
+            return []
+        updated = []
+        with self.lock:
+            for filename, (version, config) in changed.items():
+                if version <= self.shared_versions.get(filename, 0):
+                    continue
+                self.shared_versions[filename] = version
+                self._merge_defaults(config, json.loads(json.dumps(self.default_configs.get(filename, {}))))
+                self.configs[filename] = config
+                self.version += 1
+                # 同步写入本地文件
+                self._schedule_flush(filename)
+                updated.append(filename)
+        if updated:
+            print(f"已应用共享配置: {', '.join(sorted(updated))}（配置版本 {self.version}）")
+        return updated
+    
+    def journal_path(self) -> str:
+        return os.path.join(self.data_dir, JOURNAL_FILE)
+    
+    def _append_journal(self, entry: Dict[str, Any]) -> None:
+        os.makedirs(self.data_dir, exist_ok=True)
+        with open(self.journal_path(), "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def flush(self) -> bool:
+        """把所有未写入的配置写入文件，全部成功后清空修改日志"""
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            failed = set()
+            for filename in sorted(self.dirty):
+                try:
+                    write_json_atomic(self.get_config_path(filename), self.configs[filename])
+                    self._record_stat(filename)
+                except Exception as e:
+                    print(f"写入配置文件 {filename} 失败: {e}")
+                    failed.add(filename)
+            self.dirty = failed
+            if failed:
+                # 保留日志，稍后重试
+                self.flush_timer = threading.Timer(CONFIG_WRITE_DELAY, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+                return False
+            try:
+                if os.path.exists(self.journal_path()):
+                    os.remove(self.journal_path())
+            except OSError as e:
+                print(f"清空配置修改日志失败: {e}")
+            return True
+    
+    def recover_journal(self) -> int:
+        """按修改日志重放上次退出前未写入文件的修改，返回恢复的文件数"""
+        with self.lock:
+            self.journal_recovered = True
+            journal_path = self.journal_path()
+            if not os.path.exists(journal_path):
+                return 0
+            pending: Dict[str, Dict[str, Any]] = {}
+            with open(journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 追加到一半时退出，最后一行不完整
+                        break
+                    filename = entry["file"]
+                    if "config" in entry:
+                        pending[filename] = entry["config"]
+                        continue
+                    if filename not in pending:
+                        try:
+                            with open(self.get_config_path(filename), "r", encoding="utf-8") as cf:
+                                pending[filename] = json.load(cf)
+                        except Exception:
+                            pending[filename] = {}
+                    pending[filename] = set_path(pending[filename], entry["keys"], entry["value"])
+            for filename, config in pending.items():
+                write_json_atomic(self.get_config_path(filename), config)
+            os.remove(journal_path)
+            if pending:
+                print(f"已按修改日志恢复配置文件: {', '.join(sorted(pending))}")
+            return len(pending)
+    
+    def _record_stat(self, filename: str) -> None:
+        """记录文件当前的修改时间和大小（自身写入的文件不会被当作外部修改重新加载）"""
+        try:
+            stat = os.stat(self.get_config_path(filename))
+            self.file_stats[filename] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            self.file_stats.pop(filename, None)
+    
+    def check_reload(self) -> List[str]:
+        """检查已加载的配置文件是否被外部修改，校验通过的重新加载，返回重新加载的文件名
+        
+        文件无法解析或校验失败时保留当前配置，同一次修改只提示一次
+        """
+        reloaded = []
+        for filename in list(self.configs):
+            config_path = self.get_config_path(filename)
+            try:
+                stat = os.stat(config_path)
+            except OSError:
+                continue
+            if self.file_stats.get(filename) == (stat.st_mtime_ns, stat.st_size):
+                continue
+            if filename in self.dirty:
+                # 有尚未写入的修改，写入时会覆盖外部修改
+                continue
+            with self.lock:
+                self.file_stats[filename] = (stat.st_mtime_ns, stat.st_size)
+                try:
+                    with open(config_path, "r", encoding="utf-8") as f:
+                        config = json.load(f)
+                except Exception as e:
+                    print(f"配置文件 {filename} 已修改但无法解析，保留当前配置: {e}")
+                    continue
+                defaults = self.default_configs.get(filename, {})
+                errors = validate_config(config, defaults)
+                if errors:
+                    print(f"配置文件 {filename} 校验失败，保留当前配置: " + "；".join(errors[:5]))
+                    continue
+                self._merge_defaults(config, json.loads(json.dumps(defaults)))
+                # 整体替换，读取方不会看到部分更新的配置
+                self.configs[filename] = config
+                self.version += 1
+                self._publish(filename, config)
+            print(f"配置文件 {filename} 已重新加载（配置版本 {self.version}）")
+            reloaded.append(filename)
+        return reloaded
+    
+    def start_watcher(self, interval: float = 5) -> None:
+        """启动后台线程，每隔 interval 秒检查配置文件是否被修改"""
+        if self.watcher is not None and self.watcher.is_alive():
+            return
+        self.watcher_stop.clear()
+        
+        def watch() -> None:
+            while not self.watcher_stop.wait(interval):
+                try:
+                    self.check_reload()
+                    self.sync_shared()
+                except Exception as e:
+                    print(f"检查配置文件修改失败: {e}")
+        
+        self.watcher = threading.Thread(target=watch, name="config-watcher", daemon=True)
+        self.watcher.start()
+    
+    def stop_watcher(self) -> None:
+        self.watcher_stop.set()
     
     def _merge_defaults(self, config: Dict[str, Any], defaults: Dict[str, Any]) -> None:
         """递归合并默认配置到现有配置中"""
@@ -179,24 +608,9 @@ class ConfigManager:
             keys: 用点分隔的键路径，如 "api_keys.gemini"
             value: 要设置的值
         """
-        config = self.load_config(filename).copy()
-        
-        # 处理嵌套键
-        parts = keys.split(".")
-        last_key = parts[-1]
-        
-        # 导航到目标父级
-        current = config
-        for part in parts[:-1]:
-            if part not in current or not isinstance(current[part], dict):
-                current[part] = {}
-            current = current[part]
-        
-        # 设置值
-        current[last_key] = value
-        
-        # 保存配置
-        return self.save_config(filename, config)
+        with self.lock:
+            config = set_path(self.load_config(filename), keys, value)
+            return self._commit(filename, config, {"file": filename, "keys": keys, "value": value})
     
     def get_data_dir(self) -> str:
         """获取数据目录路径
@@ -208,19 +622,37 @@ class ConfigManager:
     
     def reload_config(self, filename: str) -> Dict[str, Any]:
         """重新加载指定配置文件，忽略缓存"""
+        self.flush()
         if filename in self.configs:
             del self.configs[filename]
+        self.version += 1
         return self.load_config(filename)
     
     def reload_all(self) -> None:
         """重新加载所有配置文件"""
+        self.flush()
         self.configs.clear()
+        self.version += 1
+    
+    def snapshot(self) -> ConfigSnapshot:
+        """当前配置版本的只读快照（配置变化后首次访问时重建）"""
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version != self.version:
+            snapshot = self._snapshot = build_snapshot(self.version, self.get_value)
+        return snapshot
     
     def initialize(self) -> None:
-        """初始化配置管理器，加载所有配置文件"""
-        # 预加载所有默认配置文件以确保它们存在
-        for filename in self.default_configs.keys():
-            self.load_config(filename)
+        """创建缺失的配置文件（写入默认配置，便于手动修改），在机器人启动时调用"""
+        with self.lock:
+            for filename in self.default_configs.keys():
+                config = self.load_config(filename)
+                if filename in self.dirty or os.path.exists(self.get_config_path(filename)):
+                    continue
+                try:
+                    write_json_atomic(self.get_config_path(filename), config)
+                    self._record_stat(filename)
+                except Exception as e:
+                    print(f"创建配置文件 {filename} 失败: {e}")
     
     def get_data_dir(self) -> str:
         """获取数据目录路径"""
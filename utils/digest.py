@@ -0,0 +1,196 @@
+import time
+from collections import Counter, OrderedDict, deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .retrieval import WORD_PATTERN, CJK_RUN_PATTERN
+
+# 统计消息速率的时间窗口（秒）
+RATE_WINDOW = 60
+
+class DigestBuffer:
+    """单个群的原始消息环形缓冲区
+
+    消息按到达顺序保存 (时间戳, 发言者, 内容)，超出容量时丢弃最早的消息；
+    digested_until 之前的消息已生成摘要，只用于展示最近的原始发言
+    """
+
+    def __init__(self, ring_size: int = 500):
+        self.messages: Deque[Tuple[float, str, str]] = deque(maxlen=ring_size)
+        self.digested_until = 0.0
+        self.dropped = 0  # 未生成摘要就被挤出缓冲区的消息数
+
+    def add(self, timestamp: float, speaker: str, content: str) -> None:
+        if len(self.messages) == self.messages.maxlen and self.messages[0][0] >= self.digested_until:
+            self.dropped += 1
+        self.messages.append((timestamp, speaker, content))
+
+    def take_windows(self, before: float) -> Dict[int, List[Tuple[float, str, str]]]:
+        """取出 before 之前尚未生成摘要的消息，按分钟分组"""
+        windows: Dict[int, List[Tuple[float, str, str]]] = {}
+        for message in self.messages:
+            if message[0] < self.digested_until:
+                continue
+            if message[0] >= before:
+                break
+            windows.setdefault(int(message[0] // 60 * 60), []).append(message)
+        self.digested_until = max(self.digested_until, before)
+        return windows
+
+    def pending(self) -> int:
+        """尚未生成摘要的消息数"""
+        return sum(1 for message in self.messages if message[0] >= self.digested_until)
+
+    def recent(self, count: int, max_age: float) -> List[Tuple[float, str, str]]:
+        """最近的原始消息（不超过count条且在max_age秒内）"""
+        now = time.time()
+        result = []
+        for message in reversed(self.messages):
+            if len(result) >= count or now - message[0] > max_age:
+                break
+            result.append(message)
+        result.reverse()
+        return result
+
+def phrase_candidates(content: str) -> set:
+    """消息中的候选短语：英文单词和中日韩文字的2~4字片段"""
+    text = content.lower()
+    candidates = {word for word in WORD_PATTERN.findall(text) if len(word) >= 2}
+    for run in CJK_RUN_PATTERN.findall(text):
+        for size in (2, 3, 4):
+            candidates.update(run[i:i + size] for i in range(len(run) - size + 1))
+    return candidates
+
+def extract_phrases(contents: List[str], top: int = 5) -> List[str]:
+    """抽取关键短语：按出现的消息数×长度打分，与已选短语重叠的跳过"""
+    doc_freq: Counter = Counter()
+    for content in contents:
+        doc_freq.update(phrase_candidates(content))
+    ranked = sorted(
+        (term for term, freq in doc_freq.items() if freq >= 2),
+        key=lambda term: (doc_freq[term] * len(term), len(term)),
+        reverse=True
+    )
+    phrases: List[str] = []
+    covered: set = set()
+    for term in ranked:
+        grams = {term[i:i + 2] for i in range(len(term) - 1)} or {term}
+        if grams & covered:
+            continue
+        phrases.append(term)
+        covered.update(grams)
+        if len(phrases) >= top:
+            break
+    return phrases
+
+def build_digest(minute: int, messages: List[Tuple[float, str, str]], top_speakers: int = 3, top_phrases: int = 5) -> Dict:
+    """为一分钟内的消息生成抽取式摘要：活跃发言者、关键词和一条代表发言
+
+    关键词为多条消息共有的短语，代表发言为包含关键词最多的消息
+    """
+    speakers = Counter(speaker for _, speaker, _ in messages)
+    phrases = extract_phrases([content for _, _, content in messages], top_phrases)
+    sample = ""
+    if messages:
+        best = max(messages, key=lambda message: sum(1 for phrase in phrases if phrase in message[2].lower()))
+        sample = best[2][:60]
+    return {
+        "minute": minute,
+        "count": len(messages),
+        "speakers": speakers.most_common(top_speakers),
+        "phrases": phrases,
+        "sample": sample
+    }
+
+def format_digest(digest: Dict) -> str:
+    """将摘要渲染为一行文本"""
+    parts = [f"[{datetime.fromtimestamp(digest['minute']).strftime('%m-%d %H:%M')}] {digest['count']}条消息"]
+    if digest["speakers"]:
+        parts.append("活跃：" + "、".join(f"{name}({count})" for name, count in digest["speakers"]))
+    if digest["phrases"]:
+        parts.append("关键词：" + "、".join(digest["phrases"]))
+    if digest["sample"]:
+        parts.append(f"代表发言：{digest['sample']}")
+    return "；".join(parts)
+
+class DigestManager:
+    """高流量群的摘要模式：统计消息速率，速率超过阈值时消息进入环形缓冲区
+
+    速率降到阈值的一半以下时退出（避免在阈值附近反复切换）
+    """
+
+    def __init__(self, max_keys: int = 256):
+        self.max_keys = max_keys
+        self.rates: "OrderedDict[str, Deque[float]]" = OrderedDict()
+        self.active: Dict[str, bool] = {}
+        self.buffers: Dict[str, DigestBuffer] = {}
+
+    def observe(self, key: str, timestamp: float, threshold: int) -> bool:
+        """记录一条消息，返回该群当前是否处于摘要模式"""
+        window = self.rates.get(key)
+        if window is None:
+            window = self.rates[key] = deque()
+            while len(self.rates) > self.max_keys:
+                old_key, _ = self.rates.popitem(last=False)
+                if old_key not in self.buffers:
+                    self.active.pop(old_key, None)
+        else:
+            self.rates.move_to_end(key)
+        window.append(timestamp)
+        while window and timestamp - window[0] > RATE_WINDOW:
+            window.popleft()
+        rate = len(window)
+        if rate >= threshold:
+            self.active[key] = True
+        elif rate < threshold / 2:
+            self.active[key] = False
+        return self.active.get(key, False)
+
+    def rate(self, key: str) -> int:
+        """最近一分钟的消息数"""
+        window = self.rates.get(key)
+        if not window:
+            return 0
+        now = time.time()
+        return sum(1 for timestamp in window if now - timestamp <= RATE_WINDOW)
+
+    def buffer(self, key: str, ring_size: int) -> DigestBuffer:
+        digest_buffer = self.buffers.get(key)
+        if digest_buffer is None:
+            digest_buffer = self.buffers[key] = DigestBuffer(ring_size)
+        return digest_buffer
+
+    def collect(self, key: str, before: float) -> List[Dict]:
+        """为 before 之前的完整分钟生成摘要"""
+        digest_buffer = self.buffers.get(key)
+        if digest_buffer is None:
+            return []
+        windows = digest_buffer.take_windows(before)
+        return [build_digest(minute, messages) for minute, messages in sorted(windows.items())]
+
+    def recent_lines(self, key: str, count: int, max_age: float) -> List[str]:
+        """最近的原始消息，渲染为"发言者: 内容"的形式"""
+        digest_buffer = self.buffers.get(key)
+        if digest_buffer is None:
+            return []
+        return [f"{speaker}: {content}" for _, speaker, content in digest_buffer.recent(count, max_age)]
+
+    def release_idle(self, key: str, max_age: float) -> None:
+        """摘要已全部生成、且最近没有新消息的群释放缓冲区"""
+        digest_buffer = self.buffers.get(key)
+        if digest_buffer is None or digest_buffer.pending():
+            return
+        if not digest_buffer.messages or time.time() - digest_buffer.messages[-1][0] > max_age:
+            del self.buffers[key]
+            if key not in self.rates:
+                self.active.pop(key, None)
+
+    def stats(self, key: str) -> Optional[Dict[str, int]]:
+        digest_buffer = self.buffers.get(key)
+        if digest_buffer is None:
+            return None
+        return {
+            "buffered": len(digest_buffer.messages),
+            "pending": digest_buffer.pending(),
+            "dropped": digest_buffer.dropped
+        }
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+class DiskExecutor:
+    """磁盘读写专用的有界线程池
+
+    事件循环中的记忆、配置、聊天状态和消息索引读写都在这里执行，一次慢速写入不会阻塞其他聊天；
+    同时最多 workers 个读写并发进行，其余排队。stats 中的排队数和排队等待时间持续偏高说明磁盘是瓶颈
+    """
+
+    def __init__(self, workers: int = 4):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="disk-io")
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.peak_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_seconds = 0.0  # 累计排队时间
+        self.max_wait = 0.0
+        self.run_seconds = 0.0  # 累计执行时间
+
+    def _wrap(self, func: Callable[..., Any], args: tuple, kwargs: Dict[str, Any]) -> Callable[[], Any]:
+        submitted = time.perf_counter()
+        with self.lock:
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+
+        def call() -> Any:
+            started = time.perf_counter()
+            with self.lock:
+                self.queued -= 1
+                self.running += 1
+                self.wait_seconds += started - submitted
+                self.max_wait = max(self.max_wait, started - submitted)
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                with self.lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.completed += 1
+                    self.run_seconds += time.perf_counter() - started
+        return call
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """在磁盘线程池中执行 func(*args, **kwargs) 并等待结果"""
+        return await asyncio.wrap_future(self.executor.submit(self._wrap(func, args, kwargs)))
+
+    def submit(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """提交不需要等待结果的后台写入，出错时打印错误"""
+        future = self.executor.submit(self._wrap(func, args, kwargs))
+        future.add_done_callback(self._report_error)
+        return future
+
+    @staticmethod
+    def _report_error(future: Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            print(f"后台磁盘写入失败: {str(future.exception())}")
+
+    def stats(self) -> Dict[str, Any]:
+        """当前排队/执行中的读写数及累计统计"""
+        with self.lock:
+            completed = self.completed
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "running": self.running,
+                "peak_queued": self.peak_queued,
+                "completed": completed,
+                "failed": self.failed,
+                "avg_wait_ms": self.wait_seconds / completed * 1000 if completed else 0.0,
+                "max_wait_ms": self.max_wait * 1000,
+                "avg_run_ms": self.run_seconds / completed * 1000 if completed else 0.0
+            }
+
+    def shutdown(self) -> None:
+        """等待已提交的读写完成后关闭线程池"""
+        self.executor.shutdown(wait=True)
+
+# 全局磁盘线程池实例
+disk_executor = None
+disk_executor_lock = threading.Lock()
+
+def get_disk_executor() -> DiskExecutor:
+    """获取磁盘线程池（单例模式），线程数由 config.json 的 disk_io_workers 决定，修改后需重启"""
+    global disk_executor
+    if disk_executor is None:
+        with disk_executor_lock:
+            if disk_executor is None:
+                from .config import config_manager
+                disk_executor = DiskExecutor(max(int(config_manager.get_value("config.json", "disk_io_workers", 4)), 1))
+    return disk_executor
+
+async def run_io(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """在磁盘线程池中执行读写并等待结果"""
+    return await get_disk_executor().run(func, *args, **kwargs)
+
+def submit_io(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    """把不需要等待结果的写入提交到磁盘线程池"""
+    return get_disk_executor().submit(func, *args, **kwargs)
@@ -0,0 +1,44 @@
+import threading
+import time
+from typing import Dict
+from urllib.parse import urlsplit
+
+# 每个服务地址保留的连接数（同时进行的请求超过该数时多出的连接用完即关闭）
+POOL_MAXSIZE = 10
+
+# 全局会话实例
+session = None
+session_lock = threading.Lock()
+
+def get_session():
+    """获取共享的 requests.Session（单例模式）
+
+    同一服务地址的请求复用连接池中的连接，只有第一次请求需要解析域名和进行TCP/TLS握手；
+    首次调用时才导入 requests，不影响插件的导入耗时
+    """
+    global session
+    if session is None:
+        with session_lock:
+            if session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                new_session = requests.Session()
+                adapter = HTTPAdapter(pool_maxsize=POOL_MAXSIZE)
+                new_session.mount("https://", adapter)
+                new_session.mount("http://", adapter)
+                session = new_session
+    return session
+
+def warm_up_connection(url: str, proxies: Dict[str, str], timeout: float) -> str:
+    """向服务地址发送一次HEAD请求：解析域名（使用代理时为代理地址）、建立连接并放入连接池，返回结果说明
+
+    只请求站点根路径，不携带密钥，响应状态码无关紧要
+    """
+    parts = urlsplit(url)
+    origin = f"{parts.scheme}://{parts.netloc}/"
+    start = time.perf_counter()
+    try:
+        get_session().head(origin, proxies=dict(proxies), timeout=timeout, allow_redirects=False)
+    except Exception as e:
+        return f"{origin} 连接失败: {str(e)[:80]}"
+    return f"{origin} {(time.perf_counter() - start) * 1000:.0f}ms"
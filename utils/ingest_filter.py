@@ -0,0 +1,191 @@
+import re
+import time
+import zlib
+import random
+from collections import Counter, OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# CQ码，如 [CQ:image,file=xxx.image,url=...]
+CQ_CODE_PATTERN = re.compile(r"\[CQ:([a-z_]+)[^\]]*\]")
+
+# 媒体类CQ码的简写
+MEDIA_LABELS = {
+    "image": "[图片]",
+    "face": "[表情]",
+    "mface": "[表情]",
+    "marketface": "[表情]",
+    "dice": "[骰子]",
+    "rps": "[猜拳]",
+    "record": "[语音]",
+    "video": "[视频]",
+    "file": "[文件]",
+    "forward": "[聊天记录]",
+    "json": "[卡片]",
+    "xml": "[卡片]",
+    "share": "[分享]",
+    "music": "[音乐]",
+    "reply": "",  # 回复引用本身不携带内容
+}
+
+# 近似重复检测参数
+SHINGLE_SIZE = 3  # 按相邻3个字符切分
+MINHASH_PERMUTATIONS = 32
+MINHASH_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+MINHASH_PARAMS = [
+    (_rng.randrange(1, MINHASH_PRIME), _rng.randrange(0, MINHASH_PRIME))
+    for _ in range(MINHASH_PERMUTATIONS)
+]
+
+def abbreviate_media(content: str) -> str:
+    """将CQ码替换为简短的媒体标记，如 [图片]"""
+    if "[CQ:" not in content:
+        return content
+    return CQ_CODE_PATTERN.sub(lambda match: MEDIA_LABELS.get(match.group(1), f"[{match.group(1)}]"), content).strip()
+
+def strip_media(content: str) -> str:
+    """去掉CQ码和媒体标记后的纯文本"""
+    text = CQ_CODE_PATTERN.sub("", content)
+    for label in set(MEDIA_LABELS.values()):
+        if label:
+            text = text.replace(label, "")
+    return text.strip()
+
+def minhash_signature(text: str) -> Tuple[int, ...]:
+    """计算文本字符shingle集合的MinHash签名"""
+    text = re.sub(r"\s+", "", text.lower())
+    if len(text) <= SHINGLE_SIZE:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles]
+    return tuple(min((a * h + b) % MINHASH_PRIME for h in hashes) for a, b in MINHASH_PARAMS)
+
+def estimate_similarity(sig1: Tuple[int, ...], sig2: Tuple[int, ...]) -> float:
+    """根据MinHash签名估算两段文本的Jaccard相似度"""
+    return sum(1 for x, y in zip(sig1, sig2) if x == y) / len(sig1)
+
+class IngestFilter:
+    """写入记忆前的过滤规则
+
+    apply 返回处理后的内容，返回 None 表示丢弃该消息；
+    to_me 为 True（@机器人或私聊）的消息只做内容改写，不应被丢弃
+    """
+
+    name = "base"
+
+    def apply(self, key: str, content: str, to_me: bool, options: Dict[str, Any]) -> Optional[str]:
+        return content
+
+class MediaFilter(IngestFilter):
+    """媒体消息：CQ码简写为 [图片] 等标记，纯媒体消息可按配置丢弃"""
+
+    name = "media"
+
+    def apply(self, key: str, content: str, to_me: bool, options: Dict[str, Any]) -> Optional[str]:
+        mode = options.get("media", "abbreviate")
+        if mode == "keep":
+            return content
+        abbreviated = abbreviate_media(content)
+        if not to_me and not strip_media(abbreviated) and (mode == "drop" or not abbreviated):
+            return None
+        return abbreviated
+
+class LengthFilter(IngestFilter):
+    """丢弃过短的消息（不含媒体标记的字数）"""
+
+    name = "short"
+
+    def apply(self, key: str, content: str, to_me: bool, options: Dict[str, Any]) -> Optional[str]:
+        text = strip_media(content)
+        if not to_me and text and len(text) < options.get("min_length", 2):
+            return None
+        return content
+
+class RegexFilter(IngestFilter):
+    """丢弃匹配配置中任一正则表达式的消息"""
+
+    name = "regex"
+
+    def apply(self, key: str, content: str, to_me: bool, options: Dict[str, Any]) -> Optional[str]:
+        if to_me:
+            return content
+        for pattern in options.get("drop_patterns", []):
+            try:
+                if re.search(pattern, content):
+                    return None
+            except re.error as e:
+                print(f"无效的过滤正则 {pattern}: {str(e)}")
+        return content
+
+class NearDuplicateFilter(IngestFilter):
+    """在时间窗口内折叠重复和近似重复的消息（复读、刷屏）
+
+    每个聊天保留最近 dedup_window 条消息的MinHash签名，
+    与其中任一条的估算相似度达到 dedup_threshold 时丢弃
+    """
+
+    name = "duplicate"
+
+    def __init__(self, max_keys: int = 1024):
+        self.max_keys = max_keys
+        self.windows: "OrderedDict[str, Deque[Tuple[float, Tuple[int, ...]]]]" = OrderedDict()
+
+    def apply(self, key: str, content: str, to_me: bool, options: Dict[str, Any]) -> Optional[str]:
+        window_size = options.get("dedup_window", 20)
+        if window_size <= 0:
+            return content
+        text = strip_media(content) or content
+        signature = minhash_signature(text)
+        now = time.time()
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = deque(maxlen=window_size)
+            while len(self.windows) > self.max_keys:
+                self.windows.popitem(last=False)
+        else:
+            self.windows.move_to_end(key)
+        while window and now - window[0][0] > options.get("dedup_seconds", 300):
+            window.popleft()
+        threshold = options.get("dedup_threshold", 0.8)
+        duplicate = any(estimate_similarity(signature, old) >= threshold for _, old in window)
+        if duplicate and not to_me:
+            return None
+        window.append((now, signature))
+        return content
+
+class IngestPipeline:
+    """按顺序执行的过滤规则链，并按记忆键统计各规则的命中次数"""
+
+    def __init__(self, filters: Optional[List[IngestFilter]] = None):
+        self.filters: List[IngestFilter] = filters or []
+        self.stats: Dict[str, Counter] = {}
+
+    def register(self, ingest_filter: IngestFilter) -> None:
+        """追加过滤规则"""
+        self.filters.append(ingest_filter)
+
+    def process(self, key: str, content: str, to_me: bool, options: Dict[str, Any]) -> Optional[str]:
+        """依次执行过滤规则，返回处理后的内容，None表示丢弃"""
+        counter = self.stats.setdefault(key, Counter())
+        counter["total"] += 1
+        disabled = set(options.get("disabled_rules", []))
+        for ingest_filter in self.filters:
+            if ingest_filter.name in disabled:
+                continue
+            result = ingest_filter.apply(key, content, to_me, options)
+            if result is None:
+                counter[ingest_filter.name] += 1
+                counter["dropped"] += 1
+                return None
+            if result != content:
+                counter[f"{ingest_filter.name}_rewritten"] += 1
+                content = result
+        return content
+
+    def get_stats(self, key: str) -> Counter:
+        return self.stats.get(key, Counter())
+
+def default_pipeline() -> IngestPipeline:
+    """默认规则链：媒体简写 → 过短消息 → 正则 → 近似重复"""
+    return IngestPipeline([MediaFilter(), LengthFilter(), RegexFilter(), NearDuplicateFilter()])
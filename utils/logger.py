@@ -1,25 +1,80 @@
 import os
 import json
+import queue
+import threading
+import time
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional, TextIO, Tuple
+
+# 写入线程退出标记
+STOP = object()
 
 class AIChatLogger:
-    """AI聊天日志记录器"""
-    
+    """AI聊天日志记录器
+
+    调用方只把记录放入队列，由后台写入线程生成日志内容并追加到当日的JSONL文件：
+    文件保持打开，日期变化时切换到新文件；每 batch_size 条或最早一条未写入的记录等待超过 flush_ms 毫秒时刷新到磁盘。
+    队列满（写入跟不上）时丢弃新记录并计数，不阻塞调用方
+    """
+
     def __init__(self, base_dir: str):
         """初始化日志记录器
-        
+
         Args:
             base_dir: 日志文件基础目录
         """
         self.log_dir = os.path.join(base_dir, "logs")
-        os.makedirs(self.log_dir, exist_ok=True)
-    
-    def _get_log_file_path(self) -> str:
-        """获取当日日志文件路径"""
-        today = datetime.now().strftime("%Y-%m-%d")
+        # 日志目录、队列和写入线程在首次记录时创建
+        self.log_dir_ready = False
+        self.queue: Optional[queue.Queue] = None
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.closed = False
+        self.batch_size = 50
+        self.flush_interval = 1.0
+        # 写入线程当前打开的日志文件及其日期
+        self.file: Optional[TextIO] = None
+        self.file_date: Optional[str] = None
+        self.written = 0
+        self.dropped = 0
+
+    def _get_log_file_path(self, date: str = None) -> str:
+        """获取指定日期（默认当日）的日志文件路径"""
+        if not self.log_dir_ready:
+            os.makedirs(self.log_dir, exist_ok=True)
+            self.log_dir_ready = True
+        today = date or datetime.now().strftime("%Y-%m-%d")
         return os.path.join(self.log_dir, f"ai_chat_{today}.jsonl")
-    
+
+    def _ensure_started(self) -> None:
+        """首次记录时读取队列配置并启动写入线程"""
+        with self.lock:
+            if self.thread is not None or self.closed:
+                return
+            from .config import config_manager
+            options = config_manager.get_value("config.json", "interaction_log", {}) or {}
+            self.batch_size = max(int(options.get("batch_size", 50)), 1)
+            self.flush_interval = max(options.get("flush_ms", 1000), 0) / 1000
+            self.queue = queue.Queue(maxsize=max(int(options.get("max_queued", 10000)), 1))
+            self.thread = threading.Thread(target=self._run, name="chat-logger", daemon=True)
+            self.thread.start()
+
+    def _enqueue(self, kind: str, fields: Dict[str, Any]) -> None:
+        if self.thread is None:
+            self._ensure_started()
+        if self.closed:
+            with self.lock:
+                self.dropped += 1
+            return
+        try:
+            self.queue.put_nowait((kind, datetime.now(), fields))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped == 1 or dropped % 1000 == 0:
+                print(f"日志队列已满，已丢弃 {dropped} 条日志")
+
     def log_api_interaction(
         self,
         user_id: str,
@@ -32,8 +87,8 @@ class AIChatLogger:
         memory_content: str = None,
         error: str = None
     ) -> None:
-        """记录API交互日志
-        
+        """记录API交互日志（放入队列后立即返回，之后不要再修改 request_data/response_data）
+
         Args:
             user_id: 用户ID
             group_id: 群组ID（可选）
@@ -45,28 +100,45 @@ class AIChatLogger:
             memory_content: 发送给AI的记忆内容
             error: 错误信息（如有）
         """
-        log_entry = {
-            "timestamp": datetime.now().isoformat(),
+        self._enqueue("api", {
             "user_id": user_id,
             "group_id": group_id,
             "model_name": model_name,
+            "request_data": request_data,
+            "response_data": response_data,
             "user_message": user_message,
             "ai_reply": ai_reply,
             "memory_content": memory_content,
             "error": error
+        })
+
+    def _build_api_entry(self, timestamp: datetime, fields: Dict[str, Any]) -> Dict[str, Any]:
+        """在写入线程中生成API交互日志内容"""
+        request_data = fields["request_data"]
+        response_data = fields["response_data"]
+        log_entry = {
+            "timestamp": timestamp.isoformat(),
+            "user_id": fields["user_id"],
+            "group_id": fields["group_id"],
+            "model_name": fields["model_name"],
+            "user_message": fields["user_message"],
+            "ai_reply": fields["ai_reply"],
+            "memory_content": fields["memory_content"],
+            "error": fields["error"]
         }
-        
+
         # 记录请求和响应数据（但限制大小以避免日志文件过大）
         if request_data:
             # 对于大型请求，只记录部分关键信息
             if isinstance(request_data, dict):
+                request_text = str(request_data)
                 log_entry["request_summary"] = {
                     "type": "api_request",
-                    "has_system_prompt": "system" in str(request_data).lower(),
+                    "has_system_prompt": "system" in request_text.lower(),
                     "has_messages": "messages" in request_data or "contents" in request_data,
-                    "request_size": len(str(request_data))
+                    "request_size": len(request_text)
                 }
-        
+
         if response_data:
             # 对于响应，也只记录关键信息
             log_entry["response_summary"] = {
@@ -75,58 +147,142 @@ class AIChatLogger:
                 "has_content": "choices" in response_data or "candidates" in response_data,
                 "response_size": len(str(response_data))
             }
-        
+
         # 将完整的请求和响应保存到单独的文件（可选，用于调试）
         if request_data and response_data:
-            self._save_full_interaction(user_id, request_data, response_data)
-        
-        # 写入日志文件
-        try:
-            with open(self._get_log_file_path(), "a", encoding="utf-8") as f:
-                f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
-        except Exception as e:
-            # 如果日志写入失败，打印错误但不中断程序
-            print(f"写入日志失败: {str(e)}")
-    
-    def _save_full_interaction(self, user_id: str, request_data: Dict[str, Any], response_data: Dict[str, Any]) -> None:
+            self._save_full_interaction(fields["user_id"], request_data, response_data, timestamp)
+        return log_entry
+
+    def _save_full_interaction(self, user_id: str, request_data: Dict[str, Any], response_data: Dict[str, Any], timestamp: datetime = None) -> None:
         """保存完整的交互数据到单独文件（用于调试）"""
+        timestamp = timestamp or datetime.now()
         debug_dir = os.path.join(self.log_dir, "debug")
         os.makedirs(debug_dir, exist_ok=True)
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        filename = os.path.join(debug_dir, f"interaction_{user_id}_{timestamp}.json")
-        
+
+        filename = os.path.join(debug_dir, f"interaction_{user_id}_{timestamp.strftime('%Y%m%d_%H%M%S_%f')}.json")
+
         full_data = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": timestamp.isoformat(),
             "user_id": user_id,
             "request": request_data,
             "response": response_data
         }
-        
+
         try:
             with open(filename, "w", encoding="utf-8") as f:
                 json.dump(full_data, f, ensure_ascii=False, indent=2)
         except Exception as e:
             print(f"保存完整交互日志失败: {str(e)}")
-    
+
     def log_message(self, message: str, level: str = "info") -> None:
         """记录一般日志消息
-        
+
         Args:
             message: 日志消息
             level: 日志级别 (info, warning, error)
         """
-        log_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "level": level,
-            "message": message
-        }
-        
+        self._enqueue("message", {"level": level, "message": message})
+
+    def _write(self, record: Tuple[str, datetime, Dict[str, Any]]) -> None:
+        """在写入线程中把一条记录追加到记录日期对应的日志文件（日期变化时切换文件）"""
+        kind, timestamp, fields = record
+        if kind == "api":
+            log_entry = self._build_api_entry(timestamp, fields)
+        else:
+            log_entry = {"timestamp": timestamp.isoformat(), **fields}
+        date = timestamp.strftime("%Y-%m-%d")
+        if self.file is None or self.file_date != date:
+            self._close_file()
+            self.file = open(self._get_log_file_path(date), "a", encoding="utf-8")
+            self.file_date = date
+        self.file.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
+        self.written += 1
+
+    def _flush_file(self) -> None:
+        if self.file is not None:
+            try:
+                self.file.flush()
+            except Exception as e:
+                print(f"写入日志失败: {str(e)}")
+
+    def _close_file(self) -> None:
+        if self.file is not None:
+            try:
+                self.file.close()
+            except Exception as e:
+                print(f"写入日志失败: {str(e)}")
+            self.file = None
+            self.file_date = None
+
+    def _run(self) -> None:
+        """写入线程：逐条写入队列中的记录，攒够一批或等待超时后刷新到磁盘"""
+        pending = 0
+        first_pending = 0.0  # 最早一条未刷新的记录的写入时间
+        while True:
+            timeout = None
+            if pending:
+                timeout = max(first_pending + self.flush_interval - time.monotonic(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is STOP:
+                self._close_file()
+                break
+            if isinstance(item, threading.Event):
+                # flush() 的标记：之前的记录都已写入
+                self._flush_file()
+                pending = 0
+                item.set()
+                continue
+            if item is not None:
+                try:
+                    self._write(item)
+                    if not pending:
+                        first_pending = time.monotonic()
+                    pending += 1
+                except Exception as e:
+                    # 如果日志写入失败，打印错误但不中断程序
+                    print(f"写入日志失败: {str(e)}")
+                    self._close_file()
+            if pending and (pending >= self.batch_size or time.monotonic() - first_pending >= self.flush_interval):
+                self._flush_file()
+                pending = 0
+
+    def flush(self, timeout: float = 5) -> bool:
+        """等待队列中已有的记录写入磁盘，超时返回False"""
+        if self.thread is None or not self.thread.is_alive():
+            return True
+        done = threading.Event()
         try:
-            with open(self._get_log_file_path(), "a", encoding="utf-8") as f:
-                f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
-        except Exception as e:
-            print(f"写入日志失败: {str(e)}")
+            self.queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5) -> None:
+        """退出前调用：写入队列中剩余的记录并关闭日志文件，之后的记录计入丢弃数"""
+        with self.lock:
+            self.closed = True
+            thread = self.thread
+        if thread is None:
+            return
+        try:
+            self.queue.put(STOP, timeout=timeout)
+        except queue.Full:
+            print("日志队列已满，关闭前未能写入全部日志")
+            return
+        thread.join(timeout)
+        if self.dropped:
+            print(f"日志记录器已关闭，共写入 {self.written} 条，因队列已满丢弃 {self.dropped} 条")
+
+    def stats(self) -> Dict[str, int]:
+        """已写入、排队中和丢弃的记录数"""
+        return {
+            "written": self.written,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "dropped": self.dropped
+        }
 
 # 创建全局日志器实例
 logger = None
@@ -138,4 +294,4 @@ def get_logger(data_dir: str = None) -> AIChatLogger:
         from .config import config_manager
         actual_data_dir = data_dir or config_manager.get_data_dir()
         logger = AIChatLogger(actual_data_dir)
-    return logger
\ No newline at end of file
+    return logger
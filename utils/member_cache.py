@@ -0,0 +1,118 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# 群成员列表的有效期（秒），过期后在后台重新拉取
+MEMBER_CACHE_TTL = 3600
+# 最多缓存的群数
+MAX_CACHED_GROUPS = 512
+
+class MemberCache:
+    """群成员目录缓存：群号 -> {QQ号: (群名片, 昵称)}
+
+    通过 get_group_member_list 批量填充，收到消息和成员变动通知时逐个更新
+    """
+
+    def __init__(self, ttl: float = MEMBER_CACHE_TTL, max_groups: int = MAX_CACHED_GROUPS):
+        self.ttl = ttl
+        self.max_groups = max_groups
+        # 群号 -> (上次批量拉取时间, 成员表)；未批量拉取过的群时间为0
+        self.groups: "OrderedDict[str, Tuple[float, Dict[str, Tuple[str, str]]]]" = OrderedDict()
+        # 查询统计
+        self.hits = 0
+        self.misses = 0
+
+    def _members(self, group_id: Any) -> Dict[str, Tuple[str, str]]:
+        group_id = str(group_id)
+        entry = self.groups.get(group_id)
+        if entry is None:
+            entry = self.groups[group_id] = (0.0, {})
+            while len(self.groups) > self.max_groups:
+                self.groups.popitem(last=False)
+        else:
+            self.groups.move_to_end(group_id)
+        return entry[1]
+
+    def is_fresh(self, group_id: Any) -> bool:
+        """成员列表是否在有效期内"""
+        entry = self.groups.get(str(group_id))
+        return entry is not None and time.time() - entry[0] < self.ttl
+
+    def is_loaded(self, group_id: Any) -> bool:
+        """是否批量拉取过成员列表（可能已过期）"""
+        entry = self.groups.get(str(group_id))
+        return entry is not None and entry[0] > 0
+
+    def fill(self, group_id: Any, members: List[Dict[str, Any]]) -> int:
+        """用 get_group_member_list 的结果更新成员表，返回成员数
+
+        拉取期间通过消息更新的成员会被拉取结果覆盖；退群的成员由退群通知移除
+        """
+        entry = self.groups.get(str(group_id))
+        table = dict(entry[1]) if entry is not None else {}
+        table.update(
+            (str(member.get("user_id")), (member.get("card") or "", member.get("nickname") or ""))
+            for member in members
+            if member.get("user_id") is not None
+        )
+        self.groups[str(group_id)] = (time.time(), table)
+        self.groups.move_to_end(str(group_id))
+        while len(self.groups) > self.max_groups:
+            self.groups.popitem(last=False)
+        return len(table)
+
+    def update_member(self, group_id: Any, user_id: Any, card: Optional[str] = None, nickname: Optional[str] = None) -> None:
+        """更新单个成员，未提供的字段保持原值"""
+        members = self._members(group_id)
+        old_card, old_nickname = members.get(str(user_id), ("", ""))
+        members[str(user_id)] = (
+            old_card if card is None else card,
+            old_nickname if nickname is None else nickname
+        )
+
+    def remove_group(self, group_id: Any) -> None:
+        self.groups.pop(str(group_id), None)
+
+    def remove_member(self, group_id: Any, user_id: Any) -> None:
+        entry = self.groups.get(str(group_id))
+        if entry is not None:
+            entry[1].pop(str(user_id), None)
+
+    def mark_failed(self, group_id: Any, retry_after: float = 60) -> None:
+        """拉取失败时保留已有数据，retry_after 秒后再重试"""
+        members = self._members(group_id)
+        loaded_at = time.time() - self.ttl + retry_after
+        self.groups[str(group_id)] = (loaded_at, members)
+
+    def invalidate(self, group_id: Any) -> None:
+        """标记成员列表过期（保留已有数据，下次使用时重新拉取）"""
+        entry = self.groups.get(str(group_id))
+        if entry is not None:
+            self.groups[str(group_id)] = (0.0, entry[1])
+
+    def has_member(self, group_id: Any, user_id: Any) -> bool:
+        entry = self.groups.get(str(group_id))
+        return entry is not None and str(user_id) in entry[1]
+
+    def get_name(self, group_id: Any, user_id: Any) -> Optional[str]:
+        """成员的显示名（优先群名片，其次昵称），未缓存时返回None"""
+        entry = self.groups.get(str(group_id))
+        member = entry[1].get(str(user_id)) if entry is not None else None
+        if member is None or not (member[0] or member[1]):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return member[0] or member[1]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "groups": len(self.groups),
+            "members": sum(len(entry[1]) for entry in self.groups.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+# 全局群成员缓存实例
+member_cache = MemberCache()
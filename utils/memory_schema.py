@@ -0,0 +1,247 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+# 记忆文件格式版本
+#   1: history条目为 {"role": "user_<QQ>_<昵称>", "content", "timestamp"}，带缩进的JSON
+#   2: 参与者表 + 以整数ID引用参与者的紧凑条目 [pid, content, timestamp, tokens]
+SCHEMA_VERSION = 2
+
+# 参与者类型
+KIND_AI = "ai"
+KIND_USER = "user"
+KIND_ROLE = "role"  # 自定义角色
+
+AI_ID = 0  # 参与者表中AI固定占用0号
+
+def parse_role_info(role: str) -> str:
+    """解析role字段，提取用户信息"""
+    if role == "ai":
+        return "AI"
+    elif role.startswith("user_"):
+        # 格式：user_qq号_昵称
+        parts = role.split('_', 2)
+        if len(parts) >= 3:
+            qq = parts[1]
+            nickname = parts[2]
+            return f"用户[{qq}:{nickname}]"
+        return "用户"
+    return role
+
+class HistoryEntry:
+    """单条聊天记录，pid为参与者表中的ID"""
+
+    __slots__ = ("pid", "content", "timestamp", "tokens")
+
+    def __init__(self, pid: int, content: str, timestamp: float, tokens: Optional[int] = None):
+        self.pid = pid
+        self.content = content
+        self.timestamp = timestamp
+        self.tokens = tokens  # token数缓存
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, HistoryEntry):
+            return NotImplemented
+        return self.pid == other.pid and self.content == other.content and self.timestamp == other.timestamp
+
+    def to_list(self) -> List:
+        return [self.pid, self.content, self.timestamp, self.tokens]
+
+class ParticipantTable:
+    """单个记忆键的参与者表：QQ号 -> 最新的昵称/群名片
+
+    条目通过整数ID引用参与者，昵称只存一份，改名后自动更新为最新值
+    """
+
+    __slots__ = ("rows", "user_ids", "role_ids", "_labels")
+
+    def __init__(self, rows: Optional[List[List[str]]] = None):
+        # 每行为 [类型, QQ号或角色名, 昵称, 群名片]
+        self.rows: List[List[str]] = rows or [[KIND_AI, "", "AI", ""]]
+        self.user_ids: Dict[str, int] = {}
+        self.role_ids: Dict[str, int] = {}
+        self._labels: Dict[int, str] = {}
+        for pid, row in enumerate(self.rows):
+            if row[0] == KIND_USER:
+                self.user_ids[row[1]] = pid
+            elif row[0] == KIND_ROLE:
+                self.role_ids[row[1]] = pid
+
+    def intern_user(self, qq: str, nickname: str, card: str = "") -> int:
+        """获取用户的参与者ID，不存在时新建，昵称变化时更新"""
+        pid = self.user_ids.get(qq)
+        if pid is None:
+            pid = len(self.rows)
+            self.rows.append([KIND_USER, qq, nickname, card])
+            self.user_ids[qq] = pid
+        else:
+            row = self.rows[pid]
+            if row[2] != nickname or (card and row[3] != card):
+                row[2] = nickname
+                row[3] = card or row[3]
+                self._labels.pop(pid, None)
+        return pid
+
+    def intern_role(self, role: str) -> int:
+        """获取自定义角色或旧格式role字符串对应的参与者ID"""
+        if role == "ai":
+            return AI_ID
+        if role.startswith("user_"):
+            parts = role.split("_", 2)
+            if len(parts) >= 3:
+                return self.intern_user(parts[1], parts[2])
+        pid = self.role_ids.get(role)
+        if pid is None:
+            pid = len(self.rows)
+            self.rows.append([KIND_ROLE, role, role, ""])
+            self.role_ids[role] = pid
+        return pid
+
+    def label(self, pid: int) -> str:
+        """渲染给AI看的发言者标签"""
+        label = self._labels.get(pid)
+        if label is None:
+            label = parse_role_info(self.role_string(pid))
+            self._labels[pid] = label
+        return label
+
+    def role_string(self, pid: int) -> str:
+        """还原为旧格式的role字符串（用于归档和总结）"""
+        if pid >= len(self.rows):
+            return "未知"
+        kind, ident, nickname, _ = self.rows[pid]
+        if kind == KIND_AI:
+            return "ai"
+        if kind == KIND_USER:
+            return f"user_{ident}_{nickname}"
+        return ident
+
+    def qq_of(self, pid: int) -> Optional[str]:
+        """参与者的QQ号，非用户返回None"""
+        if pid < len(self.rows) and self.rows[pid][0] == KIND_USER:
+            return self.rows[pid][1]
+        return None
+
+def new_memory() -> Dict[str, Any]:
+    """创建空记忆"""
+    return {
+        "summary": "",  # AI总结的历史信息
+        "history": [],  # 最近聊天记录（HistoryEntry列表）
+        "participants": ParticipantTable(),  # 参与者表
+        "last_summary_time": 0  # 上次总结时间戳
+    }
+
+def decode_memory(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """将文件中的记忆数据转为内存结构，兼容旧版（version 1）格式"""
+    memory = new_memory()
+    memory["summary"] = raw.get("summary", "")
+    memory["last_summary_time"] = raw.get("last_summary_time", 0)
+    for name, value in raw.items():
+        # 保留其他模块写入的附加字段
+        if name not in ("version", "summary", "last_summary_time", "participants", "history"):
+            memory[name] = value
+
+    if raw.get("version", 1) >= 2:
+        participants = ParticipantTable(raw.get("participants"))
+        memory["participants"] = participants
+        memory["history"] = [HistoryEntry(*item) for item in raw.get("history", [])]
+    else:
+        participants = memory["participants"]
+        memory["history"] = [
+            HistoryEntry(
+                participants.intern_role(item.get("role", "")),
+                item.get("content", ""),
+                item.get("timestamp", 0),
+                item.get("tokens")
+            )
+            for item in raw.get("history", [])
+        ]
+    return memory
+
+def encode_memory(memory: Dict[str, Any]) -> Dict[str, Any]:
+    """将内存结构转为可写入文件的紧凑格式"""
+    raw = {
+        "version": SCHEMA_VERSION,
+        "summary": memory["summary"],
+        "last_summary_time": memory["last_summary_time"],
+        "participants": memory["participants"].rows,
+        "history": [entry.to_list() for entry in memory["history"]]
+    }
+    for name, value in memory.items():
+        if name not in raw:
+            raw[name] = value
+    return raw
+
+def entry_to_dict(participants: ParticipantTable, entry: HistoryEntry) -> Dict[str, Any]:
+    """将条目还原为带role字符串的字典（用于归档和总结）"""
+    return {
+        "role": participants.role_string(entry.pid),
+        "content": entry.content,
+        "timestamp": entry.timestamp
+    }
+
+def validate_memory(raw: Any) -> Tuple[List[str], Optional[Dict[str, Any]]]:
+    """检查文件中的记忆数据，返回 (问题列表, 修复后的紧凑格式数据)
+
+    无效的条目被丢弃，缺失或类型错误的字段使用默认值，乱序的记录按时间重新排序；
+    整体结构无法识别时修复结果为None
+    """
+    if not isinstance(raw, dict):
+        return [f"顶层不是对象: {type(raw).__name__}"], None
+    problems: List[str] = []
+    fixed = dict(raw)
+    if not isinstance(fixed.get("summary", ""), str):
+        problems.append("summary不是字符串")
+        fixed["summary"] = str(fixed["summary"])
+    if not isinstance(fixed.get("last_summary_time", 0), (int, float)):
+        problems.append("last_summary_time不是数字")
+        fixed["last_summary_time"] = 0
+    history = fixed.get("history", [])
+    if not isinstance(history, list):
+        problems.append("history不是列表")
+        history = []
+
+    if fixed.get("version", 1) >= 2:
+        rows = fixed.get("participants")
+        if not isinstance(rows, list) or not rows:
+            problems.append("participants缺失")
+            rows = [[KIND_AI, "", "AI", ""]]
+        valid_rows = []
+        for row in rows:
+            if isinstance(row, list) and len(row) == 4 and all(isinstance(value, str) for value in row):
+                valid_rows.append(row)
+            else:
+                problems.append(f"无效的参与者: {str(row)[:50]}")
+                valid_rows.append([KIND_ROLE, "未知", "未知", ""])
+        if valid_rows[0][0] != KIND_AI:
+            problems.append("参与者表的0号不是AI")
+            valid_rows[0] = [KIND_AI, "", "AI", ""]
+        fixed["participants"] = valid_rows
+        valid_history = []
+        for item in history:
+            if (
+                isinstance(item, list) and len(item) in (3, 4)
+                and isinstance(item[0], int) and 0 <= item[0] < len(valid_rows)
+                and isinstance(item[1], str) and isinstance(item[2], (int, float))
+            ):
+                tokens = item[3] if len(item) == 4 and isinstance(item[3], int) else None
+                valid_history.append([item[0], item[1], item[2], tokens])
+            else:
+                problems.append(f"无效的记录: {str(item)[:50]}")
+    else:
+        valid_history = []
+        for item in history:
+            if (
+                isinstance(item, dict) and isinstance(item.get("role"), str)
+                and isinstance(item.get("content"), str)
+                and isinstance(item.get("timestamp", 0), (int, float))
+            ):
+                valid_history.append(item)
+            else:
+                problems.append(f"无效的记录: {str(item)[:50]}")
+
+    timestamps = [item[2] if isinstance(item, list) else item.get("timestamp", 0) for item in valid_history]
+    # 按到达顺序插入的记录允许有不足1秒的时间倒序
+    if any(a - b >= 1 for a, b in zip(timestamps, timestamps[1:])):
+        problems.append("记录未按时间排序")
+        valid_history.sort(key=lambda item: item[2] if isinstance(item, list) else item.get("timestamp", 0))
+    fixed["history"] = valid_history
+    return problems, encode_memory(decode_memory(fixed))
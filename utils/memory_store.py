@@ -0,0 +1,514 @@
+import os
+import gzip
+import heapq
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .memory_schema import new_memory, decode_memory, encode_memory
+
+# 记忆索引文件，记录每个记忆键的文件大小、条目数、有效内容长度、最近活跃时间和所在层级
+INDEX_FILE = "index.json"
+# 索引在写入记忆后最多延迟该秒数落盘（其余时间只更新内存中的索引）
+INDEX_FLUSH_INTERVAL = 30
+
+TIER_WARM = "warm"
+TIER_COLD = "cold"
+
+# 无法解析的记忆文件移动到该目录（memories/corrupt），而不是被空记忆覆盖
+CORRUPT_DIR = "corrupt"
+
+class MemoryConflict(Exception):
+    """共享存储中的记忆已被其他进程修改，需要重新加载后再修改"""
+
+def shard_dirs(id: str) -> Tuple[str, str]:
+    """按ID的哈希值计算两级分片目录，如 ("ab", "cd")"""
+    digest = hashlib.md5(id.encode("utf-8")).hexdigest()
+    return digest[:2], digest[2:4]
+
+class MemoryStore:
+    """分层记忆存储
+
+    - 热数据：最近访问的记忆缓存在内存中（按LRU淘汰，受内存预算限制）
+    - 温数据：memories/<users|groups>/<ab>/<cd>/<id>.json，未压缩
+    - 冷数据：memories/cold/<users|groups>/<ab>/<cd>/<id>.json.gz，长时间未活跃的记忆压缩归档，
+      下次访问时自动解压回温数据
+
+    旧版平铺目录（<users|groups>/<id>.json）中的文件在首次访问时自动移动到分片目录，
+    也可以通过 migrate_key 批量迁移
+
+    使用共享状态后端（shared.shared 为 True）时以后端中的记忆为准：加载时比较版本号，
+    其他进程写入过的记忆重新读取；保存时按加载时的版本号写入，版本号已变化时抛出 MemoryConflict。
+    本地文件作为副本继续写入，供索引、统计和离线工具使用
+    """
+
+    def __init__(self, memory_dir: str, shared: Optional[Any] = None):
+        self.memory_dir = memory_dir
+        self.shared = shared if shared is not None and shared.shared else None
+        # key -> 内存缓存对应的共享后端版本号
+        self.versions: Dict[str, int] = {}
+        self.cold_dir = os.path.join(memory_dir, "cold")
+        self.corrupt_dir = os.path.join(memory_dir, CORRUPT_DIR)
+        self.index_path = os.path.join(memory_dir, INDEX_FILE)
+        # key -> (记忆数据, 最近访问时间, 估算大小)
+        self.hot: "OrderedDict[str, Tuple[Dict[str, Any], float, int]]" = OrderedDict()
+        self.hot_bytes = 0
+        # 记忆在磁盘线程池的多个线程中加载/保存（同一键由调用方的记忆锁串行），热数据缓存的修改需要加锁
+        self.hot_lock = threading.RLock()
+        # key -> {"size", "entries", "chars", "last_activity", "tier"}
+        self.index: Dict[str, Dict[str, Any]] = {}
+        self.index_loaded = False
+        self.index_dirty = False
+        self.last_index_flush = 0.0
+        # 索引会在压缩/迁移线程和事件循环中同时更新
+        self.index_lock = threading.RLock()
+
+    def attach_backend(self, shared: Any) -> None:
+        """连接共享状态后端（机器人启动时调用），之后加载的记忆都与后端比较版本号"""
+        self.shared = shared if shared.shared else None
+
+    def path(self, key: str) -> str:
+        """温数据文件路径"""
+        prefix, id = key.split("_", 1)
+        return os.path.join(self.memory_dir, prefix + "s", *shard_dirs(id), f"{id}.json")
+
+    def cold_path(self, key: str) -> str:
+        """冷数据文件路径"""
+        prefix, id = key.split("_", 1)
+        return os.path.join(self.cold_dir, prefix + "s", *shard_dirs(id), f"{id}.json.gz")
+
+    def legacy_paths(self, key: str) -> Tuple[str, str]:
+        """旧版平铺目录中的温数据和冷数据文件路径"""
+        prefix, id = key.split("_", 1)
+        return (
+            os.path.join(self.memory_dir, prefix + "s", f"{id}.json"),
+            os.path.join(self.cold_dir, prefix + "s", f"{id}.json.gz")
+        )
+
+    @staticmethod
+    def estimate_size(memory: Dict[str, Any]) -> int:
+        """估算记忆在内存中占用的字节数"""
+        size = 512 + len(memory.get("summary", "")) * 2
+        for entry in memory.get("history", []):
+            size += 120 + len(entry.content) * 2
+        return size
+
+    def _cache(self, key: str, memory: Dict[str, Any]) -> None:
+        size = self.estimate_size(memory)
+        with self.hot_lock:
+            if key in self.hot:
+                self.hot_bytes -= self.hot[key][2]
+            self.hot[key] = (memory, time.time(), size)
+            self.hot.move_to_end(key)
+            self.hot_bytes += size
+
+    # ---------- 索引 ----------
+
+    def load_index(self) -> None:
+        """加载索引文件，不存在或损坏时扫描目录重建"""
+        with self.index_lock:
+            if self.index_loaded:
+                return
+            try:
+                if os.path.exists(self.index_path):
+                    with open(self.index_path, "r", encoding="utf-8") as f:
+                        self.index = json.load(f)
+                    self.index_loaded = True
+                    return
+            except Exception as e:
+                print(f"加载记忆索引失败，将重建: {str(e)}")
+            self.rebuild_index()
+
+    def iter_files(self) -> Iterator[Tuple[str, str, str]]:
+        """遍历所有记忆文件（含旧版平铺目录），依次产出 (记忆键, 层级, 文件路径)，冷数据在前"""
+        for tier, base, suffix in ((TIER_COLD, self.cold_dir, ".json.gz"), (TIER_WARM, self.memory_dir, ".json")):
+            for prefix in ("user", "group"):
+                root = os.path.join(base, prefix + "s")
+                for dir_path, _, filenames in os.walk(root):
+                    for filename in sorted(filenames):
+                        if filename.endswith(suffix):
+                            yield f"{prefix}_{filename[:-len(suffix)]}", tier, os.path.join(dir_path, filename)
+
+    def rebuild_index(self) -> int:
+        """扫描所有记忆文件重建索引（需要读取每个文件），返回记忆数"""
+        index: Dict[str, Dict[str, Any]] = {}
+        for key, tier, file_path in self.iter_files():
+            try:
+                memory = decode_memory(self.read_path(file_path))
+                stat = os.stat(file_path)
+            except Exception as e:
+                print(f"重建索引时读取记忆失败 {file_path}: {str(e)}")
+                continue
+            # 同一键同时存在温数据和冷数据时以温数据为准
+            index[key] = self._index_entry(memory, stat.st_size, tier, stat.st_mtime)
+        with self.index_lock:
+            self.index = index
+            self.index_loaded = True
+            self.index_dirty = True
+        self.flush_index(force=True)
+        return len(index)
+
+    @staticmethod
+    def _index_entry(memory: Dict[str, Any], size: int, tier: str, last_activity: Optional[float] = None) -> Dict[str, Any]:
+        history = memory.get("history", [])
+        if last_activity is None:
+            last_activity = history[-1].timestamp if history else time.time()
+        return {
+            "size": size,
+            "entries": len(history),
+            "chars": sum(len(entry.content) for entry in history),
+            "last_activity": last_activity,
+            "tier": tier
+        }
+
+    def _set_index(self, key: str, entry: Optional[Dict[str, Any]]) -> None:
+        with self.index_lock:
+            self.load_index()
+            if entry is None:
+                self.index.pop(key, None)
+            else:
+                self.index[key] = entry
+            self.index_dirty = True
+
+    def flush_index(self, force: bool = False) -> bool:
+        """索引有变化时写入文件；非强制时距上次写入不足 INDEX_FLUSH_INTERVAL 秒则跳过"""
+        with self.index_lock:
+            if not self.index_dirty:
+                return False
+            if not force and time.time() - self.last_index_flush < INDEX_FLUSH_INTERVAL:
+                return False
+            data = json.dumps(self.index, ensure_ascii=False, separators=(",", ":"))
+            self.index_dirty = False
+            self.last_index_flush = time.time()
+        try:
+            os.makedirs(self.memory_dir, exist_ok=True)
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self.index_path)
+            return True
+        except Exception as e:
+            print(f"保存记忆索引失败: {str(e)}")
+            with self.index_lock:
+                self.index_dirty = True
+            return False
+
+    def update_index(self, entries: Dict[str, Optional[Dict[str, Any]]]) -> None:
+        """批量更新索引（值为None表示删除）并立即写入文件，供离线工具使用"""
+        for key, entry in entries.items():
+            self._set_index(key, entry)
+        self.flush_index(force=True)
+
+    def get_index(self) -> Dict[str, Dict[str, Any]]:
+        """索引的副本"""
+        with self.index_lock:
+            self.load_index()
+            return {key: dict(entry) for key, entry in self.index.items()}
+
+    # ---------- 读写 ----------
+
+    def _move(self, src: str, dst: str) -> None:
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.replace(src, dst)
+
+    def _read_file(self, key: str) -> Optional[Dict[str, Any]]:
+        """从温数据或冷数据读取原始记忆，冷数据会被解压回温数据，旧版平铺目录的文件会移动到分片目录"""
+        path = self.path(key)
+        cold_path = self.cold_path(key)
+        legacy_path, legacy_cold_path = self.legacy_paths(key)
+        if not os.path.exists(path) and os.path.exists(legacy_path):
+            self._move(legacy_path, path)
+        if not os.path.exists(path) and not os.path.exists(cold_path) and os.path.exists(legacy_cold_path):
+            self._move(legacy_cold_path, cold_path)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        if os.path.exists(cold_path):
+            with gzip.open(cold_path, "rt", encoding="utf-8") as f:
+                raw = json.load(f)
+            # 重新活跃的记忆解压回温数据
+            size = self._write_file(path, raw)
+            os.remove(cold_path)
+            with self.index_lock:
+                self.load_index()
+                entry = self.index.get(key)
+                if entry is not None:
+                    entry["size"] = size
+                    entry["tier"] = TIER_WARM
+                    self.index_dirty = True
+            print(f"冷记忆已解压: {key}")
+            return raw
+        return None
+
+    @staticmethod
+    def read_path(path: str) -> Any:
+        """读取单个记忆文件的原始数据（.gz为冷数据），不做迁移或解压回写"""
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def quarantine(self, path: str) -> str:
+        """将损坏的记忆文件移动到 corrupt 目录（保留相对路径并附加时间戳），返回新路径"""
+        relative = os.path.relpath(path, self.memory_dir)
+        target = os.path.join(self.corrupt_dir, f"{relative}.{int(time.time())}")
+        self._move(path, target)
+        return target
+
+    @staticmethod
+    def _write_file(path: str, raw: Dict[str, Any]) -> int:
+        """写入记忆文件，返回文件大小"""
+        # 先写临时文件再替换，读取方不会看到写到一半的文件
+        data = json.dumps(raw, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return len(data)
+
+    def _load_shared(self, key: str) -> Optional[Dict[str, Any]]:
+        """从共享后端加载记忆，内存缓存的版本仍是最新时返回缓存；后端中没有该记忆时返回None"""
+        version = self.shared.get_version("memory:" + key)
+        if version == 0:
+            if self.versions.get(key, 0) != 0:
+                # 已被其他进程删除，本地副本也一并删除
+                self._delete_local(key)
+            self.versions[key] = 0
+            return None
+        cached = self._touch(key)
+        if cached is not None and self.versions.get(key) == version:
+            return cached
+        data, version = self.shared.get_versioned("memory:" + key)
+        if data is None:
+            self.evict(key)
+            self.versions[key] = 0
+            return None
+        memory = decode_memory(json.loads(data))
+        self.versions[key] = version
+        self.evict(key)
+        self._cache(key, memory)
+        return memory
+
+    def _touch(self, key: str) -> Optional[Dict[str, Any]]:
+        """返回缓存中的记忆并更新访问时间，不在缓存中时返回None"""
+        with self.hot_lock:
+            cached = self.hot.get(key)
+            if cached is None:
+                return None
+            self.hot[key] = (cached[0], time.time(), cached[2])
+            self.hot.move_to_end(key)
+            return cached[0]
+
+    def load(self, key: str) -> Dict[str, Any]:
+        """加载记忆，优先使用内存缓存"""
+        if self.shared is not None:
+            memory = self._load_shared(key)
+            if memory is not None:
+                return memory
+            # 后端中还没有该记忆时使用本地文件（首次保存时写入后端）
+        cached = self._touch(key)
+        if cached is not None:
+            return cached
+        try:
+            raw = self._read_file(key)
+        except (ValueError, EOFError, gzip.BadGzipFile) as e:
+            # 文件内容损坏：移到 corrupt 目录，避免下次保存时被空记忆覆盖（可用 tools.memory validate 修复）
+            for path in (self.path(key), self.cold_path(key)):
+                if os.path.exists(path):
+                    print(f"记忆文件已损坏，移动到 {self.quarantine(path)}: {str(e)}")
+                    self._set_index(key, None)
+                    # 温数据损坏时冷数据可能仍然可用
+                    return self.load(key)
+            return new_memory()
+        except Exception as e:
+            print(f"加载记忆失败: {str(e)}")
+            return new_memory()
+        memory = decode_memory(raw) if raw is not None else new_memory()
+        self._cache(key, memory)
+        return memory
+
+    def save(self, key: str, memory: Dict[str, Any]) -> bool:
+        """保存记忆（写入温数据并更新缓存和索引）
+
+        使用共享后端时，记忆在加载后被其他进程修改过则抛出 MemoryConflict
+        """
+        raw = encode_memory(memory)
+        if self.shared is not None:
+            version = self.shared.put_versioned(
+                "memory:" + key,
+                json.dumps(raw, ensure_ascii=False, separators=(",", ":")),
+                self.versions.get(key, 0)
+            )
+            if version is None:
+                self.evict(key)
+                raise MemoryConflict(key)
+            self.versions[key] = version
+        try:
+            size = self._write_file(self.path(key), raw)
+            for path in (self.cold_path(key), *self.legacy_paths(key)):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._cache(key, memory)
+            self._set_index(key, self._index_entry(memory, size, TIER_WARM, time.time()))
+            self.flush_index()
+            return True
+        except Exception as e:
+            print(f"保存记忆失败: {str(e)}")
+            return False
+
+    def delete(self, key: str) -> bool:
+        """删除记忆（所有层级），返回是否存在过"""
+        if self.shared is not None:
+            self.shared.delete_versioned("memory:" + key)
+            self.versions.pop(key, None)
+        return self._delete_local(key)
+
+    def _delete_local(self, key: str) -> bool:
+        self.evict(key)
+        existed = False
+        for path in (self.path(key), self.cold_path(key), *self.legacy_paths(key)):
+            if os.path.exists(path):
+                os.remove(path)
+                existed = True
+        self._set_index(key, None)
+        self.flush_index(force=True)
+        return existed
+
+    def exists(self, key: str) -> bool:
+        with self.index_lock:
+            self.load_index()
+            return key in self.hot or key in self.index
+
+    def evict(self, key: str) -> None:
+        """从内存缓存中移除"""
+        with self.hot_lock:
+            cached = self.hot.pop(key, None)
+            if cached is not None:
+                self.hot_bytes -= cached[2]
+
+    def evict_hot(self, max_bytes: int, idle_seconds: float, keep: Optional[set] = None) -> int:
+        """淘汰空闲超时或超出内存预算的热数据，返回淘汰数量"""
+        keep = keep or set()
+        now = time.time()
+        evicted = 0
+        with self.hot_lock:
+            items = list(self.hot.items())
+        for key, (_, last_access, _) in items:
+            if key in keep:
+                continue
+            if now - last_access >= idle_seconds or self.hot_bytes > max_bytes:
+                self.evict(key)
+                evicted += 1
+        return evicted
+
+    def keys(self) -> List[str]:
+        """列出所有记忆键（包括冷数据），来自索引，不扫描目录"""
+        with self.index_lock:
+            self.load_index()
+            return sorted(set(self.index) | set(self.hot))
+
+    def recent_keys(self, limit: int) -> List[str]:
+        """最近活跃的 limit 个记忆键（按索引中的最后活动时间）"""
+        with self.index_lock:
+            self.load_index()
+            entries = [(entry.get("last_activity", 0), key) for key, entry in self.index.items()]
+        return [key for _, key in heapq.nlargest(limit, entries)]
+
+    def disk_usage(self) -> Dict[str, int]:
+        """统计各层级的磁盘占用（字节），来自索引"""
+        usage = {TIER_WARM: 0, TIER_COLD: 0}
+        with self.index_lock:
+            self.load_index()
+            for entry in self.index.values():
+                usage[entry["tier"]] += entry["size"]
+        return usage
+
+    # ---------- 压缩归档 ----------
+
+    def compress(self, key: str) -> int:
+        """将温数据压缩为冷数据，返回节省的字节数；热数据不压缩"""
+        if key in self.hot:
+            return 0
+        path = self.path(key)
+        if not os.path.exists(path):
+            return 0
+        cold_path = self.cold_path(key)
+        os.makedirs(os.path.dirname(cold_path), exist_ok=True)
+        size = os.path.getsize(path)
+        tmp_path = cold_path + ".tmp"
+        with open(path, "rb") as src, gzip.open(tmp_path, "wb") as dst:
+            dst.write(src.read())
+        os.replace(tmp_path, cold_path)
+        os.remove(path)
+        cold_size = os.path.getsize(cold_path)
+        with self.index_lock:
+            self.load_index()
+            entry = self.index.get(key)
+            if entry is not None:
+                entry["size"] = cold_size
+                entry["tier"] = TIER_COLD
+                self.index_dirty = True
+        return size - cold_size
+
+    def compression_candidates(self, cold_after_seconds: float, disk_budget: int) -> List[str]:
+        """选出需要压缩的温数据：空闲超过阈值的，以及超出磁盘预算时按最久未活跃补充的"""
+        now = time.time()
+        with self.index_lock:
+            self.load_index()
+            files = sorted(
+                ((key, entry["last_activity"], entry["size"]) for key, entry in self.index.items() if entry["tier"] == TIER_WARM),
+                key=lambda item: item[1]
+            )
+            total = sum(entry["size"] for entry in self.index.values())
+        candidates = [key for key, last_activity, _ in files if now - last_activity >= cold_after_seconds and key not in self.hot]
+        if total > disk_budget:
+            # 超出预算：按最近活跃时间从旧到新继续压缩（压缩率按约1/4估算）
+            chosen = set(candidates)
+            for key, _, size in files:
+                if total <= disk_budget:
+                    break
+                if key in self.hot:
+                    continue
+                if key not in chosen:
+                    candidates.append(key)
+                    chosen.add(key)
+                total -= size * 3 // 4
+        return candidates
+
+    # ---------- 旧版目录迁移 ----------
+
+    def legacy_keys(self) -> List[str]:
+        """旧版平铺目录中尚未迁移的记忆键"""
+        keys = set()
+        for base, suffix in ((self.memory_dir, ".json"), (self.cold_dir, ".json.gz")):
+            for prefix in ("user", "group"):
+                dir_path = os.path.join(base, prefix + "s")
+                if not os.path.isdir(dir_path):
+                    continue
+                with os.scandir(dir_path) as it:
+                    for item in it:
+                        if item.is_file() and item.name.endswith(suffix):
+                            keys.add(f"{prefix}_{item.name[:-len(suffix)]}")
+        return sorted(keys)
+
+    def migrate_key(self, key: str) -> bool:
+        """将单个记忆从旧版平铺目录移动到分片目录，返回是否有文件被移动
+
+        分片目录中已存在同一记忆时保留较新的文件
+        """
+        moved = False
+        for legacy, target in zip(self.legacy_paths(key), (self.path(key), self.cold_path(key))):
+            if not os.path.exists(legacy):
+                continue
+            if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(legacy):
+                os.remove(legacy)
+            else:
+                self._move(legacy, target)
+            moved = True
+        # 同时存在温数据和冷数据时以温数据为准
+        if os.path.exists(self.path(key)) and os.path.exists(self.cold_path(key)):
+            os.remove(self.cold_path(key))
+        return moved
@@ -0,0 +1,227 @@
+import os
+import json
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 内存中保留的消息数
+MAX_MEMORY_ENTRIES = 5000
+# 磁盘中保留的消息数，文件行数超过两倍时压缩
+MAX_DISK_ENTRIES = 100000
+# 累计该条数后批量追加到磁盘
+FLUSH_BATCH = 32
+# 单条消息保存的最大字数
+MAX_TEXT_LENGTH = 200
+
+class MessageIndex:
+    """消息ID索引：message_id -> {sender, qq, text, time}
+
+    用于解析用户回复/引用的消息。最近的消息保存在内存中（LRU），
+    同时批量追加到 messages.jsonl，内存中只保留每条消息在文件中的偏移量
+    """
+
+    def __init__(self, index_dir: str, max_memory: int = MAX_MEMORY_ENTRIES, max_disk: int = MAX_DISK_ENTRIES):
+        self.index_dir = index_dir
+        self.path = os.path.join(index_dir, "messages.jsonl")
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.offsets: "OrderedDict[str, int]" = OrderedDict()
+        self.pending: List[Dict[str, Any]] = []
+        self.loaded = False
+        self.disk_lines = 0
+        # 查询来源统计：memory/disk/event/api/miss
+        self.stats: Counter = Counter()
+        self.lock = threading.Lock()
+        # 追加写入文件时持有，不持有 lock，写入期间不阻塞 add/get
+        self.write_lock = threading.Lock()
+        self.compacting = False
+        # 设置后由该函数在后台执行批量写入（如提交到磁盘线程池），add 不在调用方线程中写文件
+        self.background: Optional[Callable[[Callable[[], None]], Any]] = None
+
+    def _load_offsets(self) -> None:
+        """首次访问时读取磁盘文件中每条消息的偏移量"""
+        if self.loaded:
+            return
+        self.loaded = True
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                offset = 0
+                for line in f:
+                    try:
+                        message_id = json.loads(line)["id"]
+                        self.offsets[message_id] = offset
+                        self.offsets.move_to_end(message_id)
+                    except Exception:
+                        pass
+                    offset += len(line)
+                    self.disk_lines += 1
+        except Exception as e:
+            print(f"加载消息索引失败: {str(e)}")
+
+    def add(self, message_id: Any, sender: str, qq: str, text: str, timestamp: float) -> Optional[Dict[str, Any]]:
+        """记录一条消息，返回保存的记录"""
+        if message_id is None:
+            return None
+        record = {
+            "id": str(message_id),
+            "sender": sender,
+            "qq": str(qq),
+            "text": text[:MAX_TEXT_LENGTH],
+            "time": timestamp
+        }
+        with self.lock:
+            self.entries[record["id"]] = record
+            self.entries.move_to_end(record["id"])
+            while len(self.entries) > self.max_memory:
+                self.entries.popitem(last=False)
+            self.pending.append(record)
+            should_flush = len(self.pending) >= FLUSH_BATCH
+        if should_flush:
+            if self.background is not None:
+                self.background(self.flush)
+            else:
+                self.flush()
+        return record
+
+    def flush(self) -> None:
+        """将待写入的消息追加到磁盘，文件过大时压缩"""
+        with self.write_lock:
+            with self.lock:
+                if not self.pending:
+                    return
+                self._load_offsets()
+                pending, self.pending = self.pending, []
+            # 追加写入时不持有索引锁（写入中的消息仍在内存LRU中，查询不受影响）
+            written = []
+            try:
+                os.makedirs(self.index_dir, exist_ok=True)
+                with open(self.path, "ab") as f:
+                    for record in pending:
+                        written.append((record["id"], f.tell()))
+                        f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+            except Exception as e:
+                print(f"写入消息索引失败: {str(e)}")
+            with self.lock:
+                for message_id, offset in written:
+                    self.offsets[message_id] = offset
+                    self.offsets.move_to_end(message_id)
+                self.disk_lines += len(written)
+                while len(self.offsets) > self.max_disk:
+                    self.offsets.popitem(last=False)
+                snapshot = None
+                if self.disk_lines > self.max_disk * 2 and not self.compacting and os.path.exists(self.path):
+                    self.compacting = True
+                    snapshot = list(self.offsets.items())
+                    end = os.path.getsize(self.path)
+        # 压缩不持有写入锁，期间其他批次可以继续追加到旧文件
+        if snapshot is not None:
+            try:
+                self._compact(snapshot, end)
+            except Exception as e:
+                print(f"压缩消息索引失败: {str(e)}")
+            finally:
+                with self.lock:
+                    self.compacting = False
+
+    def _compact(self, snapshot: List[Tuple[str, int]], end: int) -> None:
+        """只保留 snapshot 中的消息（最近 max_disk 条）重写文件
+
+        新文件在锁外写入，期间查询照常读取旧文件、追加照常写入旧文件；
+        替换时才持有写入锁和索引锁：补上旧文件中 end 之后追加的消息，丢弃期间已被淘汰的消息，再替换文件和偏移量
+        """
+        tmp_path = self.path + ".tmp"
+        offsets: "OrderedDict[str, int]" = OrderedDict()
+        with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+            for _, offset in snapshot:
+                src.seek(offset)
+                line = src.readline()
+                try:
+                    offsets[json.loads(line)["id"]] = dst.tell()
+                except Exception:
+                    continue
+                dst.write(line)
+        with self.write_lock, self.lock:
+            with open(self.path, "rb") as src:
+                src.seek(end)
+                appended = src.readlines()
+            with open(tmp_path, "ab") as dst:
+                for line in appended:
+                    try:
+                        message_id = json.loads(line)["id"]
+                    except Exception:
+                        continue
+                    offsets[message_id] = dst.tell()
+                    offsets.move_to_end(message_id)
+                    dst.write(line)
+            os.replace(tmp_path, self.path)
+            self.offsets = OrderedDict(
+                (message_id, offset) for message_id, offset in offsets.items() if message_id in self.offsets
+            )
+            self.disk_lines = len(self.offsets)
+
+    def get(self, message_id: Any) -> Optional[Dict[str, Any]]:
+        """查询消息，依次查找内存和磁盘，结果计入命中统计"""
+        key = str(message_id)
+        with self.lock:
+            record = self.entries.get(key)
+            if record is not None:
+                self.entries.move_to_end(key)
+                self.stats["memory"] += 1
+                return record
+            for record in reversed(self.pending):
+                if record["id"] == key:
+                    self.stats["memory"] += 1
+                    return record
+            self._load_offsets()
+            offset = self.offsets.get(key)
+            if offset is None:
+                return None
+            try:
+                with open(self.path, "rb") as f:
+                    f.seek(offset)
+                    record = json.loads(f.readline())
+            except Exception:
+                return None
+            # 重新放回内存
+            self.entries[key] = record
+            while len(self.entries) > self.max_memory:
+                self.entries.popitem(last=False)
+            self.stats["disk"] += 1
+            return record
+
+    def record_source(self, source: str) -> None:
+        """记录索引外的查询来源（event：适配器已附带的引用消息，api：get_msg，miss：未找到）"""
+        with self.lock:
+            self.stats[source] += 1
+
+    def hit_rates(self) -> Dict[str, Any]:
+        """各来源的查询次数及索引命中率"""
+        with self.lock:
+            total = sum(self.stats.values())
+            hits = self.stats["memory"] + self.stats["disk"]
+            return {
+                "total": total,
+                "memory": self.stats["memory"],
+                "disk": self.stats["disk"],
+                "event": self.stats["event"],
+                "api": self.stats["api"],
+                "miss": self.stats["miss"],
+                "hit_rate": hits / total if total else 0.0,
+                "cached": len(self.entries),
+                "on_disk": len(self.offsets)
+            }
+
+# 全局消息索引实例
+message_index = None
+
+def get_message_index(data_dir: str = None) -> MessageIndex:
+    """获取消息索引实例（单例模式）"""
+    global message_index
+    if message_index is None:
+        from .config import config_manager
+        actual_data_dir = data_dir or config_manager.get_data_dir()
+        message_index = MessageIndex(os.path.join(actual_data_dir, "message_index"))
+    return message_index
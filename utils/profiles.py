@@ -0,0 +1,78 @@
+import re
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# 总结结果中用户画像部分的标记
+PROFILE_MARKER = "【用户画像】"
+# 单个画像的最大字数
+MAX_PROFILE_CHARS = 150
+# 每个群最多保留的画像数（按更新时间保留最新的）
+MAX_PROFILES = 200
+
+PROFILE_LINE_PATTERN = re.compile(r"^\s*[-*]?\s*(?:用户)?\[?(\d{5,12})(?:[:：][^\]]*)?\]?\s*[:：]\s*(.+)$")
+
+def profile_prompt(existing: Dict[str, str]) -> str:
+    """要求总结时同时维护用户画像的提示词，existing为参与本次对话的用户的已有画像"""
+    lines = [
+        f"在总结之后另起一行输出“{PROFILE_MARKER}”，然后为本次聊天记录中发言的每个用户各写一行画像，格式为“QQ号: 画像”。",
+        f"画像只记录该用户的偏好、身份、长期事实等稳定信息，每人不超过{MAX_PROFILE_CHARS // 2}字；没有新信息时沿用已有画像。"
+    ]
+    if existing:
+        lines.append("已有画像：")
+        lines.extend(f"{qq}: {text}" for qq, text in existing.items())
+    return "\n".join(lines)
+
+def split_profiles(text: str) -> Tuple[str, Dict[str, str]]:
+    """从总结结果中拆分出总结正文和用户画像 {QQ号: 画像}"""
+    if PROFILE_MARKER not in text:
+        return text.strip(), {}
+    summary, _, profile_text = text.partition(PROFILE_MARKER)
+    profiles = {}
+    for line in profile_text.splitlines():
+        match = PROFILE_LINE_PATTERN.match(line)
+        if match:
+            profiles[match.group(1)] = match.group(2).strip()[:MAX_PROFILE_CHARS]
+    return summary.strip(), profiles
+
+def merge_profiles(stored: Dict[str, List[Any]], updates: Dict[str, str]) -> Dict[str, List[Any]]:
+    """合并新画像，stored格式为 {QQ号: [画像, 更新时间]}，超出上限时丢弃最久未更新的"""
+    merged = dict(stored)
+    now = time.time()
+    for qq, text in updates.items():
+        merged[qq] = [text, now]
+    if len(merged) > MAX_PROFILES:
+        newest = sorted(merged.items(), key=lambda item: item[1][1], reverse=True)[:MAX_PROFILES]
+        merged = dict(newest)
+    return merged
+
+def get_profile(stored: Dict[str, List[Any]], qq: Optional[str]) -> str:
+    """读取用户画像文本"""
+    if not qq or qq not in stored:
+        return ""
+    return stored[qq][0]
+
+def select_focus_entries(
+    history: List[Any],
+    speaker_pid: Optional[int],
+    ai_pid: int,
+    mention_names: Set[str],
+    limit: int,
+    context_lines: int = 3
+) -> List[Any]:
+    """挑选与提问用户相关的历史记录：该用户的发言、AI的发言、@或提到该用户的发言，
+    另外保留最近 context_lines 条记录以保持对话连贯；返回按时间顺序排列的条目"""
+    tail_start = max(len(history) - context_lines, 0)
+    selected = []
+    for index in range(len(history) - 1, -1, -1):
+        if len(selected) >= limit:
+            break
+        entry = history[index]
+        if (
+            index >= tail_start
+            or entry.pid == speaker_pid
+            or entry.pid == ai_pid
+            or any(name and f"@{name}" in entry.content for name in mention_names)
+        ):
+            selected.append(entry)
+    selected.reverse()
+    return selected
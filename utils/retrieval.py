@@ -0,0 +1,358 @@
+import os
+import re
+import json
+import math
+import heapq
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Tuple
+
+# 英文单词和数字
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+# 连续的中日韩文字
+CJK_RUN_PATTERN = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 出现在超过该比例文档中的词区分度很低，查询时跳过以减少倒排表遍历
+MAX_DF_RATIO = 0.1
+
+def tokenize(text: str) -> List[str]:
+    """分词：英文按单词切分，中日韩文字按相邻两字（bigram）切分"""
+    text = text.lower()
+    tokens = WORD_PATTERN.findall(text)
+    for run in CJK_RUN_PATTERN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+class RetrievalIndex:
+    """单个记忆键的归档消息检索索引（BM25倒排索引）
+
+    目录结构：
+        messages.jsonl      归档的消息，每行一条，行号即文档ID
+        seg_<起始ID>.json   索引段，每次归档追加一个新段，压缩时合并为一个段
+    """
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self.messages_path = os.path.join(index_dir, "messages.jsonl")
+        self.segments: List[Dict] = []
+        self.doc_count = 0
+        self.total_length = 0
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def _segment_files(self) -> List[str]:
+        if not os.path.isdir(self.index_dir):
+            return []
+        names = [name for name in os.listdir(self.index_dir) if name.startswith("seg_") and name.endswith(".json")]
+        return sorted(names, key=lambda name: int(name[4:-5]))
+
+    def load(self) -> None:
+        """从磁盘加载所有索引段"""
+        if self.loaded:
+            return
+        self.segments = []
+        for name in self._segment_files():
+            try:
+                with open(os.path.join(self.index_dir, name), "r", encoding="utf-8") as f:
+                    self.segments.append(json.load(f))
+            except Exception as e:
+                print(f"加载检索索引段失败 {name}: {str(e)}")
+        self.doc_count = sum(len(seg["lengths"]) for seg in self.segments)
+        self.total_length = sum(sum(seg["lengths"]) for seg in self.segments)
+        self.loaded = True
+
+    @staticmethod
+    def _build_segment(base: int, docs: List[Tuple[int, str]]) -> Dict:
+        """为一批文档构建索引段，docs为(文件偏移, 文本)列表"""
+        postings: Dict[str, List[int]] = {}
+        lengths = []
+        offsets = []
+        for i, (offset, text) in enumerate(docs):
+            terms = tokenize(text)
+            lengths.append(len(terms))
+            offsets.append(offset)
+            for term, tf in Counter(terms).items():
+                postings.setdefault(term, []).extend((base + i, tf))
+        return {"base": base, "lengths": lengths, "offsets": offsets, "postings": postings}
+
+    def _write_segment(self, segment: Dict) -> None:
+        # 先写临时文件再替换，中途失败时原有段仍然可用
+        path = os.path.join(self.index_dir, f"seg_{segment['base']}.json")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(segment, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def _merge(self, segments: List[Dict]) -> Dict:
+        """合并相邻的索引段，写入新段后删除被合并的旧段文件"""
+        merged: Dict[str, List[int]] = {}
+        lengths = []
+        offsets = []
+        for seg in segments:
+            lengths.extend(seg["lengths"])
+            offsets.extend(seg["offsets"])
+            for term, plist in seg["postings"].items():
+                merged.setdefault(term, []).extend(plist)
+        segment = {"base": segments[0]["base"], "lengths": lengths, "offsets": offsets, "postings": merged}
+        self._write_segment(segment)
+        for seg in segments[1:]:
+            path = os.path.join(self.index_dir, f"seg_{seg['base']}.json")
+            if os.path.exists(path):
+                os.remove(path)
+        return segment
+
+    def add(self, entries: List[Dict]) -> int:
+        """归档消息并为其建立索引段，返回新增的文档数
+        
+        新段写入后，若前一个段不大于新段则两者合并（类似二进制计数），
+        段数保持在对数级别，查询时无需遍历大量小段
+        """
+        if not entries:
+            return 0
+        with self.lock:
+            self.load()
+            os.makedirs(self.index_dir, exist_ok=True)
+            docs = []
+            with open(self.messages_path, "ab") as f:
+                for entry in entries:
+                    record = {"role": entry["role"], "content": entry["content"], "timestamp": entry.get("timestamp", 0)}
+                    offset = f.tell()
+                    f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                    docs.append((offset, entry["content"]))
+            segment = self._build_segment(self.doc_count, docs)
+            self.doc_count += len(docs)
+            self.total_length += sum(segment["lengths"])
+            while self.segments and len(self.segments[-1]["lengths"]) <= len(segment["lengths"]):
+                segment = self._merge([self.segments.pop(), segment])
+            if len(segment["lengths"]) == len(docs):
+                self._write_segment(segment)
+            self.segments.append(segment)
+            return len(docs)
+
+    def compact(self) -> int:
+        """将所有索引段合并为一个段，返回合并前的段数"""
+        with self.lock:
+            self.load()
+            count = len(self.segments)
+            if count > 1:
+                self.segments = [self._merge(self.segments)]
+            return count
+
+    def rebuild(self) -> int:
+        """根据归档消息文件重建索引（单个段），返回文档数"""
+        with self.lock:
+            docs = []
+            if os.path.exists(self.messages_path):
+                with open(self.messages_path, "rb") as f:
+                    offset = 0
+                    for line in f:
+                        try:
+                            docs.append((offset, json.loads(line)["content"]))
+                        except Exception:
+                            # 损坏的行保留占位，保证文档ID与行号一致
+                            docs.append((offset, ""))
+                        offset += len(line)
+            for name in self._segment_files():
+                os.remove(os.path.join(self.index_dir, name))
+            segment = self._build_segment(0, docs)
+            if docs:
+                self._write_segment(segment)
+            self.segments = [segment] if docs else []
+            self.doc_count = len(docs)
+            self.total_length = sum(segment["lengths"])
+            self.loaded = True
+            return len(docs)
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[float, int]]:
+        """BM25检索，返回按得分降序排列的(得分, 文档ID)列表"""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self.lock:
+            self.load()
+            if not self.doc_count:
+                return []
+            avg_length = self.total_length / self.doc_count or 1
+            term_postings = []
+            for term in terms:
+                matched = [(seg, seg["postings"][term]) for seg in self.segments if term in seg["postings"]]
+                df = sum(len(plist) for _, plist in matched) // 2
+                if df:
+                    term_postings.append((df, matched))
+            # 跳过过于常见的词，但至少保留区分度最高的一个
+            term_postings.sort(key=lambda item: item[0])
+            max_df = max(self.doc_count * MAX_DF_RATIO, term_postings[0][0]) if term_postings else 0
+            scores: Dict[int, float] = {}
+            for df, matched in term_postings:
+                if df > max_df:
+                    break
+                idf = math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+                for seg, plist in matched:
+                    base = seg["base"]
+                    lengths = seg["lengths"]
+                    for i in range(0, len(plist), 2):
+                        doc_id, tf = plist[i], plist[i + 1]
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[doc_id - base] / avg_length)
+                        scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+            return heapq.nlargest(top_k, ((score, doc_id) for doc_id, score in scores.items()))
+
+    def get_documents(self, doc_ids: List[int]) -> List[Dict]:
+        """按文档ID读取归档消息，每条消息带有文档ID（id 字段），读取失败的消息跳过"""
+        with self.lock:
+            self.load()
+            offsets = []
+            for doc_id in doc_ids:
+                for seg in self.segments:
+                    if seg["base"] <= doc_id < seg["base"] + len(seg["offsets"]):
+                        offsets.append((doc_id, seg["offsets"][doc_id - seg["base"]]))
+                        break
+            results = []
+            if not offsets:
+                return results
+            with open(self.messages_path, "rb") as f:
+                for doc_id, offset in offsets:
+                    f.seek(offset)
+                    try:
+                        results.append({**json.loads(f.readline()), "id": doc_id})
+                    except Exception:
+                        continue
+            return results
+
+    def stats(self) -> Dict[str, int]:
+        """索引统计信息"""
+        with self.lock:
+            self.load()
+            return {
+                "documents": self.doc_count,
+                "segments": len(self.segments),
+                "terms": len(set().union(*(seg["postings"].keys() for seg in self.segments))) if self.segments else 0
+            }
+
+class RetrievalStore:
+    """按记忆键管理检索索引，按最近使用顺序缓存已加载的索引
+
+    加载后的索引（倒排表为Python列表）每条文档约占 2KB 内存（tools/benchmark.py retrieval 中的短消息），整个索引常驻内存；
+    缓存最多 max_cached 个索引，且已加载索引的文档总数不超过 max_cached_docs，超出时淘汰最久未使用的索引。
+    正在执行操作的索引和最近使用的一个索引不淘汰（单个超大索引可以超过该上限），
+    因此同一记忆键在任何时候只有一个索引对象，对它的读写都由该对象的锁串行化
+    """
+
+    def __init__(self, base_dir: str, max_cached: int = 32, max_cached_docs: int = 50000):
+        self.base_dir = base_dir
+        self.max_cached = max_cached
+        self.max_cached_docs = max_cached_docs
+        self._indexes: "OrderedDict[str, RetrievalIndex]" = OrderedDict()
+        # 记忆键 -> 正在使用该索引的操作数
+        self._in_use: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _acquire(self, key: str) -> RetrievalIndex:
+        """取出（必要时创建）该键的索引并标记为使用中，用完后必须调用 _release"""
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = RetrievalIndex(os.path.join(self.base_dir, key))
+                self._indexes[key] = index
+            else:
+                self._indexes.move_to_end(key)
+            self._in_use[key] += 1
+            self._evict()
+            return index
+
+    def _release(self, key: str) -> None:
+        """操作结束，索引的文档数可能已增加，重新检查缓存上限"""
+        with self._lock:
+            self._in_use[key] -= 1
+            if not self._in_use[key]:
+                del self._in_use[key]
+            self._evict()
+
+    def _evict(self) -> None:
+        """按最久未使用的顺序淘汰空闲的索引，直到数量和文档总数都不超过上限（文档数按已加载的索引计，调用方持有 _lock）"""
+        count = len(self._indexes)
+        cached_docs = sum(index.doc_count for index in self._indexes.values())
+        # 最近使用的索引不参与淘汰
+        for key in list(self._indexes)[:-1]:
+            if count <= self.max_cached and cached_docs <= self.max_cached_docs:
+                break
+            if key in self._in_use:
+                continue
+            cached_docs -= self._indexes.pop(key).doc_count
+            count -= 1
+
+    def cache_stats(self) -> Dict[str, int]:
+        """缓存的索引数和其中已加载的文档总数"""
+        with self._lock:
+            return {
+                "indexes": len(self._indexes),
+                "documents": sum(index.doc_count for index in self._indexes.values())
+            }
+
+    def has_archive(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.base_dir, key, "messages.jsonl"))
+
+    def list_keys(self) -> List[str]:
+        if not os.path.isdir(self.base_dir):
+            return []
+        return [name for name in os.listdir(self.base_dir) if self.has_archive(name)]
+
+    # 以下方法以记忆键为第一个参数，便于在分片工作进程中按键调用（见 utils/shard_pool.py）
+
+    def add(self, key: str, entries: List[Dict]) -> int:
+        index = self._acquire(key)
+        try:
+            return index.add(entries)
+        finally:
+            self._release(key)
+
+    def stats(self, key: str) -> Dict[str, int]:
+        index = self._acquire(key)
+        try:
+            return index.stats()
+        finally:
+            self._release(key)
+
+    def rebuild(self, key: str) -> int:
+        index = self._acquire(key)
+        try:
+            return index.rebuild()
+        finally:
+            self._release(key)
+
+    def compact(self, key: str) -> int:
+        index = self._acquire(key)
+        try:
+            return index.compact()
+        finally:
+            self._release(key)
+
+    def preload(self, key: str) -> bool:
+        """有归档时加载该键的索引段，避免首次检索时读取磁盘"""
+        if not self.has_archive(key):
+            return False
+        index = self._acquire(key)
+        try:
+            with index.lock:
+                index.load()
+        finally:
+            self._release(key)
+        return True
+
+    def search(self, key: str, query: str, top_k: int = 5) -> List[Dict]:
+        """检索与查询最相关的归档消息，按得分降序返回，每条消息带有 score 字段"""
+        if not self.has_archive(key):
+            return []
+        index = self._acquire(key)
+        try:
+            hits = index.search(query, top_k)
+            docs = index.get_documents([doc_id for _, doc_id in hits])
+        finally:
+            self._release(key)
+        scores = {doc_id: score for score, doc_id in hits}
+        return [{**doc, "score": scores[doc["id"]]} for doc in docs]
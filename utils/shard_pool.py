@@ -0,0 +1,219 @@
+import os
+import sys
+import types
+import asyncio
+import runpy
+import importlib
+import itertools
+import multiprocessing
+import threading
+import zlib
+from multiprocessing.connection import wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 工作进程中加载 utils 目录使用的包名（不导入插件本身，见 ShardPool._start）
+WORKER_PACKAGE = "_shard_utils"
+
+def shard_of(key: str, shards: int) -> int:
+    """记忆键所属的分片（与记忆锁的分段使用同一种哈希）"""
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+def _load_factory(utils_dir: str, module: str, name: str) -> Callable[..., Any]:
+    """在工作进程中把 utils 目录作为独立的包加载，返回其中的工厂（类或函数）"""
+    package = types.ModuleType(WORKER_PACKAGE)
+    package.__path__ = [utils_dir]
+    sys.modules[WORKER_PACKAGE] = package
+    return getattr(importlib.import_module(f"{WORKER_PACKAGE}.{module}"), name)
+
+def _worker_main(factory: Callable[..., Any], factory_args: Tuple, requests: Any, results: Any) -> None:
+    """工作进程：创建本分片的状态对象，按到达顺序依次执行请求，结果写入本进程的结果管道"""
+    state = factory(*factory_args)
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, method, args = request
+        try:
+            result = (request_id, getattr(state, method)(*args), None)
+        except Exception as e:
+            result = (request_id, None, f"{type(e).__name__}: {e}")
+        try:
+            results.send(result)
+        except Exception as e:
+            results.send((request_id, None, f"{type(e).__name__}: {e}"))
+
+class ShardPool:
+    """按记忆键哈希分片的工作进程池
+
+    每个工作进程持有 factory(*factory_args) 创建的状态对象（如本分片的检索索引缓存），
+    同一记忆键的请求总是发往同一个进程并按提交顺序执行，因此同一聊天的写入和读取保持顺序；
+    每个进程通过自己的结果管道返回结果，由后台线程交给事件循环。
+
+    工作进程以 spawn 方式启动（插件进程中已有磁盘读写、日志、配置监视等线程，fork 可能复制被持有的锁而死锁），
+    只加载 utils 目录，factory 必须定义在 utils 目录的模块中。
+    工作进程意外退出时其结果管道关闭，发往该进程的请求立即以异常结束，下次提交时重启；
+    每个请求最多等待 timeout 秒（进程卡住未退出时）
+    """
+
+    def __init__(self, workers: int, factory: Callable[..., Any], factory_args: Tuple = (), timeout: float = 30):
+        self.workers = workers
+        self.factory_args = factory_args
+        self.timeout = timeout
+        package, _, module = factory.__module__.rpartition(".")
+        if package != __name__.rpartition(".")[0]:
+            raise ValueError(f"分片工作进程的工厂必须定义在 utils 目录中: {factory.__module__}.{factory.__qualname__}")
+        self.factory_ref = (os.path.dirname(os.path.abspath(__file__)), module, factory.__qualname__)
+        self.context = multiprocessing.get_context("spawn")
+        self.queues: List[Any] = []
+        self.processes: List[Any] = []
+        # 结果管道的读取端 -> 写入该管道的进程
+        self.connections: Dict[Any, Any] = {}
+        # 新进程启动或关闭时唤醒结果读取线程
+        self.wakeup_reader, self.wakeup_writer = self.context.Pipe(duplex=False)
+        # 请求ID -> (分片, Future, 处理该请求的进程)
+        self.pending: Dict[int, Tuple[int, asyncio.Future, Any]] = {}
+        self.request_ids = itertools.count()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.reader: Optional[threading.Thread] = None
+        self.closing = False
+        self.lock = threading.Lock()
+        # 各分片已提交/已完成的请求数
+        self.submitted = [0] * workers
+        self.completed = [0] * workers
+        for shard in range(workers):
+            self.queues.append(self.context.Queue())
+            self.processes.append(self._start(shard))
+
+    def _start(self, shard: int) -> Any:
+        results, results_writer = self.context.Pipe(duplex=False)
+        # 进程入口为 runpy.run_path 执行本文件：spawn 启动的进程按模块名导入入口函数，
+        # 直接使用 _worker_main 会在工作进程中导入整个插件
+        process = self.context.Process(
+            target=runpy.run_path,
+            args=(
+                os.path.abspath(__file__),
+                {
+                    "worker_args": (self.factory_ref, self.factory_args, self.queues[shard], results_writer)
+                },
+                "__shard_worker__"
+            ),
+            name=f"shard-worker-{shard}",
+            daemon=True
+        )
+        process.start()
+        # 只有工作进程持有写入端，进程退出后读取端读到EOF
+        results_writer.close()
+        with self.lock:
+            self.connections[results] = process
+        self.wakeup_writer.send(None)
+        return process
+
+    def _read_results(self) -> None:
+        """结果读取线程：把各工作进程的结果交给事件循环，进程退出（管道EOF）时让其未完成的请求失败"""
+        while not self.closing:
+            with self.lock:
+                connections = list(self.connections)
+            for connection in wait(connections + [self.wakeup_reader]):
+                if connection is self.wakeup_reader:
+                    self.wakeup_reader.recv()
+                    continue
+                try:
+                    request_id, result, error = connection.recv()
+                except (EOFError, OSError):
+                    with self.lock:
+                        process = self.connections.pop(connection)
+                    connection.close()
+                    self._fail_pending(process)
+                    continue
+                with self.lock:
+                    entry = self.pending.pop(request_id, None)
+                if entry is None:
+                    continue
+                shard, future, _ = entry
+                self.completed[shard] += 1
+                self.loop.call_soon_threadsafe(self._resolve, future, result, error)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: Any, error: Optional[str]) -> None:
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(result)
+
+    def _fail_pending(self, process: Any) -> None:
+        """发往已退出的工作进程的请求以异常结束（进程在下次提交到该分片时重启）"""
+        process.join(1)
+        with self.lock:
+            lost = [request_id for request_id, entry in self.pending.items() if entry[2] is process]
+            entries = [self.pending.pop(request_id) for request_id in lost]
+        for shard, future, _ in entries:
+            self.completed[shard] += 1
+            self.loop.call_soon_threadsafe(self._resolve, future, None, f"分片工作进程已退出（退出码 {process.exitcode}）")
+
+    def _ensure_alive(self, shard: int) -> None:
+        """工作进程意外退出时重启"""
+        if self.processes[shard].is_alive():
+            return
+        print(f"分片工作进程 {shard} 已退出（退出码 {self.processes[shard].exitcode}），正在重启")
+        self.queues[shard] = self.context.Queue()
+        self.processes[shard] = self._start(shard)
+
+    def _submit(self, key: str, method: str, *args: Any) -> Tuple[int, asyncio.Future]:
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.reader = threading.Thread(target=self._read_results, name="shard-results", daemon=True)
+            self.reader.start()
+        shard = shard_of(key, self.workers)
+        self._ensure_alive(shard)
+        future = self.loop.create_future()
+        request_id = next(self.request_ids)
+        with self.lock:
+            self.pending[request_id] = (shard, future, self.processes[shard])
+        self.submitted[shard] += 1
+        self.queues[shard].put((request_id, method, args))
+        return request_id, future
+
+    def submit(self, key: str, method: str, *args: Any) -> asyncio.Future:
+        """把请求发往 key 所属的工作进程，返回在事件循环中等待结果的 Future"""
+        return self._submit(key, method, *args)[1]
+
+    async def call(self, key: str, method: str, *args: Any) -> Any:
+        """发送请求并等待结果，超过 timeout 秒时抛出 asyncio.TimeoutError（工作进程中的请求仍会执行完）"""
+        request_id, future = self._submit(key, method, *args)
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            with self.lock:
+                entry = self.pending.pop(request_id, None)
+            if entry is not None:
+                self.completed[entry[0]] += 1
+            raise
+
+    def stats(self) -> List[Dict[str, int]]:
+        """各分片的请求数和排队中的请求数"""
+        return [
+            {
+                "shard": shard,
+                "alive": self.processes[shard].is_alive(),
+                "submitted": self.submitted[shard],
+                "queued": self.submitted[shard] - self.completed[shard]
+            }
+            for shard in range(self.workers)
+        ]
+
+    def close(self, timeout: float = 5) -> None:
+        """通知工作进程处理完已提交的请求后退出"""
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.closing = True
+        self.wakeup_writer.send(None)
+
+if __name__ == "__shard_worker__":
+    factory_ref, factory_args, requests, results = worker_args
+    _worker_main(_load_factory(*factory_ref), factory_args, requests, results)
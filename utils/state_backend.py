@@ -0,0 +1,276 @@
+import os
+import abc
+import json
+import time
+import socket
+import asyncio
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+# 本进程的标识，用于租约的持有者
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+class StateBackend(abc.ABC):
+    """多个机器人进程之间共享的状态
+
+    - 带版本号的键值（记忆）：写入时检查版本号，被其他进程先写入时失败（乐观并发）
+    - 共享配置：按文件名发布配置，各进程拉取版本号更新的配置
+    - 令牌桶：全局QPS与每个用户的冷却时间
+    - 租约：同一聊天同时只有一个进程执行总结
+
+    shared 为 False 的实现（LocalBackend）只在本进程内有效，记忆和配置仍使用本地文件
+    """
+
+    shared = False
+
+    async def call(self, method: str, *args: Any) -> Any:
+        """在事件循环中调用后端方法：共享后端的每次调用都有一次网络往返，在线程中执行，不阻塞其他聊天"""
+        if self.shared:
+            return await asyncio.to_thread(getattr(self, method), *args)
+        return getattr(self, method)(*args)
+
+    @abc.abstractmethod
+    def get_version(self, key: str) -> int:
+        """键当前的版本号，不存在时为0"""
+
+    @abc.abstractmethod
+    def get_versioned(self, key: str) -> Tuple[Optional[str], int]:
+        """读取 (数据, 版本号)，不存在时为 (None, 0)"""
+
+    @abc.abstractmethod
+    def put_versioned(self, key: str, data: str, expected_version: int) -> Optional[int]:
+        """当前版本号等于 expected_version 时写入并返回新版本号，否则返回None"""
+
+    @abc.abstractmethod
+    def delete_versioned(self, key: str) -> None:
+        """删除键（不检查版本号）"""
+
+    @abc.abstractmethod
+    def publish_config(self, filename: str, config: Dict[str, Any]) -> int:
+        """发布配置，返回新的配置版本号"""
+
+    @abc.abstractmethod
+    def fetch_configs(self, known: Dict[str, int]) -> Dict[str, Tuple[int, Dict[str, Any]]]:
+        """返回版本号比 known 中记录的更新的配置 {文件名: (版本号, 配置)}"""
+
+    @abc.abstractmethod
+    def reserve_token(self, bucket: str, rate: float, capacity: float) -> float:
+        """从令牌桶预订一个令牌，返回需要等待的秒数（0为立即可用）
+
+        令牌不足时也会预订（令牌数记为负数），并发的请求按预订顺序依次等待
+        """
+
+    @abc.abstractmethod
+    def acquire_lease(self, name: str, ttl: float, owner: str = WORKER_ID) -> bool:
+        """获取或续期租约，已被其他持有者占用时返回False"""
+
+    @abc.abstractmethod
+    def release_lease(self, name: str, owner: str = WORKER_ID) -> None:
+        """释放自己持有的租约"""
+
+class LocalBackend(StateBackend):
+    """单进程部署使用的本地实现"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values: Dict[str, Tuple[str, int]] = {}
+        self.configs: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+        # 令牌桶名 -> (令牌数, 上次更新时间, 每秒补充数, 容量)
+        self.buckets: Dict[str, Tuple[float, float, float, float]] = {}
+        # 租约名 -> (持有者, 到期时间)
+        self.leases: Dict[str, Tuple[str, float]] = {}
+
+    def get_version(self, key: str) -> int:
+        return self.values.get(key, (None, 0))[1]
+
+    def get_versioned(self, key: str) -> Tuple[Optional[str], int]:
+        return self.values.get(key, (None, 0))
+
+    def put_versioned(self, key: str, data: str, expected_version: int) -> Optional[int]:
+        with self.lock:
+            version = self.get_version(key)
+            if version != expected_version:
+                return None
+            self.values[key] = (data, version + 1)
+            return version + 1
+
+    def delete_versioned(self, key: str) -> None:
+        with self.lock:
+            self.values.pop(key, None)
+
+    def publish_config(self, filename: str, config: Dict[str, Any]) -> int:
+        with self.lock:
+            version = self.configs.get(filename, (0, None))[0] + 1
+            self.configs[filename] = (version, config)
+            return version
+
+    def fetch_configs(self, known: Dict[str, int]) -> Dict[str, Tuple[int, Dict[str, Any]]]:
+        return {
+            filename: entry
+            for filename, entry in list(self.configs.items())
+            if entry[0] > known.get(filename, 0)
+        }
+
+    def reserve_token(self, bucket: str, rate: float, capacity: float) -> float:
+        with self.lock:
+            now = time.monotonic()
+            tokens, updated = self.buckets.get(bucket, (capacity, now))[:2]
+            tokens = min(capacity, tokens + (now - updated) * rate) - 1
+            self.buckets[bucket] = (tokens, now, rate, capacity)
+            if len(self.buckets) > 10000:
+                # 清理已回满的令牌桶（与新建的桶等价）
+                self.buckets = {
+                    name: entry for name, entry in self.buckets.items()
+                    if entry[0] + (now - entry[1]) * entry[2] < entry[3]
+                }
+            return 0.0 if tokens >= 0 else -tokens / rate
+
+    def acquire_lease(self, name: str, ttl: float, owner: str = WORKER_ID) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            holder = self.leases.get(name)
+            if holder is not None and holder[0] != owner and holder[1] > now:
+                return False
+            self.leases[name] = (owner, now + ttl)
+            return True
+
+    def release_lease(self, name: str, owner: str = WORKER_ID) -> None:
+        with self.lock:
+            holder = self.leases.get(name)
+            if holder is not None and holder[0] == owner:
+                del self.leases[name]
+
+# 带版本号写入：版本号不符时返回-1
+PUT_VERSIONED_SCRIPT = """
+local version = tonumber(redis.call('HGET', KEYS[1], 'v') or '0')
+if version ~= tonumber(ARGV[2]) then
+    return -1
+end
+redis.call('HSET', KEYS[1], 'v', version + 1, 'data', ARGV[1])
+return version + 1
+"""
+
+# 令牌桶：使用Redis服务器时间，避免各主机时钟不一致；返回需要等待的秒数（字符串）
+RESERVE_TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate) - 1
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+"""
+
+# 租约：未被占用或由自己持有时（续期）设置
+ACQUIRE_LEASE_SCRIPT = """
+local holder = redis.call('GET', KEYS[1])
+if holder and holder ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class RedisBackend(StateBackend):
+    """基于Redis（或兼容Redis协议的服务）的共享实现，多个进程/主机指向同一个服务即可共享状态
+
+    client 为 redis-py 风格的客户端（需支持 Lua 脚本），所有键都带 prefix 前缀
+    """
+
+    shared = True
+
+    def __init__(self, client: Any, prefix: str = "kirya:"):
+        self.client = client
+        self.prefix = prefix
+        self.put_script = client.register_script(PUT_VERSIONED_SCRIPT)
+        self.token_script = client.register_script(RESERVE_TOKEN_SCRIPT)
+        self.acquire_script = client.register_script(ACQUIRE_LEASE_SCRIPT)
+        self.release_script = client.register_script(RELEASE_LEASE_SCRIPT)
+        self.config_versions_key = prefix + "config:versions"
+        self.config_data_key = prefix + "config:data"
+
+    @classmethod
+    def from_url(cls, url: str, prefix: str = "kirya:") -> "RedisBackend":
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("使用 redis 状态后端需要先安装 redis：pip install redis")
+        return cls(redis.Redis.from_url(url, decode_responses=True), prefix)
+
+    def get_version(self, key: str) -> int:
+        return int(self.client.hget(self.prefix + key, "v") or 0)
+
+    def get_versioned(self, key: str) -> Tuple[Optional[str], int]:
+        version, data = self.client.hmget(self.prefix + key, ["v", "data"])
+        return data, int(version or 0)
+
+    def put_versioned(self, key: str, data: str, expected_version: int) -> Optional[int]:
+        version = int(self.put_script(keys=[self.prefix + key], args=[data, expected_version]))
+        return version if version >= 0 else None
+
+    def delete_versioned(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+    def publish_config(self, filename: str, config: Dict[str, Any]) -> int:
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hincrby(self.config_versions_key, filename, 1)
+        pipe.hset(self.config_data_key, filename, json.dumps(config, ensure_ascii=False))
+        return int(pipe.execute()[0])
+
+    def fetch_configs(self, known: Dict[str, int]) -> Dict[str, Tuple[int, Dict[str, Any]]]:
+        versions = {name: int(version) for name, version in self.client.hgetall(self.config_versions_key).items()}
+        changed = [name for name, version in versions.items() if version > known.get(name, 0)]
+        if not changed:
+            return {}
+        result = {}
+        for name, data in zip(changed, self.client.hmget(self.config_data_key, changed)):
+            if data is not None:
+                result[name] = (versions[name], json.loads(data))
+        return result
+
+    def reserve_token(self, bucket: str, rate: float, capacity: float) -> float:
+        return float(self.token_script(keys=[self.prefix + "bucket:" + bucket], args=[rate, capacity]))
+
+    def acquire_lease(self, name: str, ttl: float, owner: str = WORKER_ID) -> bool:
+        return bool(self.acquire_script(keys=[self.prefix + "lease:" + name], args=[owner, int(ttl * 1000)]))
+
+    def release_lease(self, name: str, owner: str = WORKER_ID) -> None:
+        self.release_script(keys=[self.prefix + "lease:" + name], args=[owner])
+
+# 全局状态后端实例
+state_backend = None
+
+def get_state_backend() -> StateBackend:
+    """获取状态后端（单例模式），按 config.json 的 state_backend 配置创建，连接失败时使用本地实现"""
+    global state_backend
+    if state_backend is None:
+        from .config import config_manager
+        options = config_manager.get_value("config.json", "state_backend", {}) or {}
+        backend_type = options.get("type", "local")
+        if backend_type == "redis":
+            try:
+                backend = RedisBackend.from_url(options.get("url", "redis://localhost:6379/0"), options.get("prefix", "kirya:"))
+                backend.client.ping()
+                print(f"已连接共享状态后端 {options.get('url')}（进程 {WORKER_ID}）")
+                state_backend = backend
+            except Exception as e:
+                print(f"连接共享状态后端失败，使用本地状态（多个进程同时运行时记忆和限流不再共享）: {str(e)}")
+        elif backend_type != "local":
+            print(f"未知的状态后端类型 {backend_type}，使用本地状态")
+        if state_backend is None:
+            state_backend = LocalBackend()
+    return state_backend
@@ -0,0 +1,218 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+# 任务状态
+STATE_PENDING = "pending"
+STATE_RUNNING = "running"
+STATE_FAILED = "failed"
+STATE_DONE = "done"
+
+class SummaryJob:
+    """后台总结任务"""
+
+    __slots__ = ("key", "params", "created_at", "last_touch", "immediate", "not_before")
+
+    def __init__(self, key: str, params: Dict[str, Any], immediate: bool = False, not_before: float = 0):
+        self.key = key
+        self.params = params
+        self.created_at = time.time()
+        self.last_touch = self.created_at
+        self.immediate = immediate
+        self.not_before = not_before  # 重试退避期间不执行
+
+class SummaryStatus:
+    """单个记忆键的总结任务状态"""
+
+    __slots__ = ("state", "attempts", "failures", "last_error", "last_success", "next_retry_at")
+
+    def __init__(self):
+        self.state = STATE_PENDING
+        self.attempts = 0  # 连续失败次数
+        self.failures = 0  # 累计失败次数
+        self.last_error = ""
+        self.last_success = 0.0
+        self.next_retry_at = 0.0
+
+class SummaryWorker:
+    """后台总结工作池
+
+    - 同一记忆键最多只有一个待执行任务（重复提交只刷新参数和活跃时间）
+    - 同时执行的任务数受 concurrency 限制
+    - 任务优先在聊天空闲 idle_seconds 秒后执行，最多等待 max_delay 秒
+    - 任务失败后按指数退避重试，超过 max_retries 次后暂停到退避结束
+    - 退出时 stop 等待执行中的任务，未完成的任务由 export_jobs 导出，下次启动时重新提交
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[str, Dict[str, Any]], Awaitable[None]],
+        concurrency: int = 2,
+        idle_seconds: float = 10,
+        max_delay: float = 120,
+        poll_interval: float = 1.0,
+        max_retries: int = 3,
+        retry_base: float = 30,
+        retry_max: float = 3600
+    ):
+        self.runner = runner
+        self.concurrency = concurrency
+        self.idle_seconds = idle_seconds
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.pending: Dict[str, SummaryJob] = {}
+        self.running: Set[str] = set()
+        self.status: Dict[str, SummaryStatus] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        # 执行中的任务，停止时等待其完成
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.stopping = False
+
+    def submit(self, key: str, params: Dict[str, Any], immediate: bool = False) -> bool:
+        """提交总结任务，返回是否新建了任务（已有同键任务时视为去重）"""
+        if self.stopping:
+            return False
+        job = self.pending.get(key)
+        if job is not None:
+            job.params = params
+            job.last_touch = time.time()
+            job.immediate = job.immediate or immediate
+            created = False
+        else:
+            status = self.status.get(key)
+            # 处于失败退避期的键，新任务要等退避结束后才执行
+            not_before = status.next_retry_at if status and status.state == STATE_FAILED else 0
+            self.pending[key] = SummaryJob(key, params, immediate, not_before)
+            created = True
+        status = self._get_status(key)
+        if key not in self.running and status.state != STATE_FAILED:
+            status.state = STATE_PENDING
+        self._ensure_started()
+        return created
+
+    def touch(self, key: str) -> None:
+        """记录聊天活跃，推迟该键待执行的任务"""
+        job = self.pending.get(key)
+        if job is not None:
+            job.last_touch = time.time()
+
+    def is_busy(self, key: str) -> bool:
+        """该键是否有待执行或执行中的任务"""
+        return key in self.pending or key in self.running
+
+    def get_status(self, key: str) -> Optional[SummaryStatus]:
+        """获取指定键的任务状态，没有记录时返回None"""
+        return self.status.get(key)
+
+    def _get_status(self, key: str) -> SummaryStatus:
+        if key not in self.status:
+            self.status[key] = SummaryStatus()
+        return self.status[key]
+
+    def _retry_delay(self, attempts: int) -> float:
+        return min(self.retry_base * (2 ** (attempts - 1)), self.retry_max)
+
+    def export_jobs(self) -> List[Dict[str, Any]]:
+        """待执行和执行中（未完成）的任务，用于退出时保存、下次启动时恢复
+
+        只保存记忆键和执行方式，请求参数（含函数）在恢复时重新获取
+        """
+        jobs = [
+            {"key": job.key, "immediate": job.immediate, "ignore_interval": bool(job.params.get("ignore_interval"))}
+            for job in self.pending.values()
+        ]
+        jobs.extend(
+            {"key": key, "immediate": True, "ignore_interval": False}
+            for key in self.running if key not in self.pending
+        )
+        return jobs
+
+    async def stop(self, timeout: float) -> List[Dict[str, Any]]:
+        """停止执行新任务，最多等待 timeout 秒让执行中的任务完成，超时的任务被取消
+
+        返回未完成的任务（见 export_jobs）
+        """
+        self.stopping = True
+        if self._task is not None:
+            self._task.cancel()
+        if self.tasks:
+            _, unfinished = await asyncio.wait(list(self.tasks.values()), timeout=timeout)
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                await asyncio.wait(unfinished)
+        return self.export_jobs()
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+        else:
+            self._wakeup.set()
+
+    def _is_ready(self, job: SummaryJob, now: float) -> bool:
+        if job.key in self.running or now < job.not_before:
+            return False
+        if job.immediate:
+            return True
+        return now - job.last_touch >= self.idle_seconds or now - job.created_at >= self.max_delay
+
+    async def _loop(self) -> None:
+        while self.pending or self.running:
+            now = time.time()
+            ready = sorted(
+                (job for job in self.pending.values() if self._is_ready(job, now)),
+                key=lambda job: job.created_at
+            )
+            for job in ready:
+                if len(self.running) >= self.concurrency:
+                    break
+                del self.pending[job.key]
+                self.running.add(job.key)
+                self._get_status(job.key).state = STATE_RUNNING
+                self.tasks[job.key] = asyncio.get_running_loop().create_task(self._run(job))
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, job: SummaryJob) -> None:
+        status = self._get_status(job.key)
+        try:
+            await self.runner(job.key, job.params)
+            status.state = STATE_DONE
+            status.attempts = 0
+            status.last_error = ""
+            status.last_success = time.time()
+            status.next_retry_at = 0.0
+        except asyncio.CancelledError:
+            # 退出时被取消：放回待执行队列，由 export_jobs 保存
+            self.pending.setdefault(job.key, job)
+            raise
+        except Exception as e:
+            status.state = STATE_FAILED
+            status.attempts += 1
+            status.failures += 1
+            status.last_error = str(e)
+            delay = self._retry_delay(status.attempts)
+            status.next_retry_at = time.time() + (delay if status.attempts <= self.max_retries else self.retry_max)
+            print(f"后台总结任务失败 [{job.key}]（第{status.attempts}次）: {str(e)}")
+            if status.attempts <= self.max_retries and job.key not in self.pending:
+                # 按退避时间重新排队，期间的重复提交会合并到该任务
+                self.pending[job.key] = SummaryJob(job.key, job.params, job.immediate, status.next_retry_at)
+        finally:
+            self.running.discard(job.key)
+            self.tasks.pop(job.key, None)
+            next_job = self.pending.get(job.key)
+            if next_job is not None:
+                next_job.not_before = max(next_job.not_before, status.next_retry_at)
+                if status.state == STATE_DONE:
+                    status.state = STATE_PENDING
+            if self._wakeup is not None:
+                self._wakeup.set()
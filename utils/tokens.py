@@ -0,0 +1,53 @@
+import re
+from typing import Any
+
+# 中日韩文字及全角符号，大致每个字符计为一个token
+CJK_PATTERN = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+# 非中日韩文本大约每4个字符一个token
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """本地估算文本的token数（不依赖具体模型的分词器）"""
+    if not text:
+        return 0
+    cjk_count = len(CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def entry_tokens(entry: Any) -> int:
+    """获取历史记录条目内容的token数，结果缓存在条目的tokens字段中"""
+    if entry.tokens is None:
+        entry.tokens = estimate_tokens(entry.content)
+    return entry.tokens
+
+def truncate_to_tokens(text: str, max_tokens: int, suffix: str = "…") -> str:
+    """从头保留文本，截断到不超过max_tokens个token"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 二分查找能放下的最长前缀
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) + estimate_tokens(suffix) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + suffix if low > 0 else ""
+
+def truncate_tail_to_tokens(text: str, max_tokens: int, prefix: str = "…") -> str:
+    """从尾部保留文本，截断到不超过max_tokens个token"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[-mid:]) + estimate_tokens(prefix) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return prefix + text[-low:] if low > 0 else ""